@@ -1,28 +1,114 @@
 #!/usr/bin/env python
 #coding=utf-8
 
+import sys
+import time
 
-import tornado.httpserver
-import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.options
 
 from tornado.options import define, options 
 
-from bootornado import Application
-
 define("cmd", default='run', 
-        metavar="run",
-        help=("Default use runserver"))
+        metavar="run|startup-profile|build-static",
+        help=("Default use runserver. startup-profile reports the time and "
+              "memory each module takes to import. build-static bundles and "
+              "fingerprints the static files for prod"))
 define("port", default=9000, help="default: 9000, required runserver", type=int)
+define("env", default='dev', metavar="dev|prod",
+        help="prod caches and precompiles the templates, dev reloads everything")
+define("template_cache", default=None,
+        help="where prod keeps the compiled templates across restarts, a directory "
+             "private to the user running the server")
+define("workers", default=0, type=int,
+        help="worker processes, default: one per CPU. dev always runs a single process")
+define("reuseport", default=False, type=bool,
+        help="each worker binds its own SO_REUSEPORT socket and the kernel balances them")
+define("watchdog", default=0, type=float,
+        help="log the stack of any callback blocking the IOLoop longer than this many seconds, "
+             "default: 0, disabled")
+define("metrics_allow", default=[], multiple=True,
+        help="addresses allowed to read /admin/metrics, default: none. Behind a proxy "
+             "every request comes from the proxy's address")
+define("metrics_token", default=None,
+        help="bearer token allowing to read /admin/metrics from anywhere")
+
+def maxrss():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def startup_profile(limit=30):
+    """Build the application as `run` does, timing every module imported
+    on the way"""
+    import __builtin__
+    original_import = __builtin__.__import__
+    stats = {} # module -> [cumulative seconds, self seconds, peak RSS growth]
+    nested = [] # time spent in the imports nested in each pending import
+
+    def timed_import(name, *args, **kwargs):
+        # only the first import of a module costs anything
+        if name in sys.modules:
+            return original_import(name, *args, **kwargs)
+        nested.append(0.0)
+        rss, start = maxrss(), time.time()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            inner = nested.pop()
+            if nested:
+                nested[-1] += elapsed
+            entry = stats.setdefault(name, [0.0, 0.0, 0])
+            entry[0] += elapsed
+            entry[1] += elapsed - inner
+            entry[2] += maxrss() - rss
+
+    rss, start = maxrss(), time.time()
+    __builtin__.__import__ = timed_import
+    try:
+        from bootornado import Application
+        imported = time.time()
+        Application(options.env, options.template_cache)
+    finally:
+        __builtin__.__import__ = original_import
+    built = time.time()
+
+    print '%10s %10s %10s  %s' % ('cumulative', 'self', 'peak rss', 'module')
+    for name, (cumulative, own, growth) in sorted(stats.items(), key=lambda item: -item[1][0])[:limit]:
+        print '%8.1fms %8.1fms %8dKB  %s' % (cumulative * 1000, own * 1000, growth, name)
+    print
+    print 'imports %.1fms, application %.1fms, peak RSS %dKB (+%dKB)' % (
+        (imported - start) * 1000, (built - imported) * 1000, maxrss(), maxrss() - rss)
 
 def main():
     tornado.options.parse_command_line()
 
     if options.cmd == 'run':
+        from bootornado import Application
+        import bootornado.server
+
         print 'server started. port %s' % options.port
-        http_server = tornado.httpserver.HTTPServer(Application())
-        http_server.listen(options.port)
-        tornado.ioloop.IOLoop.instance().start()
+        # built before forking, so the workers share the compiled templates
+        application = Application(options.env, options.template_cache)
+        if options.watchdog:
+            application.settings['watchdog'] = options.watchdog
+        application.settings['metrics_allow'] = options.metrics_allow
+        application.settings['metrics_token'] = options.metrics_token
+        workers = options.workers or tornado.process.cpu_count()
+        if application.settings.get('debug'):
+            # the autoreloader and the debugger need a single process
+            bootornado.server.serve(application, tornado.netutil.bind_sockets(options.port))
+        else:
+            bootornado.server.Master(application, options.port, workers, options.reuseport).run()
+
+    elif options.cmd == 'startup-profile':
+        startup_profile()
+
+    elif options.cmd == 'build-static':
+        from bootornado import Application, assets
+        manifest = assets.build(Application().settings)
+        print 'built %d static files' % len(manifest)
 
     else:
         print 'error cmd param: python app.py --help'
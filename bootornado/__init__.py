@@ -16,23 +16,49 @@ from tornado.web import url
 from tornado_utils.routes import route
 
 import bootornado.session
+from sessions.cache import UserinfoCache
 from bootornado import uimodules
+from bootornado import uimethods
+from bootornado import templating
+from bootornado import assets
+from bootornado import staticfiles
+from bootornado.compression import CompressionTransform
+from bootornado.pagecache import PageCache
+from bootornado.metrics import Registry
+from bootornado.routing import CompiledRoutingMixin
 
-import bootornado.views
-
-class Application(tornado.web.Application):
-    def __init__(self):
+class Application(CompiledRoutingMixin, tornado.web.Application):
+    """env is "dev" (debug, templates recompiled on every request) or
+    "prod" (templates precompiled at boot and cached, compiled code kept in
+    template_cache_path across restarts)"""
+    def __init__(self, env='dev', template_cache_path=None):
+        # the views register their routes when imported; importing them here
+        # keeps `import bootornado` cheap for tools that don't serve
+        import bootornado.views
         handlers = route.get_routes()
+        debug = env != 'prod'
 
         settings = dict(
             title         = "bootornado",
             template_path = os.path.join(os.path.dirname(__file__),"templates"),
             static_path   = os.path.join(os.path.dirname(__file__),"static"),
             login_url     = '/auth/login',
-            debug         = True,
+            debug         = debug,
+            compiled_template_cache = not debug,
             ui_modules    = uimodules,
+            ui_methods    = uimethods,
+            static_handler_class = staticfiles.StaticFileHandler,
+            static_bundles = assets.BUNDLES,
             autoescape    = None,
-            cookie_secret = "bootornado"
+            cookie_secret = "bootornado",
+            request_timeout = 30,
+            # seconds a callback may block the IOLoop before the watchdog
+            # logs its stack, 0 disables it
+            watchdog      = 0,
+            compression   = {
+                'level': 6,
+                'min_length': 1024
+            }
         )
         settings['session'] = {
             'engine': 'redis',
@@ -41,6 +67,36 @@ class Application(tornado.web.Application):
                 'port': 6379,
                 'db_sessions': 10,
                 'db_notifications': 11
-            }
+            },
+            'userinfo_cache': {
+                'maxsize': 10000,
+                'ttl': 30
+            },
+            'timeout': 0.5,
+            'breaker': {
+                'threshold': 5,
+                'reset_timeout': 10
+            },
+            'degraded': 'cached'
+        }
+        settings['page_cache'] = {
+            'engine': 'memory',
+            'maxsize': 1000
         }
-        tornado.web.Application.__init__(self, handlers, **settings)
\ No newline at end of file
+        if not debug:
+            # compiled code is loaded from there: not in the shared temp dir
+            settings['template_cache_path'] = template_cache_path or \
+                os.path.join(os.path.dirname(__file__), 'cache', 'templates')
+        transforms = [
+            CompressionTransform.configure(**settings['compression']),
+            tornado.web.ChunkedTransferEncoding
+        ]
+        tornado.web.Application.__init__(self, handlers, transforms=transforms, **settings)
+        self.userinfo_cache = UserinfoCache.from_settings(settings['session'])
+        self.page_cache = PageCache.from_settings(settings['page_cache'])
+        self.metrics = Registry()
+        # the metrics are kept under the route names given to @route
+        self.route_names = dict((spec.handler_class, name)
+                                for name, spec in self.named_handlers.iteritems())
+        if not debug:
+            templating.precompile(self.settings)
\ No newline at end of file
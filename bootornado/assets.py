@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    assets: build-time bundling and fingerprinting of the static files
+
+    `python app.py --cmd=build-static` concatenates and minifies the bundles
+    listed in the `static_bundles` setting, inlines the small images their
+    CSS refers to as data URIs, and writes everything under
+    `static_path/build` with its content hash in its name. Every other
+    static file gets its hash computed once too. The results go to
+    `build/manifest.json`, which `static_url` reads in production instead of
+    hashing the files on the first request of each process.
+"""
+import os
+import re
+import gzip
+import json
+import base64
+import hashlib
+import logging
+import mimetypes
+
+import tornado.web
+
+__all__ = [
+    'BUNDLES', 'build', 'load_manifest', 'minify_css', 'minify_js',
+    'ManifestStaticFileHandler', 'static_bundle',
+]
+
+# bundle name -> the static files it concatenates, in order
+BUNDLES = {
+    'site.css': [
+        'css/jquery/jquery-ui-1.9.2.custom.css',
+        'css/bootstrap/bootstrap.min.css',
+        'css/bootstrap/bootstrap-responsive.min.css',
+        'css/bootornado.css',
+    ],
+    'site.js': [
+        'js/jquery/jquery-1.8.3.min.js',
+        'js/jquery/jquery-ui-1.9.2.custom.min.js',
+    ],
+}
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+# images up to this size are inlined in the CSS referring to them
+INLINE_LIMIT = 2048
+# the built files worth precompressing
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACES = re.compile(r'\s+')
+# a space before ':' may be a descendant combinator, keep it
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*|(:)\s+')
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+# the path of a url, and its query and fragment
+_URL_SUFFIX = re.compile(r'([^?#]*)(.*)')
+
+
+def _hash(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def minify_css(css):
+    """
+        >>> minify_css('a  { color: red; }  /* note */ b,  i { margin: 0 }')
+        'a{color:red}b,i{margin:0}'
+    """
+    css = _CSS_COMMENT.sub('', css)
+    css = _CSS_SPACES.sub(' ', css)
+    css = _CSS_PUNCTUATION.sub(lambda match: match.group(1) or match.group(2), css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js, name=''):
+    """Drops the blank lines, the indentation and the line comments.
+    Already minified files are left alone."""
+    if name.endswith('.min.js'):
+        return js.strip()
+    lines = []
+    for line in js.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+class _Builder(object):
+    def __init__(self, static_path):
+        self.static_path = static_path
+        self.build_path = os.path.join(static_path, BUILD_DIR)
+        self.manifest = {}
+
+    def write(self, name, data):
+        """Write `data` under build/ with its hash in its name, and return
+        its path relative to static_path"""
+        root, ext = os.path.splitext(name)
+        filename = '%s.%s%s' % (root, _hash(data)[:12], ext)
+        path = os.path.join(self.build_path, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        if ext in COMPRESSIBLE:
+            self.compress(path, data)
+        return '%s/%s' % (BUILD_DIR, filename.replace(os.sep, '/'))
+
+    def compress(self, path, data):
+        """Write the .gz variant of `path`, and the .br one when the
+        brotli module is installed, for the static handler to send as is"""
+        with open(path + '.gz', 'wb') as f:
+            # no name nor mtime in the header, the output depends on data only
+            with gzip.GzipFile('', 'wb', 9, f, mtime=0) as gz:
+                gz.write(data)
+        try:
+            import brotli
+        except ImportError:
+            return
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data))
+
+    def rewrite_urls(self, css, source, name):
+        """Inline the small images `source` refers to, and point the
+        others at fingerprinted copies. The references left alone are
+        rebased from `source` to where bundle `name` is written."""
+        directory = os.path.dirname(os.path.join(self.static_path, source))
+        output = os.path.dirname(os.path.join(self.build_path, name))
+
+        def relative(path):
+            return os.path.relpath(path, output).replace(os.sep, '/')
+
+        def replace(match):
+            quote, url = match.groups()
+            if url.startswith(('data:', 'http:', 'https:', '/', '#')):
+                return match.group(0)
+            path, suffix = _URL_SUFFIX.match(url).groups()
+            path = os.path.normpath(os.path.join(directory, path))
+            if not os.path.isfile(path):
+                logging.warning('%s refers to missing %s', source, url)
+                return 'url(%s%s%s%s)' % (quote, relative(path), suffix, quote)
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) <= INLINE_LIMIT:
+                mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                return 'url(data:%s;base64,%s)' % (mime, base64.b64encode(data))
+            copy = self.write(os.path.relpath(path, self.static_path), data)
+            # the content hash replaces the query, a fragment still means something
+            fragment = suffix[suffix.find('#'):] if '#' in suffix else ''
+            return 'url(%s%s%s%s)' % (quote, relative(os.path.join(self.static_path, copy)),
+                                      fragment, quote)
+        return _CSS_URL.sub(replace, css)
+
+    def bundle(self, name, sources):
+        parts = []
+        for source in sources:
+            path = os.path.join(self.static_path, source)
+            if not os.path.isfile(path):
+                logging.warning('bundle %s: missing %s', name, source)
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            if name.endswith('.css'):
+                parts.append(minify_css(self.rewrite_urls(data, source, name)))
+            else:
+                parts.append(minify_js(data, source))
+        separator = '\n' if name.endswith('.css') else ';\n'
+        data = separator.join(parts)
+        self.manifest[name] = self.write(name, data) + '?v=' + _hash(data)[:5]
+        return len(data)
+
+    def fingerprint(self):
+        """Hash the static files once here, not on every process's first
+        request"""
+        for dirpath, dirnames, filenames in os.walk(self.static_path):
+            if os.path.abspath(dirpath) == os.path.abspath(self.build_path):
+                dirnames[:] = []
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    version = _hash(f.read())[:5]
+                name = os.path.relpath(path, self.static_path).replace(os.sep, '/')
+                self.manifest[name] = '%s?v=%s' % (name, version)
+
+
+def build(settings):
+    """Build the bundles of `settings` and the manifest, and return it"""
+    static_path = settings['static_path']
+    builder = _Builder(static_path)
+    builder.fingerprint()
+    for name, sources in sorted(settings.get('static_bundles', BUNDLES).iteritems()):
+        size = builder.bundle(name, sources)
+        logging.info('bundled %s: %d files, %d bytes', name, len(sources), size)
+
+    path = os.path.join(builder.build_path, MANIFEST)
+    if not os.path.isdir(builder.build_path):
+        os.makedirs(builder.build_path)
+    tmp = '%s.%d' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(builder.manifest, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+    return builder.manifest
+
+
+_manifests = {}
+
+def load_manifest(settings):
+    """The manifest of the last build, or None in debug and before any
+    build. Read once per process."""
+    if settings.get('debug'):
+        return None
+    path = os.path.join(settings['static_path'], BUILD_DIR, MANIFEST)
+    if path not in _manifests:
+        try:
+            with open(path) as f:
+                _manifests[path] = json.load(f)
+        except IOError:
+            logging.warning('no static manifest at %s, run app.py --cmd=build-static', path)
+            _manifests[path] = None
+    return _manifests[path]
+
+
+class ManifestStaticFileHandler(tornado.web.StaticFileHandler):
+    """Resolves `static_url` through the build manifest, falling back to
+    hashing the file for the paths it doesn't know"""
+    @classmethod
+    def make_static_url(cls, settings, path):
+        manifest = load_manifest(settings)
+        if manifest and path in manifest:
+            return settings.get('static_url_prefix', '/static/') + manifest[path]
+        return super(ManifestStaticFileHandler, cls).make_static_url(settings, path)
+
+
+def static_bundle(handler, name):
+    """The tags loading bundle `name`: the built file when there's a
+    manifest, its sources one by one otherwise"""
+    if name.endswith('.css'):
+        tag = '<link type="text/css" href="%s" rel="stylesheet" />'
+    else:
+        tag = '<script type="text/javascript" src="%s"></script>'
+    manifest = load_manifest(handler.settings)
+    if manifest and name in manifest:
+        return tag % handler.static_url(name)
+    sources = handler.settings.get('static_bundles', BUNDLES)[name]
+    static_path = handler.settings['static_path']
+    return '\n'.join(tag % handler.static_url(source) for source in sources
+                     if os.path.isfile(os.path.join(static_path, source)))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    compression: gzip output transform with a size threshold
+
+    Unlike Tornado's GZipContentEncoding, the level, the minimum size and the
+    content types come from the `compression` setting, and streamed responses
+    are compressed chunk by chunk as the handler flushes. Responses that
+    already have a Content-Encoding (the precompressed static files) pass
+    through untouched.
+
+    Each compressed response records (bytes in, bytes out, CPU seconds) in
+    `request.compression_stats`, and the totals of the process are kept in
+    `CompressionTransform.totals`.
+"""
+import time
+import zlib
+import logging
+
+import tornado.web
+
+__all__ = ['CompressionTransform', 'accepts_encoding']
+
+CONTENT_TYPES = (
+    "text/plain", "text/html", "text/css", "text/xml", "text/javascript",
+    "application/javascript", "application/x-javascript", "application/json",
+    "application/xml", "application/atom+xml", "application/xhtml+xml",
+    "image/svg+xml",
+)
+
+# statuses that have no body to compress
+_NO_BODY = (204, 304)
+
+
+def accepts_encoding(header, encoding):
+    """Whether the Accept-Encoding `header` accepts `encoding`: named, or
+    covered by "*", with a q-value above 0
+
+        >>> accepts_encoding('gzip;q=0, br', 'gzip'), accepts_encoding('gzip;q=0, br', 'br')
+        (False, True)
+        >>> accepts_encoding('*;q=0.5, br;q=0', 'gzip'), accepts_encoding('*, br;q=0', 'br')
+        (True, False)
+    """
+    qvalues = {}
+    for value in (header or '').split(','):
+        params = value.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        qvalues[name] = 1.0
+        for param in params[1:]:
+            key, _, q = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    qvalues[name] = float(q)
+                except ValueError:
+                    qvalues[name] = 0.0
+    return qvalues.get(encoding, qvalues.get('*', 0.0)) > 0
+
+
+class CompressionTransform(tornado.web.OutputTransform):
+    """Use `CompressionTransform.configure(**settings['compression'])` in
+    the application's transforms"""
+    level = 6
+    min_length = 1024
+    content_types = frozenset(CONTENT_TYPES)
+
+    totals = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu': 0.0}
+
+    @classmethod
+    def configure(cls, level=None, min_length=None, content_types=None):
+        attrs = {}
+        if level is not None:
+            attrs['level'] = level
+        if min_length is not None:
+            attrs['min_length'] = min_length
+        if content_types is not None:
+            attrs['content_types'] = frozenset(content_types)
+        return type(cls.__name__, (cls,), attrs)
+
+    def __init__(self, request):
+        self.request = request
+        self._compressing = accepts_encoding(request.headers.get('Accept-Encoding'), 'gzip')
+        self._compressor = None
+        self._bytes_in = self._bytes_out = 0
+        self._cpu = 0.0
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        ctype = headers.get('Content-Type', '').split(';')[0].strip()
+        if ctype not in self.content_types or 'Content-Encoding' in headers \
+                or status_code in _NO_BODY:
+            self._compressing = False
+            return status_code, headers, chunk
+
+        # the response would have been compressed for another client
+        vary = headers.get('Vary')
+        if not vary:
+            headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            headers['Vary'] = vary + ', Accept-Encoding'
+
+        if finishing:
+            # small enough not to be worth it
+            self._compressing = self._compressing and len(chunk) >= self.min_length
+        else:
+            # streamed: the length is unknown, unless the handler gave it, in
+            # which case the body must stay as is. Unknown lengths need
+            # chunked encoding, so HTTP/1.1.
+            self._compressing = self._compressing and \
+                'Content-Length' not in headers and self.request.supports_http_1_1()
+        if not self._compressing:
+            return status_code, headers, chunk
+
+        headers['Content-Encoding'] = 'gzip'
+        self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        chunk = self.transform_chunk(chunk, finishing)
+        if 'Content-Length' in headers:
+            headers['Content-Length'] = str(len(chunk))
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if not self._compressing:
+            return chunk
+        started = time.clock()
+        data = self._compressor.compress(chunk)
+        if finishing:
+            data += self._compressor.flush()
+        else:
+            # send what the handler flushed now, not when the window is full
+            data += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._cpu += time.clock() - started
+        self._bytes_in += len(chunk)
+        self._bytes_out += len(data)
+        if finishing:
+            self._record()
+        return data
+
+    def _record(self):
+        stats = (self._bytes_in, self._bytes_out, self._cpu)
+        self.request.compression_stats = stats
+        totals = self.totals
+        totals['responses'] += 1
+        totals['bytes_in'] += self._bytes_in
+        totals['bytes_out'] += self._bytes_out
+        totals['cpu'] += self._cpu
+        logging.debug('compressed %s %d -> %d bytes in %.2fms', self.request.uri,
+                      self._bytes_in, self._bytes_out, self._cpu * 1000)
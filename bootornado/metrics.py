@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    metrics: per route request counts and latency histograms
+
+    Every finished request is recorded under the name of its route (the
+    `name` given to @route, or the handler class name): its status, its
+    duration, and how much of it was spent waiting on the session
+    datastore and rendering templates. Latencies go to log-linear
+    histograms, in the manner of HdrHistogram: recording is a few integer
+    operations, memory is a few hundred counters per series, and every
+    quantile is exact to within 1/8.
+
+    The registry is per process. With pre-forked workers, WorkerMetrics
+    publishes each worker's registry to shared memory, so whichever worker
+    answers a scrape exposes the total of them all.
+
+    The watchdog records how late the IOLoop runs its callbacks in
+    `Registry.loop_lag`.
+
+    `Registry.expose()` renders the Prometheus text format; see the
+    admin.metrics route.
+"""
+import os
+import time
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+__all__ = ['Histogram', 'Registry', 'WorkerMetrics']
+
+# Prometheus buckets exported from the histograms, in seconds
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Histogram(object):
+    """Log-linear histogram of integer values: exact below 2**(SUB_BITS+1),
+    then 2**SUB_BITS buckets per power of two.
+
+        >>> h = Histogram()
+        >>> for value in range(1, 1001):
+        ...     h.record(value)
+        >>> h.count, h.total
+        (1000, 500500)
+        >>> 480 <= h.quantile(.5) <= 500
+        True
+        >>> h.count_below(128)
+        127
+    """
+    SUB_BITS = 3
+    SUB = 1 << SUB_BITS
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+
+    def index(self, value):
+        if value < 2 * self.SUB:
+            return value
+        shift = value.bit_length() - self.SUB_BITS - 1
+        return (shift + 1) * self.SUB + (value >> shift) - self.SUB
+
+    def lower_bound(self, index):
+        if index < 2 * self.SUB:
+            return index
+        shift = index // self.SUB - 1
+        return (index % self.SUB + self.SUB) << shift
+
+    def record(self, value):
+        value = max(int(value), 0)
+        index = self.index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        """Adds the values recorded in `other`"""
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q):
+        """The lowest value of the bucket holding the `q` quantile"""
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.lower_bound(index)
+        return 0
+
+    def count_below(self, limit):
+        """How many values were recorded in buckets entirely below `limit`"""
+        total = 0
+        for index, count in enumerate(self.counts):
+            if self.lower_bound(index + 1) > limit:
+                break
+            total += count
+        return total
+
+
+class _Route(object):
+    __slots__ = ('statuses', 'duration', 'session', 'render')
+
+    def __init__(self):
+        self.statuses = {}
+        # microseconds
+        self.duration = Histogram()
+        self.session = Histogram()
+        self.render = Histogram()
+
+
+class Registry(object):
+    """Metrics of the requests served by this process"""
+    def __init__(self):
+        self.routes = {}
+        # microseconds, see bootornado.watchdog
+        self.loop_lag = Histogram()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'routes': self.routes, 'loop_lag': self.loop_lag}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def observe(self, route, status, duration, session=0.0, render=0.0):
+        """Record a request; times are in seconds"""
+        with self.lock:
+            series = self.routes.get(route)
+            if series is None:
+                series = self.routes[route] = _Route()
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.duration.record(duration * 1e6)
+            series.session.record(session * 1e6)
+            series.render.record(render * 1e6)
+
+    def merge(self, other):
+        """Adds the numbers of `other`, the registry of another process"""
+        with self.lock:
+            for route, theirs in other.routes.items():
+                series = self.routes.get(route)
+                if series is None:
+                    series = self.routes[route] = _Route()
+                for status, count in theirs.statuses.items():
+                    series.statuses[status] = series.statuses.get(status, 0) + count
+                series.duration.merge(theirs.duration)
+                series.session.merge(theirs.session)
+                series.render.merge(theirs.render)
+            self.loop_lag.merge(other.loop_lag)
+
+    def expose(self, process=True):
+        """The metrics in the Prometheus text exposition format, labelled
+        with the pid of this process unless `process` is False (the totals
+        of the workers)"""
+        pid = ',pid="%d"' % os.getpid() if process else ''
+        lines = [
+            '# HELP bootornado_requests_total Requests served, by route and status.',
+            '# TYPE bootornado_requests_total counter',
+        ]
+        with self.lock:
+            routes = sorted(self.routes.items())
+            for route, series in routes:
+                for status, count in sorted(series.statuses.items()):
+                    lines.append('bootornado_requests_total{route="%s",status="%d"%s} %d'
+                                 % (route, status, pid, count))
+            for name, attr, help in (
+                    ('request_duration', 'duration', 'Time from request start to finish.'),
+                    ('session', 'session', 'Time spent waiting on the session datastore, per request.'),
+                    ('render', 'render', 'Time spent rendering templates, per request.')):
+                metric = 'bootornado_%s_seconds' % name
+                lines.append('# HELP %s %s' % (metric, help))
+                lines.append('# TYPE %s histogram' % metric)
+                for route, series in routes:
+                    self._histogram(lines, metric, 'route="%s"%s' % (route, pid),
+                                    getattr(series, attr))
+            if self.loop_lag.count:
+                metric = 'bootornado_ioloop_lag_seconds'
+                lines.append('# HELP %s How late the IOLoop ran the watchdog heartbeat.' % metric)
+                lines.append('# TYPE %s histogram' % metric)
+                self._histogram(lines, metric, pid[1:], self.loop_lag)
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, lines, metric, labels, histogram):
+        bucket_labels = labels + ',' if labels else ''
+        for bucket in BUCKETS:
+            lines.append('%s_bucket{%sle="%s"} %d' % (
+                metric, bucket_labels, bucket, histogram.count_below(int(bucket * 1e6))))
+        lines.append('%s_bucket{%sle="+Inf"} %d' % (metric, bucket_labels, histogram.count))
+        lines.append('%s_sum{%s} %.6f' % (metric, labels, histogram.total / 1e6))
+        lines.append('%s_count{%s} %d' % (metric, labels, histogram.count))
+
+
+class WorkerMetrics(object):
+    """The registries of the pre-forked workers of a master, each one
+    published every `interval` seconds to a SharedMemoryStore by its
+    worker, so that whichever worker answers a scrape exposes the total of
+    them all; the numbers of the other workers are at most `interval`
+    seconds old.
+
+    A worker that stopped publishing (it exited, or drains on a reload) is
+    left out after `STALE` intervals. The worker replacing it starts from
+    zero, which Prometheus takes as a counter reset.
+
+    The master creates it before forking; each worker calls `start` with
+    its worker id, and `stop` once it stops serving."""
+    STALE = 5
+
+    def __init__(self, registry, workers, path=None, interval=1.0):
+        from bootornado.session import SharedMemoryStore
+        self.registry = registry
+        self.workers = workers
+        self.interval = interval
+        # one file per master, which keeps its pid across reloads
+        self.path = path or os.path.join(os.path.dirname(__file__), 'cache',
+                                         'metrics-%d.shm' % os.getpid())
+        try:
+            self.store = SharedMemoryStore(self.path, slots=128 * workers, slot_size=4096,
+                                           label='metrics')
+        except ValueError:
+            # sized for another number of workers, before a reload
+            os.unlink(self.path)
+            self.store = SharedMemoryStore(self.path, slots=128 * workers, slot_size=4096,
+                                           label='metrics')
+        self.worker_id = None
+        self.publisher = None
+
+    def start(self, worker_id):
+        import tornado.ioloop
+        self.worker_id = worker_id
+        self.publisher = tornado.ioloop.PeriodicCallback(self.publish, self.interval * 1000)
+        self.publisher.start()
+
+    def stop(self):
+        if self.publisher is not None:
+            self.publisher.stop()
+
+    def publish(self):
+        with self.registry.lock:
+            pickled = pickle.dumps(self.registry, pickle.HIGHEST_PROTOCOL)
+        self.store['worker:%d' % self.worker_id] = (time.time(), pickled)
+
+    def combined(self):
+        """A registry adding up the numbers of all the workers"""
+        total = Registry()
+        total.merge(self.registry)
+        now = time.time()
+        for worker_id in range(self.workers):
+            if worker_id == self.worker_id:
+                continue
+            try:
+                published, pickled = self.store['worker:%d' % worker_id]
+            except KeyError:
+                continue
+            if now - published < self.STALE * self.interval:
+                total.merge(pickle.loads(pickled))
+        return total
+
+    def remove(self):
+        """Deletes the file, once the master is done"""
+        self.store.close()
+        os.unlink(self.path)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    pagecache: full page output cache
+
+        class Post(FrontHandler):
+            @pagecache.cached(ttl=60, stale=300, tags=lambda handler, post_id: ['post:' + post_id])
+            def get(self, post_id):
+                ...
+
+    The rendered response is stored under the route, the path and query
+    arguments, the locale and, with `vary_user`, the session. Without
+    `vary_user` only requests with no session are served from the cache.
+    Requests with flash messages waiting always render.
+
+    An entry is fresh for `ttl` seconds, then stale for `stale` more: the
+    requests get the stale copy right away, and the first one after it
+    went stale has the page rendered again behind it, with a copy of the
+    request whose response goes to the cache only.
+
+    `invalidate(application, 'post:42')` bumps the version of the tag, which
+    drops every entry rendered with it.
+
+    The `page_cache` setting picks the backend: "memory" (per process,
+    holding `maxsize` pages) or "shm" (a bootornado.session.SharedMemoryStore
+    shared by the workers of the host, so an invalidation reaches all of
+    them, sized by its `slots` and `slot_size`). The shm file goes to
+    `path`, by default in the private cache directory of the package, and
+    an entry nobody read for `ttl` seconds (a day by default) is dropped:
+    it has to be more than the `ttl` and `stale` of the pages.
+"""
+import os
+import time
+import hashlib
+import logging
+import functools
+
+import tornado.ioloop
+import tornado.httputil
+import tornado.httpserver
+
+from bootornado.utils import TTLCache
+
+__all__ = ['cached', 'invalidate', 'PageCache', 'PageCacheMixIn']
+
+# headers of a response that are not replayed from the cache
+_UNCACHED_HEADERS = ('Server', 'Date', 'Set-Cookie', 'Content-Length', 'Etag', 'X-Cache')
+
+# headers of a request that are not passed to its background refresh
+_REFRESH_DROPPED_HEADERS = ('If-None-Match', 'If-Modified-Since', 'Range', 'If-Range')
+
+DEFAULT_SHM_PATH = os.path.join(os.path.dirname(__file__), 'cache', 'pages.shm')
+
+
+class PageCache(object):
+    """Entries and tag versions, in a dict-like backend"""
+    # a refresh not done after this long is assumed dead
+    REFRESH_TIMEOUT = 30
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.refreshing = {} # key -> when this process started refreshing it
+
+    @classmethod
+    def from_settings(cls, settings):
+        settings = dict(settings or {})
+        engine = settings.pop('engine', 'memory')
+        maxsize = settings.pop('maxsize', 1000)
+        if engine == 'shm':
+            from bootornado.session import SharedMemoryStore
+            # the pages are unpickled: the store keeps them in a private directory
+            path = settings.pop('path', None) or DEFAULT_SHM_PATH
+            ttl = settings.pop('ttl', 24 * 3600)
+            return cls(SharedMemoryStore(path, ttl=ttl, label='page', **settings))
+        if engine != 'memory':
+            raise ValueError('unknown page cache engine %r' % engine)
+        return cls(TTLCache(maxsize))
+
+    def _get(self, key):
+        try:
+            return self.storage[key]
+        except KeyError:
+            return None
+
+    def tag_versions(self, tags):
+        return dict((tag, self._get('tag:' + tag) or 0) for tag in tags)
+
+    def invalidate(self, *tags):
+        # the workers sharing the storage may bump the same tag at once
+        for tag in tags:
+            self.storage.update('tag:' + tag, lambda version: (version or 0) + 1)
+
+    def get(self, key):
+        """The entry and whether it's fresh, or (None, False) when there's
+        none usable"""
+        entry = self._get('page:' + key)
+        if entry is None:
+            return None, False
+        now = time.time()
+        if now > entry['stale_until'] or self.tag_versions(entry['tags']) != entry['tags']:
+            return None, False
+        return entry, now <= entry['expires']
+
+    def set(self, key, entry):
+        self.storage['page:' + key] = entry
+        self.refreshing.pop(key, None)
+
+    def start_refresh(self, key):
+        """Whether the caller should render the stale `key` again"""
+        started = self.refreshing.get(key)
+        if started and time.time() - started < self.REFRESH_TIMEOUT:
+            return False
+        self.refreshing[key] = time.time()
+        return True
+
+
+def invalidate(application, *tags):
+    application.page_cache.invalidate(*tags)
+
+
+class _Discarded(object):
+    """Connection of a background refresh: the response goes nowhere"""
+    xheaders = False
+
+    def __init__(self):
+        self.stream = self
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write(self, chunk, callback=None):
+        if callback:
+            callback()
+
+    def finish(self):
+        pass
+
+
+def refresh(application, request):
+    """Serves a copy of `request` whose response only goes to the cache"""
+    headers = tornado.httputil.HTTPHeaders()
+    for name, value in request.headers.get_all():
+        if name not in _REFRESH_DROPPED_HEADERS:
+            headers.add(name, value)
+    copy = tornado.httpserver.HTTPRequest(
+        'GET', request.uri, request.version, headers, remote_ip=request.remote_ip,
+        protocol=request.protocol, host=request.host, connection=_Discarded())
+    copy.page_cache_refresh = True
+    application(copy)
+
+
+def cached(ttl=60, stale=0, tags=(), vary_user=False):
+    """Decorates a handler's `get`. `tags` is a list of strings or a
+    function of the handler and the method arguments returning one."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self.application, 'page_cache', None)
+            session_id = self.session.session_id
+            if cache is None or self.request.method not in ('GET', 'HEAD') or \
+                    self.has_flashed_messages() or (session_id and not vary_user):
+                return method(self, *args, **kwargs)
+
+            key = hashlib.sha1(repr((
+                self.__class__.__module__, self.__class__.__name__,
+                self.request.path, sorted(self.request.arguments.items()),
+                self.locale.code, session_id if vary_user else None,
+            ))).hexdigest()
+            entry, fresh = cache.get(key)
+            if entry is not None and not getattr(self.request, 'page_cache_refresh', False):
+                if not fresh and cache.start_refresh(key):
+                    tornado.ioloop.IOLoop.instance().add_callback(
+                        functools.partial(refresh, self.application, self.request))
+                self.set_status(entry['status'])
+                for name, value in entry['headers']:
+                    self.set_header(name, value)
+                self.set_header('X-Cache', 'HIT' if fresh else 'STALE')
+                self.finish(entry['body'])
+                return
+
+            entry_tags = tags(self, *args, **kwargs) if callable(tags) else tags
+            self._page_cache = (cache, key, ttl, stale, cache.tag_versions(entry_tags))
+            self.set_header('X-Cache', 'MISS')
+            return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class PageCacheMixIn(object):
+    """Stores the response of the handlers decorated with `cached` when
+    they finish. Responses that were flushed early, set cookies or aren't
+    200 are not stored."""
+    def flush(self, *args, **kwargs):
+        self._page_cache = None
+        return super(PageCacheMixIn, self).flush(*args, **kwargs)
+
+    def finish(self, chunk=None):
+        pending = getattr(self, '_page_cache', None)
+        if pending and self._status_code == 200 and not hasattr(self, '_new_cookie'):
+            cache, key, ttl, stale, tag_versions = pending
+            if chunk is not None:
+                self.write(chunk)
+                chunk = None
+            now = time.time()
+            try:
+                cache.set(key, {
+                    'status': self._status_code,
+                    'headers': [(name, value) for name, value in self._headers.iteritems()
+                                if name not in _UNCACHED_HEADERS],
+                    'body': ''.join(self._write_buffer),
+                    'tags': tag_versions,
+                    'expires': now + ttl,
+                    'stale_until': now + ttl + stale,
+                })
+            except Exception:
+                logging.exception('could not cache %s', self.request.uri)
+        self._page_cache = None
+        return super(PageCacheMixIn, self).finish(chunk)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    pagination: keyset (seek) pagination with opaque cursors
+
+    A page starts after the sort key of the last item of the previous page,
+    carried in the `cursor` token, instead of at an offset, so page 1000
+    costs what page 1 does. One item more than the page size is fetched to
+    tell whether there is a next page.
+
+    The source is either a sequence sorted by `key` (binary searched), any
+    other iterable sorted by `key` (scanned), or a query callback
+    `query(after, limit)` returning at most `limit` rows whose key comes
+    after `after` (None for the first page), e.g.
+
+        SELECT ... WHERE id > %(after)s ORDER BY id LIMIT %(limit)s
+"""
+import json
+import base64
+import urllib
+import operator
+import itertools
+
+__all__ = ['Page', 'paginate', 'encode_cursor', 'decode_cursor', 'InvalidCursor']
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(key):
+    """
+        >>> encode_cursor((3, 'b'))
+        'WzMsICJiIl0'
+        >>> decode_cursor(encode_cursor((3, 'b')))
+        (3, u'b')
+    """
+    return base64.urlsafe_b64encode(json.dumps(key)).rstrip('=')
+
+
+def _tuples(value):
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+    return value
+
+def decode_cursor(token):
+    try:
+        padded = str(token) + '=' * (-len(token) % 4)
+        return _tuples(json.loads(base64.urlsafe_b64decode(padded)))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(token)
+
+
+class Page(object):
+    """One page: `items`, and `next_cursor` when there are more"""
+    def __init__(self, items, cursor, next_cursor):
+        self.items = items
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __nonzero__(self):
+        return bool(self.items)
+
+    def url(self, path, arguments=None, name='cursor'):
+        """The url of the next page, from the current path and arguments"""
+        if not self.has_next:
+            return None
+        query = [(k, v) for k, values in sorted((arguments or {}).items()) if k != name
+                 for v in values]
+        query.append((name, self.next_cursor))
+        return path + '?' + urllib.urlencode(query)
+
+
+def _seek(sequence, after, key, reverse):
+    """Index of the first item of `sequence` whose key comes after `after`"""
+    lo, hi = 0, len(sequence)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        current = key(sequence[mid])
+        if (current < after) if reverse else (current > after):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def paginate(source, cursor=None, per_page=20, key=None, reverse=False):
+    """The page of `source` after `cursor`. `key` gives the sort key of an
+    item (the item itself by default), which must be unique and JSON
+    serializable; `reverse` is for sources sorted in descending order.
+
+        >>> page = paginate(range(100), per_page=10)
+        >>> page.items[-1], page.has_next
+        (9, True)
+        >>> paginate(range(100), page.next_cursor, per_page=10).items[0]
+        10
+        >>> paginate(iter(range(25)), encode_cursor(19), per_page=10).has_next
+        False
+        >>> query = lambda after, limit: [i for i in range(50) if after is None or i > after][:limit]
+        >>> paginate(query, encode_cursor(44), per_page=5).items
+        [45, 46, 47, 48, 49]
+    """
+    key = key or (lambda item: item)
+    after = decode_cursor(cursor) if cursor else None
+    limit = per_page + 1
+
+    if callable(source) and not hasattr(source, '__getitem__'):
+        rows = list(source(after, limit))[:limit]
+    elif hasattr(source, '__getitem__') and hasattr(source, '__len__'):
+        start = 0 if after is None else _seek(source, after, key, reverse)
+        # by index, not slice: xrange and some sequence types don't slice
+        rows = [source[i] for i in xrange(start, min(start + limit, len(source)))]
+    else:
+        rows = iter(source)
+        if after is not None:
+            comes_before = operator.ge if reverse else operator.le
+            rows = itertools.dropwhile(lambda item: comes_before(key(item), after), rows)
+        rows = list(itertools.islice(rows, limit))
+
+    items = rows[:per_page]
+    next_cursor = encode_cursor(key(items[-1])) if len(rows) > per_page else None
+    return Page(items, cursor, next_cursor)
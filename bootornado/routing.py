@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    routing: dispatch without trying every route
+
+    Tornado matches a request against each URL regex in turn. RouteTable
+    indexes the routes by the literal prefix of their pattern in a trie, so
+    only the routes whose prefix the path starts with have their regex run,
+    and paths without any regex part are looked up in a dict. The candidates
+    keep the order the routes were declared in, so the first route matching
+    still wins, as with Tornado.
+
+    Run `python -m bootornado.routing` for a benchmark over 1000 routes.
+"""
+import re
+import timeit
+
+import tornado.web
+
+__all__ = ['RouteTable', 'CompiledRoutingMixin', 'literal_prefix']
+
+_METACHARS = '.^$*+?{}[]|()\\'
+_QUANTIFIERS = '*+?{'
+# escapes standing for themselves, like `\.` or `\/`
+_ESCAPED_LITERAL = re.compile(r'\\([^A-Za-z0-9])')
+
+
+def literal_prefix(pattern):
+    """The literal text every path matched by `pattern` starts with, and
+    whether the pattern is nothing but that text.
+
+        >>> literal_prefix(r'/auth/login$')
+        ('/auth/login', True)
+        >>> literal_prefix(r'/user/(\d+)/?$')
+        ('/user/', False)
+        >>> literal_prefix(r'/files?/(.*)$')
+        ('/file', False)
+        >>> literal_prefix(r'/a|/b$')
+        ('', False)
+    """
+    if '|' in pattern or pattern.startswith('(?'):
+        return '', False
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        step = 1
+        if char == '\\':
+            escaped = _ESCAPED_LITERAL.match(pattern, i)
+            if not escaped:
+                break
+            char = escaped.group(1)
+            step = 2
+        elif char in _METACHARS:
+            break
+        if pattern[i + step:i + step + 1] and pattern[i + step] in _QUANTIFIERS:
+            # the char may be repeated or missing
+            break
+        prefix.append(char)
+        i += step
+    return ''.join(prefix), pattern[i:] == '$'
+
+
+class RouteTable(object):
+    """Candidate routes for a path, out of a list of URLSpecs"""
+    def __init__(self, specs):
+        self.specs = list(specs)
+        self.trie = {}
+        exact = {}
+        for index, spec in enumerate(self.specs):
+            prefix, is_exact = literal_prefix(spec.regex.pattern)
+            node = self.trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(index)
+            if is_exact and not spec.regex.groups:
+                exact.setdefault(prefix, index)
+
+        # an exact path matches its own route, so the routes after it never
+        # get a chance: its candidates are known in advance
+        self.exact = {}
+        for path, index in exact.iteritems():
+            self.exact[path] = [self.specs[i] for i in self._indices(path) if i <= index]
+
+    def _indices(self, path):
+        node = self.trie
+        indices = list(node.get(None, ()))
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            indices.extend(node.get(None, ()))
+        indices.sort()
+        return indices
+
+    def candidates(self, path):
+        specs = self.exact.get(path)
+        if specs is None:
+            specs = [self.specs[index] for index in self._indices(path)]
+        return specs
+
+    def match(self, path):
+        """The first spec matching `path` and its match, or (None, None)"""
+        for spec in self.candidates(path):
+            match = spec.regex.match(path)
+            if match:
+                return spec, match
+        return None, None
+
+
+class CompiledRoutingMixin(object):
+    """Application mixin giving Tornado's dispatch loop only the candidate
+    routes for the request path"""
+    def _get_host_handlers(self, request):
+        handlers = super(CompiledRoutingMixin, self)._get_host_handlers(request)
+        if not handlers:
+            return handlers
+        tables = self.__dict__.setdefault('_route_tables', {})
+        size, table = tables.get(id(handlers), (None, None))
+        if size != len(handlers):
+            # built on first use, and again if add_handlers grew the list
+            table = RouteTable(handlers)
+            tables[id(handlers)] = (len(handlers), table)
+        # an iterator, never falsy: no candidate is a 404, not an unknown host
+        return iter(table.candidates(request.path))
+
+
+def benchmark(count=1000, number=20000):
+    specs = []
+    for i in range(count):
+        if i % 2:
+            specs.append(tornado.web.URLSpec(r'/section%d/item/(\d+)/?' % i, tornado.web.RequestHandler))
+        else:
+            specs.append(tornado.web.URLSpec(r'/page%d' % i, tornado.web.RequestHandler))
+    table = RouteTable(specs)
+    paths = ['/page0', '/section%d/item/42' % (count / 2 + 1), '/page%d' % (count - 2), '/missing']
+
+    def linear():
+        for path in paths:
+            for spec in specs:
+                if spec.regex.match(path):
+                    break
+
+    def indexed():
+        for path in paths:
+            table.match(path)
+
+    for path in paths:
+        assert table.match(path)[0] is next((spec for spec in specs if spec.regex.match(path)), None)
+    for name, func in (('linear', linear), ('trie', indexed)):
+        seconds = min(timeit.repeat(func, number=number / 100, repeat=5)) / (number / 100) / len(paths)
+        print '%-8s %8.2fus per request over %d routes' % (name, seconds * 1e6, count)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    server: single and pre-forked serving for app.py
+
+    The master builds the application (routes, precompiled templates) and
+    binds the listening sockets before forking, so the workers share all of
+    it copy-on-write. It then waits on the workers and restarts any that
+    dies. With `reuse_port`, each worker binds its own SO_REUSEPORT socket
+    instead, and the kernel spreads the connections between them.
+
+    SIGHUP reloads the code without dropping a connection: the master
+    first boots the new code in a child process to check that it starts,
+    then re-executes itself (keeping its pid, its listening sockets and its
+    workers), boots the new application, forks new workers and waits until
+    they are serving, then has the old workers stop accepting and finish
+    their in-flight requests before they exit. If the new code doesn't
+    start, or its workers don't all serve, the old workers keep serving.
+
+    With the "memory" session engine, the sessions live in the single
+    worker and go from one worker to the next through the snapshot the
+    old one dumps on its way out, so a reload drains the old worker first
+    and only then starts the new one; connections wait in the listening
+    socket's backlog meanwhile.
+"""
+import os
+import sys
+import time
+import errno
+import fcntl
+import select
+import signal
+import socket
+import logging
+import tempfile
+import subprocess
+
+import tornado.ioloop
+import tornado.netutil
+import tornado.httpserver
+
+import bootornado.session
+from bootornado.watchdog import Watchdog
+from bootornado.metrics import WorkerMetrics
+
+# SO_REUSEPORT is missing from python 2's socket module
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15 if sys.platform.startswith('linux') else None)
+
+
+def bind_reuseport(port, address=None, backlog=128):
+    """Bind a listening socket that other processes may bind too"""
+    if SO_REUSEPORT is None:
+        raise RuntimeError('SO_REUSEPORT is not supported on %s' % sys.platform)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tornado.netutil.set_close_exec(sock.fileno())
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.setblocking(0)
+    sock.bind((address or '', port))
+    sock.listen(backlog)
+    return [sock]
+
+
+# how long a draining worker may take to finish its in-flight requests
+DRAIN_TIMEOUT = 30.0
+
+# what the master passes to its re-executed self on reload
+LISTEN_FDS_ENV = 'BOOTORNADO_LISTEN_FDS'
+OLD_WORKERS_ENV = 'BOOTORNADO_OLD_WORKERS'
+RELOAD_STARTED_ENV = 'BOOTORNADO_RELOAD_STARTED'
+# set for the process checking that the new code starts: it stops in run()
+RELOAD_CHECK_ENV = 'BOOTORNADO_RELOAD_CHECK'
+
+
+class InFlight(object):
+    """Wraps the application to count the requests being served"""
+    def __init__(self, application):
+        self.application = application
+        self.active = 0
+
+    def __call__(self, request):
+        self.active += 1
+        finish = request.finish
+        def tracked_finish():
+            self.active -= 1
+            finish()
+        request.finish = tracked_finish
+        return self.application(request)
+
+
+def shutdown():
+    # keep the in-memory sessions across the restart
+    bootornado.session.dump_snapshots()
+    tornado.ioloop.IOLoop.instance().stop()
+
+
+def drain(http_server, in_flight, timeout=DRAIN_TIMEOUT):
+    """Stop accepting connections, then shut down once the in-flight
+    requests are finished or `timeout` seconds have passed"""
+    io_loop = tornado.ioloop.IOLoop.instance()
+    deadline = time.time() + timeout
+    http_server.stop()
+
+    def check():
+        if in_flight.active and time.time() < deadline:
+            io_loop.add_timeout(time.time() + 0.1, check)
+            return
+        if in_flight.active:
+            logging.warning('worker %d dropping %d requests after %.0fs draining',
+                            os.getpid(), in_flight.active, timeout)
+        shutdown()
+    check()
+
+
+def serve(application, sockets, ready_fd=None):
+    """Serve `application` on `sockets` in this process until SIGTERM,
+    which drains the in-flight requests. Writes a byte to `ready_fd` once
+    serving. Starts the IOLoop watchdog when the "watchdog" setting gives
+    its threshold."""
+    io_loop = tornado.ioloop.IOLoop.instance()
+    if application.settings.get('watchdog'):
+        Watchdog(application, application.settings['watchdog']).start()
+    in_flight = InFlight(application)
+    http_server = tornado.httpserver.HTTPServer(in_flight)
+    http_server.add_sockets(sockets)
+
+    # the IOLoop may be in the middle of anything when the signal arrives,
+    # so the handler only raises a flag, which a periodic callback checks
+    signals = []
+    def on_sigterm(signum, frame):
+        signals.append(signum)
+    def check_signals():
+        if signals:
+            check.stop()
+            # the worker replacing this one publishes the metrics now
+            worker_metrics = getattr(application, 'worker_metrics', None)
+            if worker_metrics is not None:
+                worker_metrics.stop()
+            drain(http_server, in_flight)
+    signal.signal(signal.SIGTERM, on_sigterm)
+    check = tornado.ioloop.PeriodicCallback(check_signals, 100, io_loop)
+    check.start()
+
+    if ready_fd is not None:
+        def ready():
+            os.write(ready_fd, '.')
+            os.close(ready_fd)
+        io_loop.add_callback(ready)
+    io_loop.start()
+
+
+def inherit_sockets():
+    """The listening sockets the previous master left open for us"""
+    sockets = []
+    for entry in os.environ.pop(LISTEN_FDS_ENV, '').split(','):
+        if entry:
+            fd, family = map(int, entry.split(':'))
+            sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+            os.close(fd)
+            tornado.netutil.set_close_exec(sock.fileno())
+            sock.setblocking(0)
+            sockets.append(sock)
+    return sockets
+
+
+class Master(object):
+    """Forks `workers` processes serving `application` on `port` and keeps
+    them running until SIGTERM or SIGINT. SIGHUP reloads."""
+
+    # a worker dying sooner than this after its start is throttled
+    MIN_UPTIME = 1.0
+    # how long a reload waits for the new workers to serve
+    READY_TIMEOUT = 60.0
+
+    def __init__(self, application, port, workers, reuse_port=False):
+        # sessions kept in a worker's memory aren't seen by the others
+        self.snapshot_sessions = application.settings.get('session', {}).get('engine') == 'memory'
+        if self.snapshot_sessions and workers > 1:
+            raise ValueError('the "memory" session engine keeps the sessions in one process, '
+                             'use "shm" or "redis" with %d workers' % workers)
+        self.application = application
+        self.port = port
+        self.workers = workers
+        self.reuse_port = reuse_port
+        self.sockets = None
+        self.children = {} # pid -> (worker id, start time)
+        self.old_children = set() # workers of the previous code, draining
+        self.ready_fd = None
+        self.stopping = False
+        self.reloading = False
+
+    def run(self):
+        if os.environ.get(RELOAD_CHECK_ENV):
+            # the new code booted, that's all the reloading master asks
+            return
+        reload_started = os.environ.pop(RELOAD_STARTED_ENV, None)
+        self.old_children = set(int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid)
+        if not self.reuse_port:
+            self.sockets = inherit_sockets() or tornado.netutil.bind_sockets(self.port)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGHUP, self.on_reload)
+        if self.workers > 1 and getattr(self.application, 'metrics', None) is not None:
+            # each scrape answers with the metrics of all the workers
+            self.application.worker_metrics = WorkerMetrics(self.application.metrics, self.workers)
+
+        if reload_started:
+            started = float(reload_started)
+            booted = time.time()
+            if self.snapshot_sessions:
+                # the new worker loads the snapshot the old one dumps as it exits
+                self.stop_old()
+                drained = time.time()
+                self.spawn_ready()
+                warmed = time.time()
+                drain, warm = drained - booted, warmed - drained
+            elif self.spawn_ready():
+                warmed = time.time()
+                self.stop_old()
+                drained = time.time()
+                warm, drain = warmed - booted, drained - warmed
+            else:
+                logging.error('reload failed, the previous workers keep serving')
+                self.keep_old()
+                reload_started = None
+            if reload_started:
+                logging.info('reloaded in %.2fs: boot %.2fs, warm %.2fs, drain %.2fs',
+                             time.time() - started, booted - started, warm, drain)
+        else:
+            for worker_id in range(self.workers):
+                self.spawn(worker_id)
+        logging.info('master %d serving port %d with %d workers', os.getpid(), self.port, self.workers)
+
+        while self.children:
+            if self.reloading:
+                self.reexec()
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid not in self.children:
+                self.old_children.discard(pid)
+                continue
+            worker_id, started = self.children.pop(pid)
+            if self.stopping:
+                continue
+            logging.error('worker %d (pid %d) exited with status %d, restarting', worker_id, pid, status)
+            if time.time() - started < self.MIN_UPTIME:
+                time.sleep(self.MIN_UPTIME)
+            self.spawn(worker_id)
+        worker_metrics = getattr(self.application, 'worker_metrics', None)
+        if worker_metrics is not None:
+            worker_metrics.remove()
+
+    def spawn(self, worker_id):
+        if self.stopping: # SIGTERM came in the middle of a reload
+            return None
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (worker_id, time.time())
+            return pid
+
+        # in the worker
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        try:
+            worker_metrics = getattr(self.application, 'worker_metrics', None)
+            if worker_metrics is not None:
+                worker_metrics.start(worker_id)
+            sockets = bind_reuseport(self.port) if self.reuse_port else self.sockets
+            serve(self.application, sockets, self.ready_fd)
+        except Exception:
+            logging.exception('worker %d crashed', worker_id)
+            os._exit(1)
+        os._exit(0)
+
+    def spawn_ready(self):
+        """Spawn the workers and wait until they all serve. Tells whether
+        they did."""
+        read_fd, self.ready_fd = os.pipe()
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+        os.close(self.ready_fd)
+        self.ready_fd = None
+
+        ready = 0
+        deadline = time.time() + self.READY_TIMEOUT
+        while ready < self.workers and time.time() < deadline:
+            try:
+                readable, _, _ = select.select([read_fd], [], [], deadline - time.time())
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                break
+            data = os.read(read_fd, self.workers)
+            if not data: # every new worker exited or closed its end
+                break
+            ready += len(data)
+        os.close(read_fd)
+        if ready < self.workers:
+            logging.warning('only %d of %d new workers serving', ready, self.workers)
+            return False
+        return True
+
+    def keep_old(self):
+        """Kill the new workers of a failed reload and supervise the old
+        ones again"""
+        new = list(self.children)
+        self.kill(new, signal.SIGKILL)
+        for pid in new:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.children = dict((pid, (worker_id, time.time()))
+                             for worker_id, pid in enumerate(sorted(self.old_children)))
+        self.old_children = set()
+
+    def stop_old(self):
+        """Drain the workers of the previous code and wait for them"""
+        self.kill(self.old_children)
+        while self.old_children:
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            self.old_children.discard(pid)
+            if pid in self.children:
+                # a new worker died while the old ones drained
+                worker_id, started = self.children.pop(pid)
+                logging.error('worker %d (pid %d) exited with status %d, restarting', worker_id, pid, status)
+                self.spawn(worker_id)
+
+    def check_new_code(self):
+        """Boot the new code in a child process, which stops before
+        serving, and tell whether it started"""
+        with tempfile.TemporaryFile() as output:
+            process = subprocess.Popen([sys.executable] + sys.argv, stdout=output, stderr=output,
+                                       env=dict(os.environ, **{RELOAD_CHECK_ENV: '1'}))
+            deadline = time.time() + self.READY_TIMEOUT
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+                logging.error('reload aborted, the new code took more than %.0fs to start',
+                              self.READY_TIMEOUT)
+                return False
+            if process.returncode:
+                output.seek(0)
+                logging.error('reload aborted, the new code does not start:\n%s', output.read())
+                return False
+        return True
+
+    def reexec(self):
+        """Replace this master with a fresh interpreter running the new
+        code. It keeps this pid, so the current workers stay its children,
+        and it inherits the listening sockets. Nothing changes if the new
+        code doesn't start."""
+        self.reloading = False
+        logging.info('master %d reloading', os.getpid())
+        if not self.check_new_code() or self.stopping:
+            return
+        fds = []
+        for sock in self.sockets or ():
+            flags = fcntl.fcntl(sock.fileno(), fcntl.F_GETFD)
+            fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+            fds.append('%d:%d' % (sock.fileno(), sock.family))
+        os.environ[LISTEN_FDS_ENV] = ','.join(fds)
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in list(self.children) + list(self.old_children))
+        os.environ[RELOAD_STARTED_ENV] = repr(time.time())
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def kill(self, pids, sig=signal.SIGTERM):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except OSError:
+                pass
+
+    def on_reload(self, signum, frame):
+        self.reloading = True
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+        self.kill(self.children)
+        self.kill(self.old_children)
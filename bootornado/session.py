@@ -3,8 +3,9 @@ Session Management
 (from web.py)
 """
 
-import os, time, datetime, random, base64
+import os, time, datetime, random, base64, uuid
 import os.path
+import struct, zlib, threading, heapq, contextlib, weakref
 from copy import deepcopy
 try:
     import cPickle as pickle
@@ -17,19 +18,15 @@ except ImportError:
     import sha
     sha1 = sha.new
 
-from tornado.options import options
-
 import tornado.web
 import bootornado.utils 
 
 import logging
 
-import redis
-import pdb 
-
 __all__ = [
     'Session', 'SessionExpired',
-    'Store', 'DiskStore', 'DBStore',
+    'Store', 'DiskStore', 'DBStore', 'LogStore', 'ExpiryIndex',
+    'SharedMemoryStore', 'MemoryStore', 'dump_snapshots', 'UserIndex',
 ]
 
 session_parameters = bootornado.utils.storage({
@@ -54,11 +51,13 @@ class Session(object):
     """
     __slots__ = [
         "store", "_initializer", "_last_cleanup_time", "_config", "_data", "handler",
+        "user_index",
         "__getitem__", "__setitem__", "__delitem__"
     ]
 
-    def __init__(self, store, initializer=None):
+    def __init__(self, store, initializer=None, user_index=None):
         self.store = store
+        self.user_index = user_index or UserIndex.for_store(store)
         self._initializer = initializer
         self._last_cleanup_time = 0
         self._config = bootornado.utils.storage(session_parameters)
@@ -83,7 +82,6 @@ class Session(object):
         if name in self.__slots__:
             object.__setattr__(self, name, value)
         else:
-            logging.error('name : %s ,value : %s' %(name,value))
             setattr(self._data, name, value)
         
     def __delattr__(self, name):
@@ -116,8 +114,8 @@ class Session(object):
         self._check_expiry()
         if self.session_id:
             d = self.store[self.session_id]
-            logging.error(d)
             self.update(d)
+            self._validate_user()
             self._validate_ip()
         
         if not self.session_id:
@@ -141,6 +139,16 @@ class Session(object):
             else:
                 return self.expired()
 
+    def _validate_user(self):
+        # check the user didn't log out everywhere since this session started
+        user_id = self.get('_user')
+        if user_id is not None and not _result(self.user_index.is_current, user_id, self.get('_generation')):
+            del self.store[self.session_id]
+            if self._config.ignore_expiry:
+                self.session_id = None
+            else:
+                return self.expired()
+
     def _validate_ip(self):
         # check for change of IP
         if self.session_id and self.get('ip', None) != self.handler.request.remote_ip:
@@ -150,7 +158,6 @@ class Session(object):
     def _save(self):
         if not self.get('_killed'):
             self._setcookie(self.session_id)
-            logging.error( dict(self._data) )
             self.store[self.session_id] = dict(self._data)
         else:
             self._setcookie(self.session_id, expires=-1)
@@ -205,8 +212,175 @@ class Session(object):
     def kill(self):
         """Kill the session, make it no longer available"""
         del self.store[self.session_id]
+        if self.get('_user') is not None:
+            self.user_index.remove(self.get('_user'), self.session_id)
         self._killed = True
 
+    def bind_user(self, user_id):
+        """Tie the session to `user_id` (on login), so `kill_all` can end it"""
+        self._data['_user'] = user_id
+        self._data['_generation'] = _result(self.user_index.add, user_id, self.session_id)
+
+    def kill_all(self):
+        """Kill every session of the user bound to this one ("log out everywhere")"""
+        if self.get('_user') is not None:
+            self.user_index.invalidate(self.get('_user'))
+        self.kill()
+
+def _result(method, *args):
+    """Calls `method` of a UserIndex over a synchronous store, returns what it
+    gives its callback"""
+    result = []
+    method(*args, callback=result.append)
+    return result[0]
+
+class UserIndex(object):
+    """Secondary index from a user to its sessions, used by both this module's
+    Session and sessions.session.SessionManager.
+
+    Each user has a generation, a random token written by `invalidate`, and
+    the list of the ids of its latest sessions.  A session keeps the
+    generation it was bound at, and fails `is_current` once the user was
+    invalidated since, so it's dropped the next time it's loaded.
+    Invalidating is a single write however many sessions the user has.
+
+    The generation is only ever written whole by `invalidate`, never read,
+    changed and written back, so a login racing with an invalidation can't
+    undo it: at worst the new session is bound at the old generation and
+    dropped.  A user without a generation record (never invalidated, or
+    whose record expired) has every session current; the record is written
+    after the last write of the sessions it invalidates, so it outlives
+    them whenever the datastore expires idle keys.
+
+    `get(key, callback)` and `set(key, value)` are the datastore's; the
+    methods call back right away with a synchronous one.
+
+        >>> index = UserIndex.for_store(MemoryStore())
+        >>> generation = _result(index.add, 'bob', 'abc')
+        >>> _result(index.sessions, 'bob')
+        ['abc']
+        >>> _result(index.invalidate, 'bob')
+        ['abc']
+        >>> _result(index.is_current, 'bob', generation), _result(index.sessions, 'bob')
+        (False, [])
+    """
+    MAX_SESSIONS = 100
+
+    def __init__(self, get, set):
+        self.get = get
+        self.set = set
+
+    @classmethod
+    def for_store(cls, store):
+        def get(key, callback):
+            try:
+                callback(store[key])
+            except KeyError:
+                callback(None)
+        return cls(get, store.__setitem__)
+
+    def _key(self, user_id, field):
+        return 'user:%s:%s' % (sha1(bootornado.utils.safestr(user_id)).hexdigest(), field)
+
+    def generation(self, user_id, callback):
+        # drivers give {} for a missing key
+        self.get(self._key(user_id, 'generation'), lambda value: callback(value or None))
+
+    def sessions(self, user_id, callback):
+        self.get(self._key(user_id, 'sessions'), lambda value: callback(value or []))
+
+    def is_current(self, user_id, generation, callback):
+        def on_generation(current):
+            callback(current is None or current == generation)
+        self.generation(user_id, on_generation)
+
+    def add(self, user_id, session_id, callback=None):
+        """Adds a session to the user's, calls back with the current generation"""
+        def on_sessions(sessions):
+            if session_id not in sessions:
+                self.set(self._key(user_id, 'sessions'),
+                         sessions[1 - self.MAX_SESSIONS:] + [session_id])
+            self.generation(user_id, callback or (lambda generation: None))
+        self.sessions(user_id, on_sessions)
+
+    def remove(self, user_id, session_id, callback=None):
+        def on_sessions(sessions):
+            if session_id in sessions:
+                sessions.remove(session_id)
+                self.set(self._key(user_id, 'sessions'), sessions)
+            if callback:
+                callback()
+        self.sessions(user_id, on_sessions)
+
+    def invalidate(self, user_id, callback=None):
+        """Ends all the sessions of the user, calls back with the ids of the
+        latest ones"""
+        self.set(self._key(user_id, 'generation'), uuid.uuid4().hex)
+        def on_sessions(sessions):
+            if sessions:
+                self.set(self._key(user_id, 'sessions'), [])
+            if callback:
+                callback(sessions)
+        self.sessions(user_id, on_sessions)
+
+class ExpiryIndex(object):
+    """Index of session keys by access time, maintained by the stores.
+
+    Stores `touch` a key when it's read or written and `discard` it when
+    it's deleted; `expired` then pops just the keys idle for longer than
+    the timeout, so a cleanup costs O(expired) instead of a scan of every
+    session.  It's a min-heap with lazy deletion: touching a key pushes a
+    new entry and the stale one is skipped when it reaches the top.
+
+        >>> index = ExpiryIndex([('a', 10), ('b', 20)])
+        >>> index.touch('a', 30)
+        >>> index.expired(15, now=40)
+        ['b']
+        >>> 'b' in index
+        False
+    """
+    def __init__(self, items=()):
+        self._lock = threading.Lock()
+        self._rebuild(dict(items))
+
+    def _rebuild(self, atimes):
+        self._atimes = atimes
+        self._heap = [(atime, key) for key, atime in atimes.iteritems()]
+        heapq.heapify(self._heap)
+
+    def __contains__(self, key):
+        return key in self._atimes
+
+    def __len__(self):
+        return len(self._atimes)
+
+    def touch(self, key, atime=None):
+        if atime is None:
+            atime = time.time()
+        with self._lock:
+            self._atimes[key] = atime
+            heapq.heappush(self._heap, (atime, key))
+            # keep the stale entries from outgrowing the live ones
+            if len(self._heap) > 2 * len(self._atimes) + 1024:
+                self._rebuild(self._atimes)
+
+    def discard(self, key):
+        with self._lock:
+            self._atimes.pop(key, None)
+
+    def expired(self, timeout, now=None):
+        """Removes and returns the keys not touched for `timeout` seconds"""
+        deadline = (now or time.time()) - timeout
+        expired = []
+        with self._lock:
+            heap, atimes = self._heap, self._atimes
+            while heap and heap[0][0] < deadline:
+                atime, key = heapq.heappop(heap)
+                if atimes.get(key) == atime:
+                    del atimes[key]
+                    expired.append(key)
+        return expired
+
 class Store:
     """Base class for session stores"""
 
@@ -257,6 +431,9 @@ class DiskStore(Store):
                     os.path.abspath(root)
                     )
         self.root = root
+        self.expiry = ExpiryIndex(
+            (f, os.stat(self._get_path(f)).st_atime) for f in os.listdir(root)
+        )
 
     def _get_path(self, key):
         if os.path.sep in key: 
@@ -271,6 +448,7 @@ class DiskStore(Store):
         path = self._get_path(key)
         if os.path.exists(path): 
             pickled = open(path).read()
+            self.expiry.touch(key)
             return self.decode(pickled)
         else:
             raise KeyError, key
@@ -284,21 +462,29 @@ class DiskStore(Store):
                 f.write(pickled)
             finally: 
                 f.close()
+            self.expiry.touch(key)
         except IOError:
             pass
 
     def __delitem__(self, key):
         path = self._get_path(key)
+        self.expiry.discard(key)
         if os.path.exists(path):
             os.remove(path)
     
     def cleanup(self, timeout):
         now = time.time()
-        for f in os.listdir(self.root):
+        for f in self.expiry.expired(timeout, now):
             path = self._get_path(f)
-            atime = os.stat(path).st_atime
+            try:
+                atime = os.stat(path).st_atime
+            except OSError:
+                continue
+            # another process sharing the directory may have used it since
             if now - atime > timeout :
                 os.remove(path)
+            else:
+                self.expiry.touch(f, atime)
 
 class DBStore(Store):
     """Store for saving a session in database
@@ -352,6 +538,7 @@ class ShelfStore:
     """
     def __init__(self, shelf):
         self.shelf = shelf
+        self.expiry = ExpiryIndex((k, self.shelf[k][0]) for k in self.shelf.keys())
 
     def __contains__(self, key):
         return key in self.shelf
@@ -362,20 +549,676 @@ class ShelfStore:
         return v
 
     def __setitem__(self, key, value):
-        self.shelf[key] = time.time(), value
+        atime = time.time()
+        self.shelf[key] = atime, value
+        self.expiry.touch(key, atime)
         
     def __delitem__(self, key):
+        self.expiry.discard(key)
         try:
             del self.shelf[key]
         except KeyError:
             pass
 
     def cleanup(self, timeout):
+        for k in self.expiry.expired(timeout):
+            del self[k]
+
+_pread = getattr(os, 'pread', None)
+
+class LogStore(Store):
+    """Store for saving sessions in an append-only log file.
+
+    Every write is a single append of one record and every read is a
+    single positioned read of one record, located through an in-memory
+    index of key -> offset.  Access times live in the index only, so
+    reading a session never writes to disk.
+
+    On startup the index is rebuilt by replaying the log; a record torn by
+    a crash fails its checksum and is truncated away.  Superseded records
+    are reclaimed by `compact`, which runs in a background thread once
+    enough of the log is garbage.
+
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'sessions.log')
+        >>> s = LogStore(path)
+        >>> s['a'] = 'foo'
+        >>> s.close()
+        >>> s = LogStore(path)
+        >>> s['a']
+        'foo'
+        >>> time.sleep(0.01)
+        >>> s.cleanup(0.01)
+        >>> s['a']
+        Traceback (most recent call last):
+            ...
+        KeyError: 'a'
+    """
+    _PUT, _DEL = 1, 2
+
+    # crc32 of the rest of the record, then op, mtime, key and value length
+    _crc = struct.Struct('>I')
+    _header = struct.Struct('>BdHI')
+    _overhead = _crc.size + _header.size
+
+    def __init__(self, path, sync=False, compact_ratio=0.5, compact_min_bytes=1 << 20):
+        # the values are unpickled, so no one else may write the file
+        bootornado.utils.private_directory(os.path.dirname(os.path.abspath(path)))
+        self.path = path
+        self.sync = sync
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compacting = None
+        self._index = {} # key -> (offset of value, length of value, atime)
+        self._garbage = 0
+
+        # a compaction interrupted by a crash leaves the old log intact
+        if os.path.exists(self._compact_path()):
+            os.remove(self._compact_path())
+        self._fd = self._open(path)
+        self._size, self._garbage = self._replay(self._fd, 0, self._index)
+        self.expiry = ExpiryIndex(
+            (key, atime) for key, (offset, length, atime) in self._index.iteritems()
+        )
+
+    def _open(self, path, truncate=False):
+        flags = os.O_RDWR | os.O_CREAT | os.O_APPEND
+        if truncate:
+            flags |= os.O_TRUNC
+        return os.open(path, flags, 0o600)
+
+    def _compact_path(self):
+        return self.path + '.compact'
+
+    def _replay(self, fd, offset, index):
+        """Applies the records of `fd` from `offset` on to `index`.
+
+        Returns the offset just past the last good record, and the number
+        of bytes of garbage found.  Anything after the last good record is
+        truncated.
+        """
+        garbage = 0
+        f = os.fdopen(os.dup(fd), 'rb')
+        try:
+            f.seek(offset)
+            while True:
+                head = f.read(self._overhead)
+                if len(head) < self._overhead:
+                    break
+                op, mtime, klen, vlen = self._header.unpack(head[self._crc.size:])
+                body = f.read(klen + vlen)
+                if len(body) < klen + vlen:
+                    break
+                crc, = self._crc.unpack(head[:self._crc.size])
+                if zlib.crc32(head[self._crc.size:] + body) & 0xffffffff != crc:
+                    break
+                key = body[:klen]
+                old = index.pop(key, None)
+                if old is not None:
+                    garbage += self._overhead + klen + old[1]
+                if op == self._PUT:
+                    index[key] = (offset + self._overhead + klen, vlen, mtime)
+                else:
+                    garbage += self._overhead + klen
+                offset += self._overhead + klen + vlen
+        finally:
+            f.close()
+
+        if offset < os.fstat(fd).st_size:
+            logging.warning('LogStore: dropping torn record at offset %d of %s', offset, self.path)
+            os.ftruncate(fd, offset)
+        return offset, garbage
+
+    def _pread(self, fd, offset, length):
+        if _pread is not None:
+            return _pread(fd, length, offset)
+        with self._lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, length)
+
+    def _record(self, op, key, value, mtime):
+        body = self._header.pack(op, mtime, len(key), len(value)) + key + value
+        return self._crc.pack(zlib.crc32(body) & 0xffffffff) + body
+
+    def _append(self, op, key, value=''):
+        """Appends one record to the log, returns the offset of its value"""
+        record = self._record(op, key, value, time.time())
+        offset = self._size + self._overhead + len(key)
+        written = 0
+        while written < len(record):
+            written += os.write(self._fd, record[written:])
+        if self.sync:
+            os.fsync(self._fd)
+        self._size += len(record)
+        return offset
+
+    def _forget(self, key):
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._garbage += self._overhead + len(key) + old[1]
+        return old
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        with self._lock:
+            offset, length, atime = self._index[key]
+            atime = time.time()
+            self._index[key] = offset, length, atime
+            self.expiry.touch(key, atime)
+            pickled = self._pread(self._fd, offset, length)
+        return pickle.loads(pickled)
+
+    def __setitem__(self, key, value):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            offset = self._append(self._PUT, key, pickled)
+            self._forget(key)
+            atime = time.time()
+            self._index[key] = offset, len(pickled), atime
+            self.expiry.touch(key, atime)
+            self._maybe_compact()
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key in self._index:
+                self._append(self._DEL, key)
+                self._forget(key)
+                self.expiry.discard(key)
+                self._garbage += self._overhead + len(key)
+                self._maybe_compact()
+
+    def cleanup(self, timeout):
+        with self._lock:
+            for key in self.expiry.expired(timeout):
+                del self[key]
+
+    def _maybe_compact(self):
+        if (self._compacting is None and
+                self._garbage >= self.compact_min_bytes and
+                self._garbage >= self._size * self.compact_ratio):
+            self._compacting = threading.Thread(target=self.compact)
+            self._compacting.daemon = True
+            self._compacting.start()
+
+    def compact(self):
+        """Rewrites the log with only the live records and swaps it in.
+
+        The live records are copied without holding the store lock; only
+        the records appended meanwhile are copied with the lock held, right
+        before the new log is renamed over the old one.
+        """
+        with self._compact_lock:
+            try:
+                self._compact()
+            finally:
+                self._compacting = None
+
+    def _compact(self):
+        with self._lock:
+            live = [(key, offset, length, atime)
+                    for key, (offset, length, atime) in self._index.iteritems()]
+            end = self._size
+
+        fd = self._open(self._compact_path(), truncate=True)
+        try:
+            index, size, chunk = {}, 0, []
+            for key, offset, length, atime in live:
+                record = self._record(self._PUT, key, self._pread(self._fd, offset, length), atime)
+                index[key] = (size + self._overhead + len(key), length, atime)
+                size += len(record)
+                chunk.append(record)
+                if len(chunk) >= 256:
+                    os.write(fd, ''.join(chunk))
+                    chunk = []
+            os.write(fd, ''.join(chunk))
+
+            with self._lock:
+                tail = self._pread(self._fd, end, self._size - end)
+                os.write(fd, tail)
+                size, garbage = self._replay(fd, size, index)
+                for key, (offset, length, atime) in index.iteritems():
+                    if key in self._index:
+                        index[key] = offset, length, self._index[key][2]
+                os.fsync(fd)
+                os.rename(self._compact_path(), self.path)
+                os.close(self._fd)
+                self._fd, fd = fd, None
+                self._index, self._size, self._garbage = index, size, garbage
+        finally:
+            if fd is not None:
+                os.close(fd)
+                os.remove(self._compact_path())
+
+    def close(self):
+        compacting = self._compacting
+        if compacting is not None:
+            compacting.join()
+        with self._lock:
+            if self.sync:
+                os.fsync(self._fd)
+            os.close(self._fd)
+
+_snapshot_stores = weakref.WeakValueDictionary()
+
+def dump_snapshots():
+    """Dumps every store created with a snapshot path, on graceful shutdown"""
+    for store in _snapshot_stores.values():
+        try:
+            store.dump()
+        except (IOError, OSError), e:
+            logging.error('could not dump session snapshot %s: %s', store.snapshot, e)
+
+class MemoryStore(Store):
+    """Store for keeping sessions in the memory of the process.
+
+    Given a `snapshot` path, `dump` writes all the sessions to that file
+    (`dump_snapshots` does it for every such store on SIGTERM) and the
+    next process loads them back on startup.  Loading memory-maps the file
+    and reads only the keys and access times: expired sessions are skipped
+    and the others are copied out of the map the first time they're read.
+    The file is removed once loaded, so a crash can't bring back sessions
+    deleted after the snapshot was taken.
+
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'sessions.snapshot')
+        >>> s = MemoryStore(path)
+        >>> s['a'] = 'foo'
+        >>> s.dump()
+        >>> s = MemoryStore(path)
+        >>> s['a']
+        'foo'
+        >>> os.path.exists(path)
+        False
+    """
+    MAGIC = 'BTSNAP01'
+
+    # magic, number of sessions, size of the index that follows
+    _header = struct.Struct('>8sII')
+    # atime, key length, value length; then the key
+    _entry = struct.Struct('>dHI')
+
+    def __init__(self, snapshot=None, timeout=None):
+        self.snapshot = snapshot
+        self._lock = threading.RLock()
+        self._data = {} # key -> [atime, pickled value or (offset, length) in the map]
+        self._map = None
+        self.expiry = ExpiryIndex()
+        if snapshot:
+            # the snapshot is unpickled, so no one else may write there
+            bootornado.utils.private_directory(os.path.dirname(os.path.abspath(snapshot)))
+            _snapshot_stores[id(self)] = self
+            if os.path.exists(snapshot):
+                self._load(timeout or session_parameters.timeout)
+
+    def _load(self, timeout):
+        import mmap
         now = time.time()
-        for k in self.shelf.keys():
-            atime, v = self.shelf[k]
-            if now - atime > timeout :
-                del self[k]
+        f = open(self.snapshot, 'rb')
+        try:
+            if os.fstat(f.fileno()).st_size < self._header.size:
+                return
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+            os.remove(self.snapshot)
+
+        magic, count, index_size = self._header.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            logging.error('%s is not a session snapshot', self.snapshot)
+            return
+        offset = self._header.size
+        value_offset = offset + index_size
+        for i in xrange(count):
+            atime, klen, vlen = self._entry.unpack_from(self._map, offset)
+            offset += self._entry.size
+            if now - atime <= timeout:
+                key = self._map[offset:offset + klen]
+                self._data[key] = [atime, (value_offset, vlen)]
+                self.expiry.touch(key, atime)
+            offset += klen
+            value_offset += vlen
+
+    def _value(self, entry):
+        value = entry[1]
+        if isinstance(value, tuple):
+            offset, length = value
+            value = entry[1] = self._map[offset:offset + length]
+        return value
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._data[key]
+            entry[0] = time.time()
+            self.expiry.touch(key, entry[0])
+            pickled = self._value(entry)
+        return pickle.loads(pickled)
+
+    def __setitem__(self, key, value):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        atime = time.time()
+        with self._lock:
+            self._data[key] = [atime, pickled]
+            self.expiry.touch(key, atime)
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self.expiry.discard(key)
+
+    def cleanup(self, timeout):
+        with self._lock:
+            for key in self.expiry.expired(timeout):
+                self._data.pop(key, None)
+
+    def dump(self):
+        """Writes all the sessions to the snapshot file"""
+        with self._lock:
+            index, values = [], []
+            for key, entry in self._data.iteritems():
+                value = self._value(entry)
+                index.append(self._entry.pack(entry[0], len(key), len(value)) + key)
+                values.append(value)
+            index = ''.join(index)
+            tmp = self.snapshot + '.tmp'
+            f = open(tmp, 'wb')
+            try:
+                f.write(self._header.pack(self.MAGIC, len(values), len(index)))
+                f.write(index)
+                f.writelines(values)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            os.rename(tmp, self.snapshot)
+
+class SharedMemoryStore(Store):
+    """Store for sharing sessions between the processes of one host.
+
+    The sessions live in a hash table inside a memory-mapped file, so every
+    worker forked on the box (or started against the same `path`) sees the
+    same data, and a read is a local memory read.  The table is made of
+    fixed-size slots: a session takes one slot, and one larger than a slot
+    spills over into a chain of overflow slots.  Each bucket is guarded by
+    an `fcntl` lock on its own byte range of the file, so processes only
+    contend when they touch the same bucket.
+
+    Sessions not accessed for `ttl` seconds are treated as gone on read and
+    their slots reclaimed by `cleanup`, or by a sweep when the table runs
+    out of free slots.  `update` changes a value in one step for all the
+    processes.  `label` names what the store holds in its log messages.
+
+        >>> import tempfile
+        >>> s = SharedMemoryStore(os.path.join(tempfile.mkdtemp(), 'sessions.shm'), slots=64)
+        >>> s['a'] = 'foo'
+        >>> s['b'] = 'x' * 2000
+        >>> s['a'], len(s['b'])
+        ('foo', 2000)
+        >>> s.update('n', lambda n: n + 1, 0), s.update('n', lambda n: n + 1, 0)
+        (1, 2)
+        >>> time.sleep(0.01)
+        >>> s.cleanup(0.01)
+        >>> s['a']
+        Traceback (most recent call last):
+            ...
+        KeyError: 'a'
+    """
+    MAGIC = 'BTSHM001'
+
+    # magic, buckets, slots, slot size, free list head, first never used slot
+    _table = struct.Struct('>8sIIIII')
+    _bucket = struct.Struct('>I')
+    # next in bucket, next overflow slot, atime, key length, value length
+    _entry = struct.Struct('>IIdHI')
+    # next overflow slot (or next free slot)
+    _link = struct.Struct('>I')
+
+    _FREE_OFFSET = 8 + 4 * 3
+    # a byte of the header, past the table, locked by update()
+    _UPDATE_OFFSET = 32
+
+    def __init__(self, path, slots=65536, slot_size=512, buckets=None, ttl=None, label='session'):
+        import fcntl, mmap
+        self._fcntl = fcntl
+
+        # the values are unpickled, so no one else may write the file
+        bootornado.utils.private_directory(os.path.dirname(os.path.abspath(path)))
+        self.path = path
+        self.ttl = ttl or session_parameters.timeout
+        self.label = label
+        self._lock = threading.RLock()
+
+        buckets = buckets or slots
+        self._buckets_offset = 64
+        self._slots_offset = self._buckets_offset + buckets * self._bucket.size
+        self._slots_offset += -self._slots_offset % slot_size
+        size = self._slots_offset + slots * slot_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        st = os.fstat(self._fd)
+        if st.st_uid != os.getuid() or st.st_mode & 0022:
+            os.close(self._fd)
+            raise OSError('%s is writable by other users' % path)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.read(self._fd, self._table.size)
+            if len(header) == self._table.size and header[:8] == self.MAGIC:
+                geometry = self._table.unpack(header)[1:4]
+                if geometry != (buckets, slots, slot_size):
+                    raise ValueError('%s was created with another geometry %r' % (path, geometry))
+            else:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                # the read above moved the offset past whatever was there
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, self._table.pack(self.MAGIC, buckets, slots, slot_size, 0, 1))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+        self.buckets, self.slots, self.slot_size = buckets, slots, slot_size
+        self._map = mmap.mmap(self._fd, size)
+
+    @contextlib.contextmanager
+    def _locked(self, offset, length, shared=False):
+        fcntl = self._fcntl
+        fcntl.lockf(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, length, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def _bucket_for(self, key):
+        return self._buckets_offset + (zlib.crc32(key) & 0xffffffff) % self.buckets * self._bucket.size
+
+    def _slot(self, n):
+        return self._slots_offset + (n - 1) * self.slot_size
+
+    def _find(self, bucket, key):
+        """Returns (previous slot, slot) of `key` in `bucket`, 0 if missing"""
+        prev, n = 0, self._bucket.unpack_from(self._map, bucket)[0]
+        while n:
+            offset = self._slot(n)
+            next, more, atime, klen, vlen = self._entry.unpack_from(self._map, offset)
+            start = offset + self._entry.size
+            if klen == len(key) and self._map[start:start + klen] == key:
+                return prev, n
+            prev, n = n, next
+        return prev, 0
+
+    def _expired(self, atime, now, timeout):
+        return now - atime > timeout
+
+    def _read(self, n):
+        offset = self._slot(n)
+        next, more, atime, klen, vlen = self._entry.unpack_from(self._map, offset)
+        start = offset + self._entry.size + klen
+        chunk = min(vlen, offset + self.slot_size - start)
+        parts, left = [self._map[start:start + chunk]], vlen - chunk
+        while left:
+            offset = self._slot(more)
+            more, = self._link.unpack_from(self._map, offset)
+            start = offset + self._link.size
+            chunk = min(left, self.slot_size - self._link.size)
+            parts.append(self._map[start:start + chunk])
+            left -= chunk
+        return ''.join(parts)
+
+    def _alloc(self, count):
+        """Takes `count` slots off the free list, or None if there's no room"""
+        taken = []
+        with self._locked(self._FREE_OFFSET, 8):
+            free, top = struct.unpack_from('>II', self._map, self._FREE_OFFSET)
+            while len(taken) < count and free:
+                taken.append(free)
+                free, = self._link.unpack_from(self._map, self._slot(free))
+            while len(taken) < count and top <= self.slots:
+                taken.append(top)
+                top += 1
+            if len(taken) < count:
+                return None
+            struct.pack_into('>II', self._map, self._FREE_OFFSET, free, top)
+        return taken
+
+    def _free(self, n):
+        """Puts the slot chain starting at `n` back on the free list"""
+        more = self._entry.unpack_from(self._map, self._slot(n))[1]
+        chain = [n]
+        while more:
+            chain.append(more)
+            more, = self._link.unpack_from(self._map, self._slot(more))
+        with self._locked(self._FREE_OFFSET, 8):
+            free, = self._link.unpack_from(self._map, self._FREE_OFFSET)
+            for n in chain:
+                self._link.pack_into(self._map, self._slot(n), free)
+                free = n
+            self._link.pack_into(self._map, self._FREE_OFFSET, free)
+
+    def _unlink(self, bucket, prev, n):
+        next = self._entry.unpack_from(self._map, self._slot(n))[0]
+        if prev:
+            self._link.pack_into(self._map, self._slot(prev), next)
+        else:
+            self._bucket.pack_into(self._map, bucket, next)
+        self._free(n)
+
+    def __contains__(self, key):
+        try:
+            self._get(key, touch=False)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key):
+        return pickle.loads(self._get(key))
+
+    def _get(self, key, touch=True):
+        bucket = self._bucket_for(key)
+        with self._lock:
+            with self._locked(bucket, self._bucket.size, shared=True):
+                prev, n = self._find(bucket, key)
+                if not n:
+                    raise KeyError, key
+                offset = self._slot(n)
+                atime = self._entry.unpack_from(self._map, offset)[2]
+                if self._expired(atime, time.time(), self.ttl):
+                    raise KeyError, key
+                if touch:
+                    struct.pack_into('>d', self._map, offset + 8, time.time())
+                return self._read(n)
+
+    def __setitem__(self, key, value):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        head = self.slot_size - self._entry.size - len(key)
+        if head < 0:
+            raise ValueError, "Bad key: %s" % repr(key)
+        overflow = self.slot_size - self._link.size
+        count = 1 + (max(len(pickled) - head, 0) + overflow - 1) // overflow
+
+        bucket = self._bucket_for(key)
+        with self._lock:
+            slots = self._alloc(count)
+            if slots is None:
+                self.cleanup(self.ttl)
+                slots = self._alloc(count)
+            if slots is None:
+                logging.error('SharedMemoryStore: %s is full, dropping %s %s', self.path, self.label, key)
+                return
+
+            # write the new chain first, then swap it in under the bucket lock
+            offset = self._slot(slots[0])
+            more = slots[1] if count > 1 else 0
+            self._entry.pack_into(self._map, offset, 0, more, time.time(), len(key), len(pickled))
+            start = offset + self._entry.size
+            self._map[start:start + len(key) + min(head, len(pickled))] = key + pickled[:head]
+            written = head
+            for i, n in enumerate(slots[1:]):
+                offset = self._slot(n)
+                more = slots[i + 2] if i + 2 < count else 0
+                self._link.pack_into(self._map, offset, more)
+                chunk = pickled[written:written + overflow]
+                start = offset + self._link.size
+                self._map[start:start + len(chunk)] = chunk
+                written += overflow
+
+            with self._locked(bucket, self._bucket.size):
+                prev, n = self._find(bucket, key)
+                if n:
+                    self._unlink(bucket, prev, n)
+                self._link.pack_into(self._map, self._slot(slots[0]),
+                                     self._bucket.unpack_from(self._map, bucket)[0])
+                self._bucket.pack_into(self._map, bucket, slots[0])
+
+    def update(self, key, function, default=None):
+        """Sets `key` to what `function` returns for its current value (or
+        `default`) and returns it; the processes updating the store take
+        their turn, so none loses another's change"""
+        with self._lock:
+            with self._locked(self._UPDATE_OFFSET, 1):
+                try:
+                    current = self[key]
+                except KeyError:
+                    current = default
+                value = function(current)
+                self[key] = value
+        return value
+
+    def __delitem__(self, key):
+        bucket = self._bucket_for(key)
+        with self._lock:
+            with self._locked(bucket, self._bucket.size):
+                prev, n = self._find(bucket, key)
+                if n:
+                    self._unlink(bucket, prev, n)
+
+    def cleanup(self, timeout):
+        """Reclaims the expired sessions; walks the slot headers in memory,
+        no session is unpickled."""
+        now = time.time()
+        with self._lock:
+            for i in xrange(self.buckets):
+                bucket = self._buckets_offset + i * self._bucket.size
+                if not self._bucket.unpack_from(self._map, bucket)[0]:
+                    continue
+                with self._locked(bucket, self._bucket.size):
+                    prev, n = 0, self._bucket.unpack_from(self._map, bucket)[0]
+                    while n:
+                        next, more, atime, klen, vlen = self._entry.unpack_from(self._map, self._slot(n))
+                        if self._expired(atime, now, timeout):
+                            self._unlink(bucket, prev, n)
+                        else:
+                            prev = n
+                        n = next
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
 
 class RedisStore(Store):
     """Store for saving a session in redis
@@ -386,6 +1229,9 @@ class RedisStore(Store):
         data TEXT
     """
     def __init__(self):
+        import redis
+        from tornado.options import options
+
         redis_host   = options.get('redis_host','localhost')
         redis_port   = options.get('redis_port','6379')
         redis_db     = options.get('redis_db','')
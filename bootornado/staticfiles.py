@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    staticfiles: static file handler for production traffic
+
+    Serves the `.br` or `.gz` file built next to the requested one when the
+    client accepts that encoding, keeps small files in memory, and streams
+    the larger ones from a memory map in chunks, without reading them into
+    the heap. ETags are content hashes, computed once per file version, and
+    fingerprinted files (`?v=` or under build/) are cached for a year.
+"""
+import os
+import stat
+import mmap
+import hashlib
+import datetime
+import mimetypes
+import email.utils
+
+import tornado.web
+
+from bootornado.assets import ManifestStaticFileHandler, BUILD_DIR
+from bootornado.compression import CONTENT_TYPES, accepts_encoding
+from bootornado.utils import TTLCache
+
+__all__ = ['StaticFileHandler']
+
+# content encoding -> suffix of the precompressed variant, by preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class _File(object):
+    """What we know about one version of a file on disk"""
+    __slots__ = ('mtime', 'size', 'etag')
+
+    def __init__(self, st):
+        self.mtime = st[stat.ST_MTIME]
+        self.size = st[stat.ST_SIZE]
+        self.etag = None
+
+    def current(self, st):
+        return self.mtime == st[stat.ST_MTIME] and self.size == st[stat.ST_SIZE]
+
+
+class StaticFileHandler(ManifestStaticFileHandler):
+    """Drop-in `static_handler_class`"""
+    # files up to this size are kept in memory
+    HOT_SIZE = 64 * 1024
+    # how many of them
+    HOT_FILES = 512
+    # bytes sent per write for the memory mapped files
+    CHUNK_SIZE = 64 * 1024
+    # for fingerprinted files
+    IMMUTABLE_MAX_AGE = 86400 * 365
+
+    _files = {} # abspath -> _File, every file seen by this process
+    _hot = TTLCache(HOT_FILES) # abspath -> content of the small files
+
+    def head(self, path):
+        self.get(path, include_body=False)
+
+    @tornado.web.asynchronous
+    def get(self, path, include_body=True):
+        abspath = self.resolve(path)
+        if abspath is None:
+            return
+
+        mime_type, encoding = mimetypes.guess_type(abspath)
+        variant, content_encoding = self.select_variant(abspath)
+        if content_encoding:
+            self.set_header('Content-Encoding', content_encoding)
+        if mime_type in CONTENT_TYPES or content_encoding or \
+                any(os.path.exists(abspath + suffix) for _, suffix in ENCODINGS):
+            # the response depends on the encodings the client accepts: a
+            # variant, or the compression transform, another client would
+            # get. Even a 304 says so, for the caches revalidating it.
+            self.set_header('Vary', 'Accept-Encoding')
+
+        try:
+            st = os.stat(variant)
+        except OSError:
+            raise tornado.web.HTTPError(404)
+        entry = self._files.get(variant)
+        if entry is None or not entry.current(st):
+            entry = self._files[variant] = _File(st)
+            self._hot.pop(variant, None)
+
+        modified = datetime.datetime.utcfromtimestamp(entry.mtime)
+        self.set_header('Last-Modified', modified)
+        if mime_type:
+            self.set_header('Content-Type', mime_type)
+        self.set_cache_headers(path, modified, mime_type)
+        self.set_extra_headers(path)
+
+        data = None
+        if entry.size <= self.HOT_SIZE:
+            data = self._hot.get(variant)
+            if data is None:
+                with open(variant, 'rb') as f:
+                    data = f.read()
+                self._hot[variant] = data
+        if entry.etag is None:
+            entry.etag = '"%s"' % self.hash_file(variant, data)
+        self.set_header('Etag', entry.etag)
+
+        if self.not_modified(entry.etag, modified):
+            self.set_status(304)
+            self.finish()
+            return
+
+        self.set_header('Content-Length', entry.size)
+        if not include_body:
+            self.finish()
+        elif data is not None:
+            self.finish(data)
+        else:
+            self.send_mapped(variant, entry.size)
+
+    def resolve(self, path):
+        """The absolute path to serve, with the checks of Tornado's handler"""
+        path = self.parse_url_path(path)
+        abspath = os.path.abspath(os.path.join(self.root, path))
+        if not (abspath + os.path.sep).startswith(self.root):
+            raise tornado.web.HTTPError(403, "%s is not in root static directory", path)
+        if os.path.isdir(abspath) and self.default_filename is not None:
+            if not self.request.path.endswith("/"):
+                self.redirect(self.request.path + "/")
+                return None
+            abspath = os.path.join(abspath, self.default_filename)
+        if not os.path.exists(abspath):
+            raise tornado.web.HTTPError(404)
+        if not os.path.isfile(abspath):
+            raise tornado.web.HTTPError(403, "%s is not a file", path)
+        return abspath
+
+    def select_variant(self, abspath):
+        """(path, content encoding) of the file to send"""
+        accepted = self.request.headers.get('Accept-Encoding')
+        for encoding, suffix in ENCODINGS:
+            if accepts_encoding(accepted, encoding) and os.path.isfile(abspath + suffix):
+                return abspath + suffix, encoding
+        return abspath, None
+
+    def set_cache_headers(self, path, modified, mime_type):
+        if 'v' in self.request.arguments or path.startswith(BUILD_DIR + '/'):
+            self.set_header('Expires', datetime.datetime.utcnow() +
+                                       datetime.timedelta(seconds=self.IMMUTABLE_MAX_AGE))
+            self.set_header('Cache-Control', 'public, max-age=%d, immutable' % self.IMMUTABLE_MAX_AGE)
+        else:
+            cache_time = self.get_cache_time(path, modified, mime_type)
+            if cache_time > 0:
+                self.set_header('Expires', datetime.datetime.utcnow() +
+                                           datetime.timedelta(seconds=cache_time))
+                self.set_header('Cache-Control', 'max-age=' + str(cache_time))
+            else:
+                self.set_header('Cache-Control', 'public')
+
+    def not_modified(self, etag, modified):
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match.strip() == '*' or \
+                etag in [tag.strip() for tag in if_none_match.split(',')]
+        ims_value = self.request.headers.get('If-Modified-Since')
+        if ims_value is not None:
+            date_tuple = email.utils.parsedate(ims_value)
+            if date_tuple is not None:
+                return datetime.datetime(*date_tuple[:6]) >= modified
+        return False
+
+    @staticmethod
+    def hash_file(path, data=None):
+        if data is not None:
+            return hashlib.sha1(data).hexdigest()
+        hasher = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), ''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    def send_mapped(self, path, size):
+        """Stream `path` from a memory map, one chunk per flush so a slow
+        client doesn't make us buffer the whole file"""
+        with open(path, 'rb') as f:
+            self._mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        state = {'offset': 0}
+
+        def send_next():
+            if self._mapped is None or self.request.connection.stream.closed():
+                self.unmap()
+                return
+            offset = state['offset']
+            if offset >= size:
+                self.unmap()
+                self.finish()
+                return
+            state['offset'] = offset + self.CHUNK_SIZE
+            self.write(self._mapped[offset:offset + self.CHUNK_SIZE])
+            self.flush(callback=send_next)
+        send_next()
+
+    def unmap(self):
+        mapped, self._mapped = getattr(self, '_mapped', None), None
+        if mapped is not None:
+            mapped.close()
+
+    def on_connection_close(self):
+        # the flush callback never comes once the client is gone
+        self.unmap()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    templating: compiled template cache for production
+
+    In production the application precompiles every template under
+    `template_path` at boot, so no request pays the compile cost, and
+    keeps the compiled code on disk, so a restart doesn't pay it either.
+
+    It also compiles streaming variants of the templates, for
+    RequestHandler.render_stream: their output goes to the client every
+    `size` bytes instead of being joined at the end.
+"""
+import os
+import re
+import sys
+import copy
+import marshal
+import hashlib
+import logging
+
+import tornado
+import tornado.web
+import tornado.escape
+import tornado.template
+
+from bootornado.utils import private_directory
+
+TEMPLATE_EXTENSIONS = ('.html', '.htm')
+
+
+def fingerprint(root):
+    """Hash of every template under `root`, plus the versions the compiled
+    code depends on. Templates inline their ancestors when compiled, so a
+    change to any file invalidates the whole cache."""
+    sha = hashlib.sha1('%s %s' % (tornado.version, sys.version))
+    for dirpath, dirnames, filenames in sorted(os.walk(root)):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            sha.update(path)
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
+class CachedTemplate(tornado.template.Template):
+    """A template built from compiled code read back from the disk cache,
+    without parsing or compiling its source."""
+    def __init__(self, source, name, loader, code, compiled):
+        self.name = name
+        self.source = source
+        self.loader = loader
+        self.namespace = loader.namespace
+        self.autoescape = loader.autoescape
+        self.code = code
+        self.compiled = compiled
+
+    def __getattr__(self, name):
+        # the parse tree is only needed to compile a template extending this
+        # one; parse it on demand
+        if name == 'file':
+            self.file = tornado.template.Template(self.source, self.name, self.loader).file
+            return self.file
+        raise AttributeError(name)
+
+
+class PersistentLoader(tornado.template.Loader):
+    """Loader keeping the compiled code of its templates in `cache_path`.
+    The code found there is executed, so the directory must be private to
+    the user running the server."""
+    def __init__(self, root_directory, cache_path, **kwargs):
+        tornado.template.Loader.__init__(self, root_directory, **kwargs)
+        self.cache_path = private_directory(cache_path)
+        self.fingerprint = fingerprint(self.root)
+
+    def _cache_file(self, name):
+        key = hashlib.sha1('%s %s %r' % (self.fingerprint, name, self.autoescape)).hexdigest()
+        return os.path.join(self.cache_path, key + '.tpl')
+
+    def _create_template(self, name):
+        with open(os.path.join(self.root, name)) as f:
+            source = f.read()
+        cache_file = self._cache_file(name)
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    code, compiled = marshal.load(f)
+                return CachedTemplate(source, name, self, code, compiled)
+            except (EOFError, ValueError, TypeError), ex:
+                logging.warning('bad compiled template %s: %s', cache_file, ex)
+
+        template = tornado.template.Template(source, name=name, loader=self)
+        tmp = '%s.%d' % (cache_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            marshal.dump((template.code, template.compiled), f)
+        os.rename(tmp, cache_file)
+        return template
+
+
+def create_loader(template_path, settings):
+    kwargs = {}
+    if "autoescape" in settings:
+        kwargs["autoescape"] = settings["autoescape"]
+    cache_path = settings.get('template_cache_path')
+    if cache_path:
+        return PersistentLoader(template_path, cache_path, **kwargs)
+    return tornado.template.Loader(template_path, **kwargs)
+
+
+def precompile(settings):
+    """Compile every template under `template_path`, for every directory a
+    handler may use as its template path, and install the loaders where
+    `RequestHandler.render` will find them."""
+    root = settings['template_path']
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        loader = create_loader(dirpath, settings)
+        for subpath, subdirnames, subfilenames in os.walk(dirpath):
+            for filename in subfilenames:
+                if os.path.splitext(filename)[1] in TEMPLATE_EXTENSIONS:
+                    loader.load(os.path.relpath(os.path.join(subpath, filename), dirpath))
+                    count += 1
+        with tornado.web.RequestHandler._template_loader_lock:
+            tornado.web.RequestHandler._template_loaders[dirpath] = loader
+    logging.info('precompiled %d templates under %s', count, root)
+
+
+class StreamBuffer(list):
+    """The `_buffer` of a streaming template: sends what it holds to the
+    handler whenever it reaches `size` bytes, or on `flush()`"""
+    def __init__(self, handler, size):
+        list.__init__(self)
+        self.handler = handler
+        self.size = size
+        self.pending = 0
+
+    def append(self, chunk):
+        list.append(self, chunk)
+        self.pending += len(chunk)
+        if self.pending >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self:
+            self.handler.write(''.join(self))
+            del self[:]
+            self.pending = 0
+        self.handler.flush()
+
+
+# the output list of the template body; nested {% apply %} bodies keep theirs
+_TOP_BUFFER = re.compile(r'^(    _buffer = )\[\]', re.M)
+
+def streaming(template):
+    """A copy of `template` writing through `_stream_buffer()`, which its
+    namespace has to provide"""
+    stream = getattr(template, '_streaming', None)
+    if stream is None:
+        stream = copy.copy(template)
+        stream.code = _TOP_BUFFER.sub(r'\1_stream_buffer()', template.code, 1)
+        stream.compiled = compile(
+            tornado.escape.to_unicode(stream.code),
+            "%s.generated.py" % template.name.replace('.', '_'),
+            "exec")
+        template._streaming = stream
+    return stream
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    uimethods: functions the templates call, with the handler as first
+    argument
+"""
+from bootornado.assets import static_bundle
+
+
+def early_flush(handler):
+    """Sends what a streaming render (RequestHandler.render_stream) has
+    produced so far, e.g. the <head> and the page header, while the rest is
+    generated. Does nothing in a plain render."""
+    buffer = getattr(handler, '_stream_buffer', None)
+    if buffer is not None:
+        buffer.flush()
+    return ''
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    uimodules: UI modules the templates use with {% module ... %}
+"""
+import tornado.web
+
+from bootornado.utils import TTLCache
+
+__all__ = ['CachedFragment']
+
+
+class CachedFragment(tornado.web.UIModule):
+    """Renders a sub-template once per key and TTL, then serves it from a
+    bounded in-process cache:
+
+        {% module CachedFragment("modules/nav.html", ttl=300, vary_user=True) %}
+
+    The key is the template name, the `key` argument, the locale and, with
+    `vary_user`, the current user. The other keyword arguments go to the
+    template and are not part of the key: whatever changes the output has to
+    be in `key`. In debug the fragment is rendered every time.
+    """
+    cache = TTLCache(4096)
+
+    def render(self, template, key=None, ttl=60, vary_user=False, vary_locale=True, **kwargs):
+        if self.handler.settings.get('debug'):
+            return self.render_string(template, **kwargs)
+
+        user = None
+        if vary_user and self.current_user:
+            user = self.current_user
+            if isinstance(user, dict):
+                user = user.get('id') or user.get('username') or repr(sorted(user.items()))
+            else:
+                user = getattr(user, 'id', None) or getattr(user, 'username', None) or repr(user)
+        cache_key = (self.handler.get_template_path(), template, key, user,
+                     self.locale.code if vary_locale else None)
+        fragment = self.cache.get(cache_key)
+        if fragment is None:
+            fragment = self.render_string(template, **kwargs)
+            self.cache.set(cache_key, fragment, ttl)
+        return fragment
+
+    @classmethod
+    def invalidate(cls):
+        cls.cache.clear()
@@ -12,10 +12,11 @@ __all__ = [
   "safeunicode", "safestr", "utf8",
   "TimeoutError", "timelimit",
   "Memoize", "memoize",
+  "TTLCache", "ttlcache",
   "re_compile", "re_subm",
   "group", "uniq", "iterview",
   "IterBetter", "iterbetter",
-  "safeiter", "safewrite",
+  "safeiter", "safewrite", "private_directory",
   "dictreverse", "dictfind", "dictfindall", "dictincr", "dictadd",
   "requeue", "restack",
   "listget", "intget", "datestr",
@@ -32,11 +33,6 @@ __all__ = [
 
 import re, sys, time, threading, itertools, traceback, os
 
-try:
-    import subprocess
-except ImportError: 
-    subprocess = None
-
 try: import datetime
 except ImportError: pass
 
@@ -506,6 +502,95 @@ class Memoize:
 
 memoize = Memoize
 
+class TTLCache:
+    """
+    A bounded cache whose entries expire `ttl` seconds after being set.
+    When it's full, the least recently used entry is evicted.
+    
+        >>> c = TTLCache(2, ttl=60)
+        >>> c['a'] = 1
+        >>> c['b'] = 2
+        >>> c.get('a')
+        1
+        >>> c['c'] = 3
+        >>> 'b' in c
+        False
+        >>> c.set('d', 4, ttl=.1)
+        >>> import time
+        >>> time.sleep(.2)
+        >>> c.get('d', 'gone')
+        'gone'
+    """
+    def __init__(self, maxsize=1024, ttl=None):
+        from collections import OrderedDict
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict() # key -> (value, expiry time)
+        self.lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, expires = self.data.pop(key)
+            except KeyError:
+                return default
+            if expires and expires < time.time():
+                return default
+            self.data[key] = value, expires
+            return value
+    
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value, ttl and time.time() + ttl
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+    
+    __setitem__ = set
+    
+    def update(self, key, function, default=None, ttl=None):
+        """Sets `key` to what `function` returns for its current value (or
+        `default`) in one step, and returns it.
+        
+            >>> c = TTLCache()
+            >>> c.update('n', lambda n: n + 1, 0), c.update('n', lambda n: n + 1, 0)
+            (1, 2)
+        """
+        ttl = ttl or self.ttl
+        with self.lock:
+            entry = self.data.pop(key, None)
+            if entry is None or (entry[1] and entry[1] < time.time()):
+                entry = default, None
+            value = function(entry[0])
+            self.data[key] = value, ttl and time.time() + ttl
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return value
+    
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError, key
+        return value
+    
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.data.pop(key, None)
+        return entry[0] if entry else default
+    
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+ttlcache = TTLCache
+
 re_compile = memoize(re.compile) #@@ threadsafe?
 re_compile.__doc__ = """
 A memoized version of re.compile.
@@ -723,6 +808,38 @@ def safewrite(filename, content):
     f.close()
     os.rename(f.name, filename)
 
+def private_directory(path):
+    """Creates the directory `path` readable and writable by the current
+    user only, and makes sure an existing one is owned by that user and
+    writable by nobody else, so no one else can plant files we'd load.
+    Returns the absolute path.
+
+        >>> import tempfile
+        >>> root = private_directory(os.path.join(tempfile.mkdtemp(), 'cache'))
+        >>> oct(os.stat(root).st_mode & 0777)
+        '0700'
+        >>> os.chmod(root, 0777)
+        >>> try: private_directory(root)
+        ... except OSError: print 'refused'
+        refused
+    """
+    path = os.path.abspath(path)
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path, 0700)
+        except OSError:
+            # created meanwhile, by another worker or someone else
+            if not os.path.isdir(path):
+                raise
+    st = os.lstat(path)
+    if not os.path.isdir(path) or os.path.islink(path):
+        raise OSError('%s is not a directory' % path)
+    if st.st_uid != os.getuid():
+        raise OSError('%s is owned by another user' % path)
+    if st.st_mode & 0022:
+        raise OSError('%s is writable by other users' % path)
+    return path
+
 def dictreverse(mapping):
     """
     Returns a new dictionary with keys and values swapped.
@@ -1503,6 +1620,11 @@ class _EmailMessage:
                 
             cmd = [sendmail, '-f', self.from_address] + self.recipients
 
+            try:
+                import subprocess
+            except ImportError:
+                subprocess = None
+
             if subprocess:
                 p = subprocess.Popen(cmd, stdin=subprocess.PIPE)
                 p.stdin.write(message_text)
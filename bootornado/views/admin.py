@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    views: admin.py
+"""
+import hmac
+
+import tornado.web
+
+from tornado_utils.routes import route
+
+from bootornado.views.base import GeneralHandler
+
+
+@route(r'/admin/metrics', name='admin.metrics')
+class Metrics(GeneralHandler):
+    """Request metrics in the Prometheus text format: of all the workers
+    when the server runs several (see bootornado.metrics.WorkerMetrics),
+    of this process otherwise. Denied unless the request comes from an address in the "metrics_allow"
+    setting, or carries the "metrics_token" setting as a bearer token.
+    Behind a proxy every request comes from the proxy's address, so list
+    only the scraper's there, or use the token."""
+    def get(self):
+        if not self.allowed():
+            raise tornado.web.HTTPError(403)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        workers = getattr(self.application, 'worker_metrics', None)
+        if workers is not None:
+            self.finish(workers.combined().expose(process=False))
+        else:
+            self.finish(self.application.metrics.expose())
+
+    def allowed(self):
+        token = self.settings.get('metrics_token')
+        if token:
+            given = self.request.headers.get('Authorization', '')
+            if hmac.compare_digest(given, 'Bearer ' + token):
+                return True
+        return self.request.remote_ip in (self.settings.get('metrics_allow') or ())
@@ -4,18 +4,25 @@
     views: base.py
 """
 import os
+import time
+import hashlib
+import calendar
+import datetime
+import email.utils
 
 import logging
 import tornado.web
 import tornado.locale
 import tornado.escape
+import tornado.stack_context
 import urlparse
 
+import bootornado.templating
+import bootornado.pagination
 from sessions.session import SessionMixin
+from sessions.notification import NotificationMixin
+from bootornado.pagecache import PageCacheMixIn
 
-from pygments import highlight
-from pygments.lexers import get_lexer_for_filename
-from pygments.formatters import HtmlFormatter
 
 try:
     from urllib import urlencode  # py2
@@ -58,13 +65,339 @@ class FlashMessageMixIn(object):
         messages = self.messages()
         self.clear_cookie('flash_messages')
         return messages
-class RequestHandler(tornado.web.RequestHandler,  FlashMessageMixIn,SessionMixin):
+class NotificationFlashMixIn(object):
+    """
+        Flash messages kept server side in the notifications instead of in a
+        signed cookie; same API as FlashMessageMixIn. A one-byte "flash"
+        cookie marks that messages are waiting, so requests without it decode
+        nothing and send no extra header.
+
+        The waiting messages are loaded by the prefetch stage (see
+        RequestHandler.prefetch), or on first use by the pages that don't
+        prefetch: render() waits for them before rendering.
+    """
+    FLASH_CHANNEL = 'flash_messages'
+    FLASH_COOKIE  = 'flash'
+
+    def flash(self, message, category='message'):
+        if not getattr(self, '_flashes', None):
+            self._flashes = []
+            self.set_cookie(self.FLASH_COOKIE, '1')
+        self._flashes.append((category, message))
+
+    def has_flashed_messages(self):
+        return self.get_cookie(self.FLASH_COOKIE) == '1'
+
+    def load_flashed_messages(self, callback):
+        """Load the waiting messages, unless the prefetch stage did, then
+        run `callback`"""
+        prefetched = self.__dict__.setdefault('prefetched', {})
+        if not self.has_flashed_messages() or self.FLASH_CHANNEL in prefetched:
+            return callback()
+
+        def on_found(found):
+            prefetched[self.FLASH_CHANNEL] = found.get(self.FLASH_CHANNEL)
+            if found:
+                # deleted once shown, like the prefetched notifications
+                self._delivered_channels = (getattr(self, '_delivered_channels', None) or []) + list(found)
+            callback()
+        self.notifications.get_many((self.FLASH_CHANNEL,), on_found)
+
+    def after_flashed_messages(self, callback):
+        """Run `callback` once the messages are loaded, keeping the request
+        open if that takes a trip to the datastore"""
+        done = []
+        def run():
+            done.append(True)
+            callback()
+        self.load_flashed_messages(run)
+        if not done:
+            self._auto_finish = False
+
+    def render(self, template_name, **kwargs):
+        self.after_flashed_messages(
+            lambda: super(NotificationFlashMixIn, self).render(template_name, **kwargs))
+
+    def get_flashed_messages(self):
+        if not self.has_flashed_messages():
+            return []
+        # with a networked datastore this is only in time from render()
+        self.load_flashed_messages(lambda: None)
+        prefetched = self.prefetched
+        if self.FLASH_CHANNEL not in prefetched:
+            return []
+        if not getattr(self, '_flashes', None):
+            self.clear_cookie(self.FLASH_COOKIE)
+        messages, prefetched[self.FLASH_CHANNEL] = prefetched[self.FLASH_CHANNEL], []
+        return messages or []
+
+    def finish(self, chunk=None):
+        prefetched = getattr(self, 'prefetched', {})
+        flashes = getattr(self, '_flashes', [])
+        try:
+            if self.FLASH_CHANNEL in prefetched:
+                # keep the new messages, and the loaded ones nobody displayed
+                messages = (prefetched[self.FLASH_CHANNEL] or []) + flashes
+                if messages:
+                    self.notifications.set(self.FLASH_CHANNEL, messages)
+            elif flashes:
+                # add them to the ones waiting that this request didn't load
+                self.notifications.update(self.FLASH_CHANNEL,
+                                          lambda waiting: (waiting or []) + flashes)
+        except tornado.web.HTTPError:
+            logging.warning('flash messages lost, notifications unavailable')
+        super(NotificationFlashMixIn, self).finish(chunk)
+
+class RequestHandler(PageCacheMixIn, NotificationFlashMixIn, tornado.web.RequestHandler, SessionMixin,NotificationMixin):
+    # session keys and notification channels the handler needs; they're
+    # loaded together by prefetch() and kept in self.prefetched
+    prefetch_session       = ()
+    prefetch_notifications = ()
+    # hash the output as it's written, for the ETag, instead of all of it
+    # again in finish()
+    incremental_etag       = False
+
+    def get_secure_cookie(self, name, value=None, max_age_days=31):
+        """Each secure cookie is verified and decoded once per request, then
+        served from a per-request cache. After a secret rotation, the old
+        secrets in the "cookie_secret_fallbacks" setting are tried only when
+        the current one fails."""
+        cache = self.__dict__.setdefault('_secure_cookies', {})
+        if value is None:
+            if name in cache:
+                return cache[name]
+            value = self.get_cookie(name)
+        if not value:
+            decoded = None
+        else:
+            decoded = tornado.web.RequestHandler.get_secure_cookie(self, name, value, max_age_days)
+            for secret in self.settings.get('cookie_secret_fallbacks', ()):
+                if decoded is not None:
+                    break
+                decoded = tornado.web.decode_signed_value(secret, name, value, max_age_days=max_age_days)
+        if value == self.get_cookie(name):
+            cache[name] = decoded
+        return decoded
+
+    def set_secure_cookie(self, name, value, expires_days=30, **kwargs):
+        # later reads in this request see the new value
+        tornado.web.RequestHandler.set_secure_cookie(self, name, value, expires_days, **kwargs)
+        self.__dict__.setdefault('_secure_cookies', {})[name] = value
+
+    def clear_cookie(self, name, path="/", domain=None):
+        tornado.web.RequestHandler.clear_cookie(self, name, path, domain)
+        self.__dict__.setdefault('_secure_cookies', {})[name] = None
+
+    @property
+    def request_deadline(self):
+        """When the client gives up on the request, from the "request_timeout"
+        setting; session datastore calls never wait past it."""
+        timeout = self.settings.get('request_timeout')
+        if timeout:
+            return self.request._start_time + timeout
+
+    def on_session_unavailable(self, callback):
+        """What the request gets when the session datastore is down or too
+        slow, per the "degraded" session setting: "anonymous" goes on with an
+        empty session, "cached" with the userinfo still cached for it, and
+        "unavailable" (the default) answers 503."""
+        mode = self.settings['session'].get('degraded', 'unavailable')
+        if mode == 'anonymous':
+            callback({})
+        elif mode == 'cached':
+            cache = getattr(self.application, 'userinfo_cache', None)
+            session_id = self.session.session_id
+            userinfo = cache is not None and session_id and cache.get(session_id)
+            callback({'userinfo': userinfo} if userinfo else {})
+        else:
+            raise tornado.web.HTTPError(503)
+
+    def create_template_loader(self, template_path):
+        return bootornado.templating.create_loader(template_path, self.settings)
+
+    def render_string(self, template_name, **kwargs):
+        # the time spent rendering, for the metrics; templates rendered
+        # inside another one (UI modules) are counted once
+        if getattr(self, '_rendering', False):
+            return tornado.web.RequestHandler.render_string(self, template_name, **kwargs)
+        self._rendering = True
+        started = time.time()
+        try:
+            return tornado.web.RequestHandler.render_string(self, template_name, **kwargs)
+        finally:
+            self._rendering = False
+            self.render_seconds = getattr(self, 'render_seconds', 0.0) + time.time() - started
+
+    def on_finish(self):
+        metrics = getattr(self.application, 'metrics', None)
+        if metrics is not None:
+            route_names = getattr(self.application, 'route_names', {})
+            metrics.observe(route_names.get(self.__class__, self.__class__.__name__),
+                            self.get_status(), self.request.request_time(),
+                            getattr(self, 'session_seconds', 0.0),
+                            getattr(self, 'render_seconds', 0.0))
+
+    def render_stream(self, template_name, **kwargs):
+        """Like render(), but the page goes out as it's generated: every
+        "stream_buffer_size" bytes (16KB by default), and wherever the
+        template calls {{ early_flush() }}. A loop over a generator sends
+        its rows as they come, and the page is never whole in memory.
+
+        The headers are sent with the first chunk, so an exception in the
+        middle of the template can't turn into an error page, and the
+        CSS/JS of UI modules is not injected."""
+        self.after_flashed_messages(lambda: self._render_stream(template_name, **kwargs))
+
+    def _render_stream(self, template_name, **kwargs):
+        template_path = self.get_template_path()
+        with tornado.web.RequestHandler._template_loader_lock:
+            loader = tornado.web.RequestHandler._template_loaders.get(template_path)
+            if loader is None:
+                loader = self.create_template_loader(template_path)
+                tornado.web.RequestHandler._template_loaders[template_path] = loader
+        template = bootornado.templating.streaming(loader.load(template_name))
+        size = self.settings.get('stream_buffer_size', 16 * 1024)
+
+        def stream_buffer():
+            self._stream_buffer = bootornado.templating.StreamBuffer(self, size)
+            return self._stream_buffer
+        namespace = self.get_template_namespace()
+        namespace.update(kwargs)
+        namespace['_stream_buffer'] = stream_buffer
+        self._rendering = True
+        started = time.time()
+        try:
+            rest = template.generate(**namespace)
+        finally:
+            self._stream_buffer = None
+            self._rendering = False
+            self.render_seconds = getattr(self, 'render_seconds', 0.0) + time.time() - started
+        self.finish(rest)
+
+    def _execute(self, transforms, *args, **kwargs):
+        # the declared session keys and notifications are loaded before
+        # prepare() and the handler method run
+        execute = lambda: tornado.web.RequestHandler._execute(self, transforms, *args, **kwargs)
+        if not self.prefetch_session and not self.prefetch_notifications:
+            return execute()
+        self._transforms = transforms
+        try:
+            with tornado.stack_context.ExceptionStackContext(self._stack_context_handle_exception):
+                self.prefetch(execute)
+        except Exception, e:
+            self._handle_request_exception(e)
+
+    def get_prefetch_session(self):
+        return self.prefetch_session
+
+    def get_prefetch_notifications(self):
+        channels = tuple(self.prefetch_notifications)
+        if self.has_flashed_messages():
+            channels += (self.FLASH_CHANNEL,)
+        return channels
+
+    def prefetch(self, callback):
+        """Load the declared session keys and notification channels before
+        the handler body runs. The session is read in one call and the
+        notifications in another, issued concurrently; afterwards the
+        session is served from memory for the rest of the request."""
+        self.prefetched = {}
+        keys = self.get_prefetch_session()
+        channels = self.get_prefetch_notifications()
+        pending = [load for load in (keys, channels) if load]
+        if not pending:
+            return callback()
+
+        def loaded(values):
+            self.prefetched.update(values)
+            pending.pop()
+            if not pending:
+                callback()
+        if keys:
+            self.session.prefetch(lambda session: loaded(
+                dict((key, session.get(key)) for key in keys)))
+        def on_notifications(found):
+            self._delivered_channels = list(found)
+            loaded(dict((channel, found.get(channel)) for channel in channels))
+        if channels:
+            self.notifications.get_many(channels, on_notifications)
+
+    def finish(self, chunk=None):
+        # the prefetched notifications are gone once a page showed them; a
+        # redirect to the login page, an error or a page cache refresh,
+        # which nobody sees, leaves them for the next
+        delivered = getattr(self, '_delivered_channels', None)
+        if delivered and self.get_status() == 200 and \
+                not getattr(self.request, 'page_cache_refresh', False):
+            self._delivered_channels = None
+            try:
+                self.notifications.delete(*delivered)
+            except tornado.web.HTTPError:
+                logging.warning('notifications unavailable, %s delivered again', delivered)
+        super(RequestHandler, self).finish(chunk)
+
+    def write(self, chunk):
+        tornado.web.RequestHandler.write(self, chunk)
+        if self.incremental_etag:
+            if getattr(self, '_etag_hash', None) is None:
+                self._etag_hash = hashlib.sha1()
+            self._etag_hash.update(self._write_buffer[-1])
+
+    def clear(self):
+        tornado.web.RequestHandler.clear(self)
+        self._etag_hash = None
+
+    def compute_etag(self):
+        if not self.incremental_etag:
+            return tornado.web.RequestHandler.compute_etag(self)
+        hasher = getattr(self, '_etag_hash', None) or hashlib.sha1()
+        return '"%s"' % hasher.hexdigest()
+
+    def is_not_modified(self, etag=None, last_modified=None):
+        """Send the validators of the resource, and tell whether the client
+        already has it, in which case the status is set to 304 and the
+        handler only has to finish:
+
+            if self.is_not_modified(last_modified=post.updated):
+                return
+            self.render(...)
+
+        `last_modified` is a UTC datetime or a timestamp."""
+        if etag is not None:
+            if not etag.startswith(('"', 'W/"')):
+                etag = '"%s"' % etag
+            self.set_header('Etag', etag)
+        if last_modified is not None:
+            if not isinstance(last_modified, datetime.datetime):
+                last_modified = datetime.datetime.utcfromtimestamp(last_modified)
+            last_modified = last_modified.replace(microsecond=0)
+            self.set_header('Last-Modified', last_modified)
+
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            current = if_none_match.strip() == '*' or (etag is not None and
+                etag in [tag.strip() for tag in if_none_match.split(',')])
+        elif last_modified is not None and self.request.headers.get('If-Modified-Since'):
+            since = email.utils.parsedate(self.request.headers['If-Modified-Since'])
+            current = since is not None and \
+                calendar.timegm(since) >= calendar.timegm(last_modified.utctimetuple())
+        else:
+            current = False
+        if current:
+            self.set_status(304)
+        return current
+
     def get_error_html(self, status_code, **kwargs):
         if self.settings.get('debug', False) is False:
             self.set_status(status_code)
             return self.render_string('errors/%s.html' % status_code)
 
         else:
+            # only the debug pages need pygments, keep it out of startup
+            from pygments import highlight
+            from pygments.lexers import get_lexer_for_filename
+            from pygments.formatters import HtmlFormatter
+
             def get_snippet(fp, target_line, num_lines):
                 if fp.endswith('.html'):
                     fp = os.path.join(self.get_template_path(), fp)
@@ -91,6 +424,19 @@ class RequestHandler(tornado.web.RequestHandler,  FlashMessageMixIn,SessionMixin
                                       status_code=status_code, 
                                       kwargs=kwargs)
     
+    def paginate(self, source, per_page=20, key=None, reverse=False, name='cursor'):
+        """The page of `source` after the cursor in the `name` argument,
+        see bootornado.pagination. A malformed cursor is a 400."""
+        try:
+            return bootornado.pagination.paginate(
+                source, self.get_argument(name, None), per_page, key, reverse)
+        except bootornado.pagination.InvalidCursor:
+            raise tornado.web.HTTPError(400)
+
+    def page_url(self, page, name='cursor'):
+        """The url of the page after `page`, or None"""
+        return page.url(self.request.path, self.request.arguments, name)
+
     def get_args(self, key, default=None, type=None):
         if type==list:
             if default is None: default = []
@@ -118,22 +464,52 @@ class GeneralHandler(RequestHandler):
         return None
 
 class FrontHandler(RequestHandler):
+    incremental_etag = True
     def get_template_path(self):
         return os.path.join(self.settings.get('template_path'),"front")
 class AdminHandler(RequestHandler):
+    incremental_etag = True
     def get_template_path(self):
         return os.path.join(self.settings.get('template_path'),"admin")
         
 class AsynAuthHandler(RequestHandler):
     '''
         you shuld use _get_,_post_,_put_,_delete_ and self.finish() end.
+        add what _get_ etc. need to prefetch_session/prefetch_notifications
+        to load it along with userinfo.
     '''
+    def _execute(self, transforms, *args, **kwargs):
+        # authenticate() prefetches along with the userinfo
+        tornado.web.RequestHandler._execute(self, transforms, *args, **kwargs)
+
+    def get_prefetch_session(self):
+        return ('userinfo',) + tuple(self.prefetch_session)
+
+    def authenticate(self, callback):
+        """Resolve the userinfo for the auth check. A hit in the in-process
+        userinfo cache skips the session store, unless the handler also
+        needs other session keys or notifications."""
+        cache = getattr(self.application, 'userinfo_cache', None)
+        session_id = self.session.session_id
+        if cache is not None and session_id:
+            userinfo = cache.get(session_id)
+            if userinfo and not self.prefetch_session and not self.get_prefetch_notifications():
+                self.prefetched = {'userinfo': userinfo}
+                return callback(userinfo)
+
+        def on_prefetch():
+            userinfo = self.prefetched.get('userinfo')
+            if cache is not None and session_id and userinfo:
+                cache.set(session_id, userinfo)
+            callback(userinfo)
+        self.prefetch(on_prefetch)
+
     @tornado.web.asynchronous 
     @tornado.gen.engine
     def get(self,*args,**kwargs):
         if not hasattr(self,'_get_'):
             raise tornado.web.HTTPError(405)   
-        userinfo = yield tornado.gen.Task( self.session.get,'userinfo' )
+        userinfo = yield tornado.gen.Task( self.authenticate )
         if not userinfo:
             url = self.get_login_url()
             if "?" not in url:
@@ -151,7 +527,7 @@ class AsynAuthHandler(RequestHandler):
     def post(self,*args,**kwargs):
         if not hasattr(self,'_post_'):
             raise tornado.web.HTTPError(405)   
-        userinfo = yield tornado.gen.Task( self.session.get,'userinfo' )
+        userinfo = yield tornado.gen.Task( self.authenticate )
         if not userinfo:
             raise tornado.web.HTTPError(403) 
         self._post_(*args,**kwargs)
@@ -160,7 +536,7 @@ class AsynAuthHandler(RequestHandler):
     def put(self,*args,**kwargs):
         if not hasattr(self,'_put_'):
             raise tornado.web.HTTPError(405)   
-        userinfo = yield tornado.gen.Task( self.session.get,'userinfo' )
+        userinfo = yield tornado.gen.Task( self.authenticate )
         if not userinfo:
             raise tornado.web.HTTPError(403) 
         self._put_(*args,**kwargs)
@@ -169,7 +545,7 @@ class AsynAuthHandler(RequestHandler):
     def delete(self,*args,**kwargs):
         if not hasattr(self,'_delete_'):
             raise tornado.web.HTTPError(405)   
-        userinfo = yield tornado.gen.Task( self.session.get,'userinfo' )
+        userinfo = yield tornado.gen.Task( self.authenticate )
         if not userinfo:
             raise tornado.web.HTTPError(403) 
         self.userinfo = userinfo
@@ -3,8 +3,6 @@
 """
     views: web.py
 """
-import simplejson
-import logging
 import tornado.web
 import tornado.escape
 
@@ -12,16 +10,18 @@ from datetime import datetime
 from tornado_utils.routes import route
 
 from bootornado.views.base import FrontAsynAuthHandler,FrontHandler
+from bootornado import pagecache
 
 
 @route(r'/', name='index')
 class Index(FrontAsynAuthHandler):
+    prefetch_session = ('user_id',)
+
     def _get_(self):
-        page_obj = []        
-        page_url = None
+        page_obj = self.paginate([])
+        page_url = self.page_url(page_obj)
         user_id  = None
         if "user_id" in self.session:
-        	logging.error( self.session["user_id"] )
         	user_id = self.session["user_id"]
         if user_id:
         	user_id = user_id + "_" + user_id
@@ -30,11 +30,12 @@ class Index(FrontAsynAuthHandler):
         self.session["user_id"] = user_id
 
         self.session_end()
-        self.render("index.html", 
+        self.render_stream("index.html", 
                     page_obj = page_obj,
                     page_url = page_url)
 @route(r'/auth/login',name='auto.login')
 class AuthLogin(FrontHandler):
+    @pagecache.cached(ttl=60, stale=600)
     def get(self):
         page_obj = []        
         page_url = None
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+    watchdog: finds the callbacks that block the IOLoop
+
+    A heartbeat scheduled on the IOLoop every `interval` seconds measures
+    how late it runs: that lag is how long the requests waiting behind the
+    current callback were stalled. A sampling thread watches the heartbeat,
+    and when it is more than `threshold` seconds late, captures the stack
+    of the IOLoop's thread while the blocking call is still on it, and logs
+    it with the handler being served:
+
+        IOLoop blocked for 0.25s in front.index (GET /): ...stack...
+        IOLoop was blocked for 1.32s in front.index (GET /)
+
+    Every lag is recorded in the `ioloop_lag` histogram of the application
+    metrics. Threads don't survive a fork, so each worker starts its own.
+"""
+import sys
+import time
+import thread
+import logging
+import threading
+import traceback
+
+import tornado.web
+import tornado.ioloop
+
+__all__ = ['Watchdog']
+
+
+class Watchdog(object):
+    """Use `Watchdog(application, threshold).start()` in the process
+    running the IOLoop"""
+    # at most this many frames are logged, the innermost ones
+    STACK_LIMIT = 30
+
+    def __init__(self, application, threshold=0.1, interval=None, io_loop=None):
+        self.application = application
+        self.threshold = threshold
+        self.interval = interval or threshold / 2.0
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.thread_id = None # of the IOLoop, known at the first heartbeat
+        self.expected = None # when the next heartbeat is due
+        self.reported = None # the heartbeat whose stall was logged
+        self.culprit = None
+        self.stalls = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.expected = time.time() + self.interval
+        self.io_loop.add_timeout(self.expected, self.beat)
+        sampler = threading.Thread(target=self.sample, name='ioloop-watchdog')
+        sampler.daemon = True
+        sampler.start()
+
+    def stop(self):
+        self.running = False
+
+    def beat(self):
+        now = time.time()
+        self.thread_id = thread.get_ident()
+        lag = max(now - self.expected, 0.0)
+        metrics = getattr(self.application, 'metrics', None)
+        if metrics is not None:
+            metrics.loop_lag.record(lag * 1e6)
+        if self.reported == self.expected:
+            logging.warning('IOLoop was blocked for %.2fs in %s', lag, self.culprit)
+        if self.running:
+            self.expected = now + self.interval
+            self.io_loop.add_timeout(self.expected, self.beat)
+
+    def sample(self):
+        while self.running:
+            time.sleep(self.interval / 2.0)
+            expected = self.expected
+            if self.thread_id is None or self.reported == expected or \
+                    time.time() - expected < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.reported = expected
+            self.stalls += 1
+            self.culprit = self.describe(frame)
+            logging.warning('IOLoop blocked for %.2fs in %s:\n%s',
+                            time.time() - expected, self.culprit,
+                            ''.join(traceback.format_stack(frame, self.STACK_LIMIT)))
+
+    def describe(self, frame):
+        """The handler running in `frame` or one of its callers"""
+        route_names = getattr(self.application, 'route_names', {})
+        while frame is not None:
+            handler = frame.f_locals.get('self')
+            if isinstance(handler, tornado.web.RequestHandler):
+                cls = handler.__class__
+                return '%s (%s %s)' % (route_names.get(cls, cls.__name__),
+                                       handler.request.method, handler.request.uri)
+            frame = frame.f_back
+        return 'a callback outside any handler'
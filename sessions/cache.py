@@ -0,0 +1,83 @@
+'''
+This module contains UserinfoCache, a per-process cache of the "userinfo"
+resolved for each session id, so that authenticated requests coming back to
+the same worker can skip the session store for the auth check.
+
+It's configured with a "userinfo_cache" dictionary in the "session" settings:
+"maxsize" and "ttl" (in seconds) bound it, and, when the engine is Redis,
+"pubsub" set to True makes every invalidation reach the other workers through
+a Redis channel. Without it, another worker may keep a stale entry for up to
+"ttl" seconds.
+'''
+
+import logging
+import os
+
+from bootornado.utils import TTLCache
+
+
+class UserinfoCache(object):
+    CHANNEL = 'bootornado:userinfo'
+
+    def __init__(self, maxsize=10000, ttl=30, pubsub=False, storage=None):
+        self.entries = TTLCache(maxsize, ttl)
+        self.pubsub = pubsub
+        self.storage = storage or {}
+        self.publisher = None
+        self.subscribed_pid = None
+
+    @classmethod
+    def from_settings(cls, session_settings):
+        settings = session_settings.get('userinfo_cache')
+        if not settings:
+            return None
+        return cls(storage=session_settings.get('storage'), **settings)
+
+    def get(self, session_id):
+        if self.pubsub:
+            self.__subscribe()
+        return self.entries.get(session_id)
+
+    def set(self, session_id, userinfo):
+        self.entries[session_id] = userinfo
+
+    def invalidate(self, *session_ids):
+        '''
+        Drops the entries of "session_ids" here, and in the other workers too
+        when "pubsub" is on.
+        '''
+
+        for session_id in session_ids:
+            self.entries.pop(session_id)
+        if self.pubsub and session_ids:
+            self.__publish(session_ids)
+
+    def __client(self):
+        import tornadoredis
+        client = tornadoredis.Client(host=self.storage.get('host', 'localhost'),
+                                     port=self.storage.get('port', 6379))
+        client.connect()
+        return client
+
+    def __publish(self, session_ids):
+        if self.publisher is None:
+            self.publisher = self.__client()
+        self.publisher.publish(self.CHANNEL, ' '.join(session_ids))
+
+    def __subscribe(self):
+        # subscribe once in every worker, after it has been forked
+        if self.subscribed_pid == os.getpid():
+            return
+        self.subscribed_pid = os.getpid()
+        self.entries.clear()
+        self.publisher = None
+        client = self.__client()
+
+        def on_message(message):
+            if message.kind == 'message':
+                for session_id in message.body.split():
+                    self.entries.pop(session_id)
+            elif message.kind == 'disconnect':
+                logging.warning('userinfo cache lost its invalidation channel')
+                self.subscribed_pid = None
+        client.subscribe(self.CHANNEL, lambda result: client.listen(on_message))
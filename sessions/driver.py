@@ -3,8 +3,10 @@ This module is for internal use, only. It contains datastore drivers to be used
 with the session and notification managers.
 '''
 from copy import copy
+import logging
+import os
 import pickle
-import tornadoredis
+import time
 import tornado.gen
 
 
@@ -29,11 +31,11 @@ class Driver(object):
 
         return self._to_dict(raw_session)
 
-    def set(self, session_id, session):
+    def set(self, session_id, session, callback=None):
         pickled_session = pickle.dumps(session)
         self._setup_client()
 
-        self._set_and_expire(session_id, pickled_session)
+        self._set_and_expire(session_id, pickled_session, callback)
 
 
 class RedisDriver(Driver):
@@ -46,13 +48,16 @@ class RedisDriver(Driver):
         self.settings = settings
 
     @tornado.gen.engine
-    def _set_and_expire(self, session_id, pickled_session):
+    def _set_and_expire(self, session_id, pickled_session, callback=None):
             
         yield tornado.gen.Task( self.client.set, session_id,pickled_session )
         yield tornado.gen.Task( self.client.expire, session_id,self.EXPIRE_SECONDS )
+        if callback:
+            callback()
 
     def _create_client(self):
         import redis
+        import tornadoredis
         if 'max_connections' in self.settings:
             connection_pool = redis.ConnectionPool(**self.settings)
             settings = copy(self.settings)
@@ -70,18 +75,20 @@ class RedisDriver(Driver):
         if callback:
             callback( self._to_dict(sesstion) )
 
-    def set(self, session_id, session):
+    def set(self, session_id, session, callback=None):
         pickled_session = pickle.dumps(session)
         self._setup_client()
-        self._set_and_expire(session_id, pickled_session)
+        self._set_and_expire(session_id, pickled_session, callback)
 
 
 class MemcachedDriver(Driver):
     def __init__(self, settings):
         self.settings = settings
 
-    def _set_and_expire(self, session_id, pickled_session):
+    def _set_and_expire(self, session_id, pickled_session, callback=None):
         self.client.set(session_id, pickled_session, self.EXPIRE_SECONDS)
+        if callback:
+            callback()
 
     def _create_client(self):
         import memcache
@@ -91,6 +98,140 @@ class MemcachedDriver(Driver):
         self.client = memcache.Client(servers, **settings)
 
 
+class StoreDriver(Driver):
+    '''
+    Base for drivers over an in-process bootornado.session.Store. There's no
+    network hop, so callbacks are run right away.
+    '''
+
+    DEFAULT_PATH = '/dev/shm/bootornado'
+
+    CLEANUP_INTERVAL = 60
+
+    # a driver is created for every request, the store only once per process
+    _stores = {}
+    _cleaned_at = {}
+
+    def __init__(self, settings, storage_category):
+        self.settings = settings
+        self.storage_category = storage_category
+
+    def _path(self, settings, extension):
+        root = settings.pop('path', self.DEFAULT_PATH)
+        return os.path.join(root, '%s.%s' % (self.storage_category, extension))
+
+    def _shared_store(self, store_class, path, *args, **kwargs):
+        store = self._stores.get(path)
+        if store is None:
+            store = self._stores[path] = store_class(path, *args, **kwargs)
+        return store
+
+    def get(self, session_id, callback=None):
+        self._setup_client()
+        try:
+            session = self.client[session_id]
+        except KeyError:
+            session = {}
+        if callback:
+            callback(session)
+        return session
+
+    def set(self, session_id, session, callback=None):
+        self._setup_client()
+        self.client[session_id] = session
+        self._cleanup()
+        if callback:
+            callback()
+
+    def _cleanup(self):
+        now = time.time()
+        if now - self._cleaned_at.get(id(self.client), 0) > self.CLEANUP_INTERVAL:
+            self._cleaned_at[id(self.client)] = now
+            self.client.cleanup(self.EXPIRE_SECONDS)
+
+
+class SharedMemoryDriver(StoreDriver):
+    '''
+    Keeps the sessions in a memory-mapped file shared by every worker
+    process on the host (see bootornado.session.SharedMemoryStore).
+    '''
+
+    def _create_client(self):
+        from bootornado.session import SharedMemoryStore
+        settings = copy(self.settings)
+        path = self._path(settings, 'shm')
+        settings.setdefault('ttl', self.EXPIRE_SECONDS)
+        self.client = self._shared_store(SharedMemoryStore, path, **settings)
+
+
+class MemoryDriver(StoreDriver):
+    '''
+    Keeps the sessions in the memory of the process. They're dumped to a
+    snapshot file on SIGTERM and loaded back on startup (see
+    bootornado.session.MemoryStore), so a restart doesn't log everyone out.
+    '''
+
+    def _create_client(self):
+        from bootornado.session import MemoryStore
+        settings = copy(self.settings)
+        self.client = self._shared_store(MemoryStore, self._path(settings, 'snapshot'),
+                                         self.EXPIRE_SECONDS)
+
+
+class CircuitBreaker(object):
+    '''
+    Fails fast when a datastore keeps failing: after "threshold" failures in a
+    row the breaker opens and calls are refused for "reset_timeout" seconds;
+    then a single trial call is let through, and its outcome closes the
+    breaker or opens it again. There's one breaker per datastore and process.
+    '''
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    _breakers = {}
+
+    def __init__(self, threshold=5, reset_timeout=10):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+
+    @classmethod
+    def get(cls, name, **settings):
+        breaker = cls._breakers.get(name)
+        if breaker is None:
+            breaker = cls._breakers[name] = cls(**settings)
+        return breaker
+
+    def is_open(self):
+        return self.state == self.OPEN and time.time() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        '''
+        Tells whether a call may go through now.
+        '''
+
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and not self.is_open():
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logging.error('session datastore failing, circuit breaker opened')
+            self.state = self.OPEN
+            self.opened_at = time.time()
+
+
 class DriverFactory(object):
     STORAGE_CATEGORIES = ('db_sessions', 'db_notifications')
 
@@ -112,3 +253,15 @@ class DriverFactory(object):
 
     def _create_memcached(self, storage_settings, storage_category):
         return MemcachedDriver(storage_settings)
+
+    def _create_shm(self, storage_settings, storage_category):
+        storage_settings = copy(storage_settings)
+        for category in self.STORAGE_CATEGORIES:
+            storage_settings.pop(category, None)
+        return SharedMemoryDriver(storage_settings, storage_category)
+
+    def _create_memory(self, storage_settings, storage_category):
+        storage_settings = copy(storage_settings)
+        for category in self.STORAGE_CATEGORIES:
+            storage_settings.pop(category, None)
+        return MemoryDriver(storage_settings, storage_category)
@@ -8,23 +8,36 @@ with sessions. (You can change this setting with the "db_notifications" setting
 in the "storage" setting.)
 '''
 
-from pycket.session import create_mixin, SessionManager
+from sessions.session import create_mixin, SessionManager
 
 
 class NotificationManager(SessionManager):
     STORAGE_CATEGORY = 'db_notifications'
+    CACHED_KEYS = ()
 
-    def get(self, name, default=None):
+    def get(self, name, callback, default=None):
         '''
         Retrieves the object with "name", like with SessionManager.get(), but
         removes the object from the database after retrieval, so that it can be
         retrieved only once
         '''
 
-        session_object = super(NotificationManager, self).get(name, default)
-        if session_object is not None:
-            self.delete(name)
-        return session_object
+        def on_response(session_object):
+            if session_object is not None:
+                self.delete(name)
+            callback(session_object)
+        super(NotificationManager, self).get(name, on_response, default)
+
+    def get_many(self, names, callback):
+        '''
+        Retrieves the objects of all the "names" at once, as a dict of the
+        ones found. Unlike get(), they're left in the database: call
+        delete(*found) once they've been delivered, in a single write
+        '''
+
+        def on_response(session):
+            callback(dict((name, session[name]) for name in names if name in session))
+        self.prefetch(on_response)
 
 
 class NotificationMixin(object):
@@ -11,6 +11,11 @@ tells which engine you want to use.
 Supported engines, for now, are:
 - Redis
 - Memcache
+- Shared memory ("shm"), a memory-mapped file shared by the worker processes
+  of one host; its "storage" settings are "path" (a directory), "slots",
+  "slot_size" and "buckets"
+- Memory ("memory"), kept in the process and carried over restarts by a
+  snapshot file in the "path" directory
 
 If you want to change the settings that are passed to the storage client, set a
 "storage" dictionary in the "pycket" settings with the intended storage settings
@@ -19,6 +24,13 @@ settings are passed to the redis.Redis client, except for the "db_sessions" and
 "db_notifications". These settings can contain numbers to change the datasets
 used for persistence, if you don't want to use the default numbers.
 
+Calls to the datastore are guarded: each read times out after "timeout"
+seconds (1 by default), or sooner if the handler's "request_deadline" comes
+first, and a circuit breaker ("breaker" setting, with "threshold" and
+"reset_timeout") fails fast while the datastore keeps failing. A read that
+fails is handed to the handler's on_session_unavailable(callback), if it has
+one, to decide what the request gets; otherwise it raises a 503.
+
 If you want to change the cookie settings passed to the handler, set a
 "cookies" setting in the "pycket" settings with the items you want.
 This is also valid for "expires" and "expires_days", which, by default, will be
@@ -26,11 +38,16 @@ None, therefore making the sessions expire on browser close, but, if you set one
 of them, your custom value will override the default behaviour.
 '''
 
+import time
 from uuid import uuid4
 
-from sessions.driver import DriverFactory
+from sessions.driver import DriverFactory, CircuitBreaker
+from bootornado.session import UserIndex
 
 import tornado.gen
+import tornado.ioloop
+import tornado.web
+from tornado.stack_context import ExceptionStackContext
 
 import logging
 
@@ -53,6 +70,9 @@ class SessionManager(object):
 
     SESSION_ID_NAME = 'PYCKET_ID'
     STORAGE_CATEGORY = 'db_sessions'
+    # keys whose values other workers may cache (see sessions.cache)
+    CACHED_KEYS = ('userinfo',)
+    OPERATION_TIMEOUT = 1.0
 
     driver = None
 
@@ -63,13 +83,18 @@ class SessionManager(object):
 
         self.handler = handler
         self.settings = {}
+        self.__session = None
+        self.__degraded = False
         self.__setup_driver()
+        self.user_index = UserIndex(self.__index_get, self.__driver_set)
 
     def __setup_driver(self):
         self.__setup_settings()
         storage_settings = self.settings.get('storage', {})
         factory = DriverFactory()
         self.driver = factory.create(self.settings.get('engine'), storage_settings, self.STORAGE_CATEGORY)
+        self.breaker = CircuitBreaker.get((self.settings.get('engine'), self.STORAGE_CATEGORY),
+                                          **self.settings.get('breaker', {}))
 
     def __setup_settings(self):
         pycket_settings = self.handler.settings.get('session')
@@ -89,7 +114,21 @@ class SessionManager(object):
         def change(session):
             session[name] = value
         self.__change_session(change)
+        if name in self.CACHED_KEYS:
+            self.__invalidate_cache(self.session_id)
         
+    def update(self, name, function, default=None):
+        '''
+        Replaces the object for "name" with what "function" returns for the
+        current one (or "default"), in a single read and write.
+        '''
+
+        def change(session):
+            session[name] = function(session.get(name, default))
+        self.__change_session(change)
+        if name in self.CACHED_KEYS:
+            self.__invalidate_cache(self.session_id)
+
     def get(self, name, callback, default=None):
         '''
         Gets the object for "name", or None if there's no such object. If
@@ -111,19 +150,38 @@ class SessionManager(object):
             for name in names_in_common:
                 del session[name]
         self.__change_session(change)
+        if set(names) & set(self.CACHED_KEYS):
+            self.__invalidate_cache(self.session_id)
     __delitem__ = delete
 
+    @property
+    def session_id(self):
+        '''
+        The id of the session the request came with, or None.
+        '''
+
+        return self.handler.get_secure_cookie(self.SESSION_ID_NAME)
+
+    def prefetch(self, callback):
+        '''
+        Loads the session from the datastore, once per request: the later
+        get(), set() and delete() calls are served from memory, and the
+        session can then be read synchronously too (keys(), "in", [...]).
+        '''
+
+        self.__get_session_from_db(callback)
+
     def keys(self):
-        session = self.__get_session_from_db()
+        session = self.__get_prefetched_session()
         return session.keys()
 
     def iterkeys(self):
-        session = self.__get_session_from_db()
+        session = self.__get_prefetched_session()
         return iter(session)
     __iter__ = iterkeys
 
     def __getitem__(self, key):
-        value = self.get(key)
+        value = self.__get_prefetched_session().get(key)
         if value is None:
             raise KeyError('%s not found in session' % key)
         return value
@@ -136,17 +194,152 @@ class SessionManager(object):
         session = yield tornado.gen.Task( self.__get_session_from_db )
         callback(session)
     def __contains__(self, key):
-        session = self.__get_session_from_db()
+        session = self.__get_prefetched_session()
         return key in session
 
+    def __get_prefetched_session(self):
+        if self.__session is None:
+            raise RuntimeError('The session must be prefetched to be read synchronously')
+        return self.__session
+
+    def bind_user(self, user_id, callback=None):
+        '''
+        Ties the current session to "user_id" (call it on login), so that
+        invalidate_user() can end it along with the user's other sessions.
+        '''
+
+        def on_generation(generation):
+            def change(session):
+                session['_user'] = user_id
+                session['_generation'] = generation
+            self.__change_session(change)
+            if callback:
+                callback()
+        self.user_index.add(user_id, self.__get_session_id(), on_generation)
+
+    def invalidate_user(self, user_id, callback=None):
+        '''
+        Ends every session of "user_id" ("log out everywhere", password change,
+        ban). The user gets a new generation, and sessions bound at an older
+        one are dropped when they are next loaded, so this costs the same
+        however many sessions there are (see bootornado.session.UserIndex).
+        '''
+
+        def on_sessions(session_ids):
+            self.__invalidate_cache(*session_ids)
+            if callback:
+                callback()
+        self.user_index.invalidate(user_id, on_sessions)
+
+    def user_sessions(self, user_id, callback):
+        '''
+        Gets the ids of the latest sessions bound to "user_id".
+        '''
+
+        self.user_index.sessions(user_id, callback)
+
+    def __invalidate_cache(self, *session_ids):
+        cache = getattr(self.handler.application, 'userinfo_cache', None)
+        session_ids = [session_id for session_id in session_ids if session_id]
+        if cache is not None and session_ids:
+            cache.invalidate(*session_ids)
+
     def __set_session_in_db(self, session):
         session_id = self.__get_session_id()
-        self.driver.set(session_id, session)
+        self.__driver_set(session_id, session)
 
     def __get_session_from_db(self,callback):
+        if self.__session is not None:
+            return callback(self.__session)
         session_id = self.__get_session_id()
-        
-        self.driver.get(session_id,callback = callback)
+
+        def loaded(session):
+            self.__session = session
+            callback(session)
+
+        def on_response(session):
+            if session.get('_user') is None:
+                return loaded(session)
+            # drop the session if its user was invalidated since it was bound
+            def on_current(current):
+                if not current:
+                    self.__driver_set(session_id, {})
+                    self.__invalidate_cache(session_id)
+                    return loaded({})
+                loaded(session)
+            self.user_index.is_current(session['_user'], session.get('_generation'), on_current)
+        self.__driver_get(session_id, on_response)
+
+    def __driver_get(self, key, callback, unavailable=None):
+        unavailable = unavailable or self.__unavailable
+        timeout = self.settings.get('timeout', self.OPERATION_TIMEOUT)
+        deadline = getattr(self.handler, 'request_deadline', None)
+        if deadline:
+            timeout = min(timeout, deadline - time.time())
+        if timeout <= 0 or not self.breaker.allow():
+            return unavailable(callback)
+
+        io_loop = tornado.ioloop.IOLoop.instance()
+        done = []
+        started = time.time()
+        def finish(response=None, failed=False):
+            if done:
+                return
+            done.append(True)
+            io_loop.remove_timeout(expiry)
+            self.__record(time.time() - started)
+            if failed:
+                self.breaker.failure()
+                return unavailable(callback)
+            self.breaker.success()
+            callback(response)
+
+        def on_error(type, value, traceback):
+            if done:
+                # raised by the callback, not by the datastore
+                return False
+            logging.warning('session datastore error: %s', value)
+            finish(failed=True)
+            return True
+
+        expiry = io_loop.add_timeout(time.time() + timeout, lambda: finish(failed=True))
+        with ExceptionStackContext(on_error):
+            self.driver.get(key, callback=finish)
+
+    def __index_get(self, key, callback):
+        # the handler's degraded mode answers for the session, not for the
+        # user index: a read of the index that fails finds nothing, so the
+        # session counts as current rather than being dropped
+        def unavailable(callback):
+            self.__degraded = True
+            callback(None)
+        self.__driver_get(key, callback, unavailable)
+
+    def __driver_set(self, key, value):
+        # don't write over a session that couldn't be read
+        if self.__degraded or self.breaker.is_open():
+            logging.warning('session datastore unavailable, dropping write of %s', key)
+            return
+
+        def on_error(type, value, traceback):
+            logging.warning('session datastore error: %s', value)
+            self.breaker.failure()
+            return True
+        # timed until the datastore acknowledged the write, not only sent
+        started = time.time()
+        with ExceptionStackContext(on_error):
+            self.driver.set(key, value, callback=lambda: self.__record(time.time() - started))
+
+    def __record(self, seconds):
+        # time the request spent on the datastore, for the handler's metrics
+        self.handler.session_seconds = getattr(self.handler, 'session_seconds', 0.0) + seconds
+
+    def __unavailable(self, callback):
+        self.__degraded = True
+        handler = getattr(self.handler, 'on_session_unavailable', None)
+        if handler is None:
+            raise tornado.web.HTTPError(503)
+        handler(callback)
 
     def __get_session_id(self):
         session_id = self.handler.get_secure_cookie(self.SESSION_ID_NAME)
@@ -0,0 +1,92 @@
+'''
+Tests of bootornado.assets, building a throwaway static directory
+
+    python -m unittest discover -s test
+'''
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from bootornado import assets
+
+
+class BuildTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('img/small.png', 'p' * 10)
+        self.write('img/big.png', 'P' * (assets.INLINE_LIMIT + 1))
+        self.write('css/sub/a.css', '\n'.join([
+            '.small { background: url(../../img/small.png) }',
+            '.big { background: url("../../img/big.png?v=2#top") }',
+            '.font { src: url(\'../fonts/missing.woff?v=1#x\') }',
+            '.grad { fill: url(#gradient) }',
+            '.abs { background: url(/img/abs.png) }',
+        ]))
+        self.write('js/a.js', 'var a = 1; // one\n\n  var b = 2;\n')
+        self.settings = {'static_path': self.root, 'static_bundles': {
+            'site.css': ['css/sub/a.css'],
+            'pages/site.css': ['css/sub/a.css'],
+            'site.js': ['js/a.js', 'js/missing.js'],
+        }}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        assets._manifests.clear()
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, url):
+        with open(os.path.join(self.root, url.split('?')[0])) as f:
+            return f.read()
+
+    def test_css_bundle(self):
+        manifest = assets.build(self.settings)
+        css = self.read(manifest['site.css'])
+        self.assertTrue('url(data:image/png;base64,' in css)
+        big = manifest['site.css'].split('/')[1]
+        self.assertTrue(big.startswith('site.') and big.count('.') == 2)
+        self.assertTrue('url("img/big.' in css)
+        self.assertTrue('.png#top")' in css)
+        # left as it was, but relative to build/ now
+        self.assertTrue("url('../css/fonts/missing.woff?v=1#x')" in css)
+        self.assertTrue('url(#gradient)' in css)
+        self.assertTrue('url(/img/abs.png)' in css)
+
+    def test_references_resolve_from_the_bundle(self):
+        manifest = assets.build(self.settings)
+        for name in ('site.css', 'pages/site.css'):
+            bundle = os.path.dirname(os.path.join(self.root, manifest[name].split('?')[0]))
+            css = self.read(manifest[name])
+            big = css.split('url("')[1].split('#')[0]
+            self.assertEqual(open(os.path.join(bundle, big)).read(), 'P' * (assets.INLINE_LIMIT + 1))
+            font = css.split("url('")[1].split('?')[0]
+            self.assertEqual(os.path.normpath(os.path.join(bundle, font)),
+                             os.path.join(self.root, 'css', 'fonts', 'missing.woff'))
+
+    def test_js_bundle_and_precompressed(self):
+        manifest = assets.build(self.settings)
+        self.assertEqual(self.read(manifest['site.js']), 'var a = 1; // one\nvar b = 2;')
+        path = os.path.join(self.root, manifest['site.js'].split('?')[0])
+        self.assertEqual(gzip.open(path + '.gz').read(), self.read(manifest['site.js']))
+
+    def test_manifest(self):
+        assets.build(self.settings)
+        with open(os.path.join(self.root, 'build', 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertTrue(manifest['img/small.png'].startswith('img/small.png?v='))
+        self.assertEqual(assets.load_manifest(self.settings), manifest)
+        self.assertEqual(assets.load_manifest(dict(self.settings, debug=True)), None)
+        url = assets.ManifestStaticFileHandler.make_static_url(self.settings, 'site.css')
+        self.assertEqual(url, '/static/' + manifest['site.css'])
+
+
+if __name__ == '__main__':
+    unittest.main()
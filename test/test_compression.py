@@ -0,0 +1,111 @@
+'''
+Tests of bootornado.compression
+
+    python -m unittest discover -s test
+'''
+import zlib
+import unittest
+
+import tornado.web
+import tornado.testing
+
+from bootornado.compression import CompressionTransform
+
+BODY = 'line of text %d\n' * 100
+
+
+class Page(tornado.web.RequestHandler):
+    def get(self):
+        size = int(self.get_argument('size', len(BODY)))
+        self.set_header('Content-Type', self.get_argument('type', 'text/html'))
+        self.finish(BODY[:size])
+
+
+class Stream(tornado.web.RequestHandler):
+    @tornado.web.asynchronous
+    def get(self):
+        if self.get_argument('length', None):
+            self.set_header('Content-Length', len(BODY) * 3)
+        self.chunks = 3
+        self.send()
+
+    def send(self):
+        self.write(BODY)
+        self.chunks -= 1
+        if self.chunks:
+            self.flush(callback=self.send)
+        else:
+            self.finish()
+
+
+class Stats(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain')
+        self.write(BODY)
+
+    def on_finish(self):
+        self.application.stats = getattr(self.request, 'compression_stats', None)
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class CompressionTransformTest(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application([
+            (r'/page', Page), (r'/stream', Stream), (r'/stats', Stats),
+        ], transforms=[CompressionTransform.configure(min_length=100),
+                       tornado.web.ChunkedTransferEncoding])
+
+    def get(self, path, accept='gzip', **headers):
+        headers['Accept-Encoding'] = accept
+        return self.fetch(path, headers=headers, use_gzip=False)
+
+    def test_compressed(self):
+        response = self.get('/page')
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(response.headers.get('Vary'), 'Accept-Encoding')
+        self.assertEqual(gunzip(response.body), BODY)
+        self.assertEqual(int(response.headers['Content-Length']), len(response.body))
+
+    def test_below_threshold(self):
+        response = self.get('/page?size=50')
+        self.assertEqual(response.headers.get('Content-Encoding'), None)
+        # another response for the same url may be compressed
+        self.assertEqual(response.headers.get('Vary'), 'Accept-Encoding')
+        self.assertEqual(response.body, BODY[:50])
+
+    def test_not_accepted(self):
+        for accept in ('', 'identity', 'gzip;q=0', 'deflate'):
+            response = self.get('/page', accept)
+            self.assertEqual(response.headers.get('Content-Encoding'), None, accept)
+            self.assertEqual(response.body, BODY)
+
+    def test_incompressible_type(self):
+        response = self.get('/page?type=image/png')
+        self.assertEqual(response.headers.get('Content-Encoding'), None)
+        self.assertEqual(response.headers.get('Vary'), None)
+
+    def test_streamed(self):
+        response = self.get('/stream')
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(response.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertEqual(gunzip(response.body), BODY * 3)
+
+    def test_streamed_with_length_left_alone(self):
+        response = self.get('/stream?length=1')
+        self.assertEqual(response.headers.get('Content-Encoding'), None)
+        self.assertEqual(response.body, BODY * 3)
+
+    def test_stats(self):
+        before = dict(CompressionTransform.totals)
+        response = self.get('/stats')
+        bytes_in, bytes_out, cpu = self._app.stats
+        self.assertEqual((bytes_in, bytes_out), (len(BODY), len(response.body)))
+        self.assertEqual(CompressionTransform.totals['responses'], before['responses'] + 1)
+        self.assertEqual(CompressionTransform.totals['bytes_in'], before['bytes_in'] + len(BODY))
+
+
+if __name__ == '__main__':
+    unittest.main()
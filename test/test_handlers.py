@@ -0,0 +1,492 @@
+'''
+Tests of the request handlers of bootornado.views.base, served by a
+throwaway application over the "memory" session engine
+
+    python -m unittest discover -s test
+'''
+import os
+import time
+import hashlib
+import shutil
+import tempfile
+import unittest
+
+import tornado.web
+import tornado.ioloop
+import tornado.testing
+
+import bootornado.session
+import bootornado.uimethods
+from bootornado.views.base import RequestHandler, AsynAuthHandler
+from sessions.cache import UserinfoCache
+from sessions.driver import StoreDriver, DriverFactory, CircuitBreaker
+
+
+class Login(RequestHandler):
+    @tornado.web.asynchronous
+    def get(self):
+        self.session.set('userinfo', {'name': 'bob'})
+        self.finish('ok')
+
+
+class Notify(RequestHandler):
+    @tornado.web.asynchronous
+    def get(self):
+        self.notifications.set('note', self.get_argument('text'))
+        self.finish('ok')
+
+
+class Inbox(AsynAuthHandler):
+    prefetch_notifications = ('note',)
+
+    def _get_(self):
+        self.finish(self.prefetched.get('note') or 'empty')
+
+
+class Notes(RequestHandler):
+    prefetch_session = ('userinfo',)
+    prefetch_notifications = ('note',)
+
+    def get(self):
+        userinfo = self.prefetched.get('userinfo') or {}
+        self.write('%s %s' % (userinfo.get('name'), self.prefetched.get('note') or 'empty'))
+
+
+class Private(AsynAuthHandler):
+    def _get_(self):
+        self.finish(self.prefetched['userinfo']['name'])
+
+
+class Bind(RequestHandler):
+    @tornado.web.asynchronous
+    def get(self):
+        self.session.bind_user('bob', callback=lambda: self.finish('ok'))
+
+
+class Logout(RequestHandler):
+    @tornado.web.asynchronous
+    def get(self):
+        self.session.delete('userinfo')
+        self.finish('ok')
+
+
+class Account(AsynAuthHandler):
+    prefetch_session = ('theme',)
+
+    def _get_(self):
+        self.finish(self.prefetched['userinfo']['name'])
+
+
+class Token(RequestHandler):
+    def get(self):
+        seen = [self.get_secure_cookie('token') for i in range(3)]
+        if self.get_argument('set', None):
+            self.set_secure_cookie('token', self.get_argument('set'))
+            seen.append(self.get_secure_cookie('token'))
+        self.finish(' '.join(str(value) for value in seen))
+
+
+class Flash(RequestHandler):
+    def get(self):
+        self.flash(self.get_argument('text'), 'success')
+        self.redirect('/show')
+
+
+class Show(RequestHandler):
+    def get(self):
+        self.render(self.get_argument('template', 'show.html'))
+
+
+class Hashed(RequestHandler):
+    incremental_etag = True
+
+    def get(self):
+        for i in range(3):
+            self.write('part %d;' % i)
+        if self.get_argument('error', None):
+            self.clear()
+            self.write('replaced')
+
+
+class Article(RequestHandler):
+    def get(self):
+        if self.is_not_modified(self.get_argument('etag', None),
+                                float(self.get_argument('updated', 0)) or None):
+            self.application.rendered = False
+            return
+        self.application.rendered = True
+        self.write('article')
+
+
+class Streamed(RequestHandler):
+    def get(self):
+        def rows():
+            for i in range(5):
+                # what was generated before has been sent, past a few bytes
+                buffer = getattr(self, '_stream_buffer', None)
+                if buffer is not None:
+                    self.application.buffered.append(buffer.pending)
+                yield i
+        self.application.buffered = []
+        render = self.render_stream if self.get_argument('stream', None) else self.render
+        render('rows.html', rows=rows())
+
+
+class HandlerTestCase(tornado.testing.AsyncHTTPTestCase):
+    handlers = [
+        (r'/login', Login),
+        (r'/bind', Bind),
+        (r'/notify', Notify),
+        (r'/inbox', Inbox),
+        (r'/notes', Notes),
+        (r'/private', Private),
+        (r'/account', Account),
+        (r'/token', Token),
+        (r'/logout', Logout),
+        (r'/flash', Flash),
+        (r'/show', Show),
+        (r'/hashed', Hashed),
+        (r'/article', Article),
+        (r'/streamed', Streamed),
+    ]
+    templates = {
+        'show.html': '{% for category, msg in handler.get_flashed_messages() %}'
+                     '{{ category }}:{{ msg }};{% end %}',
+        'twice.html': '{{ len(handler.get_flashed_messages()) }} '
+                      '{{ len(handler.get_flashed_messages()) }}',
+        'rows.html': '<head>{{ early_flush() }}{% for row in rows %}row {{ row }};{% end %}</end>',
+        'errors/403.html': 'forbidden',
+        'errors/404.html': 'not found',
+        'errors/500.html': 'error',
+        'errors/503.html': 'unavailable',
+    }
+    settings = {}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cookies = {}
+        for name, content in self.templates.items():
+            if not os.path.isdir(os.path.dirname(os.path.join(self.root, name))):
+                os.makedirs(os.path.dirname(os.path.join(self.root, name)))
+            with open(os.path.join(self.root, name), 'w') as f:
+                f.write(content)
+        super(HandlerTestCase, self).setUp()
+
+    def tearDown(self):
+        super(HandlerTestCase, self).tearDown()
+        StoreDriver._stores.clear()
+        bootornado.session._snapshot_stores.clear()
+        shutil.rmtree(self.root)
+
+    def get_new_ioloop(self):
+        # the code under test schedules its callbacks on the global IOLoop
+        return tornado.ioloop.IOLoop.instance()
+
+    def get_app(self):
+        settings = dict(
+            cookie_secret = 'secret',
+            login_url     = '/login',
+            template_path = self.root,
+            ui_methods    = bootornado.uimethods,
+            session       = {'engine': 'memory', 'storage': {'path': self.root}},
+        )
+        settings.update(self.settings)
+        return tornado.web.Application(self.handlers, **settings)
+
+    def get(self, path, **kwargs):
+        """Fetches `path` as a browser would, keeping the cookies"""
+        headers = kwargs.setdefault('headers', {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        kwargs.setdefault('follow_redirects', False)
+        response = self.fetch(path, **kwargs)
+        for header in response.headers.get_list('Set-Cookie'):
+            name, value = header.split(';')[0].split('=', 1)
+            if value.strip('"'):
+                self.cookies[name] = value
+            else:
+                self.cookies.pop(name, None)
+        return response
+
+
+class PrefetchTest(HandlerTestCase):
+    def test_notifications_kept_until_shown(self):
+        self.get('/notify?text=hi')
+        # not logged in: redirected to the login page, the note stays
+        self.assertEqual(self.get('/inbox').code, 302)
+        self.get('/login')
+        self.assertEqual(self.get('/inbox').body, 'hi')
+        self.assertEqual(self.get('/inbox').body, 'empty')
+
+    def test_any_handler_prefetches(self):
+        self.get('/notify?text=hi')
+        self.assertEqual(self.get('/notes').body, 'None hi')
+        self.get('/login')
+        self.assertEqual(self.get('/notes').body, 'bob empty')
+
+
+class UserinfoCacheTest(HandlerTestCase):
+    def get_app(self):
+        application = super(UserinfoCacheTest, self).get_app()
+        application.userinfo_cache = UserinfoCache(maxsize=10, ttl=30)
+        return application
+
+    def test_auth_check_skips_the_store(self):
+        self.get('/login')
+        self.assertEqual(self.get('/private').body, 'bob')
+        # the sessions are gone, the worker still knows the user
+        StoreDriver._stores.clear()
+        self.assertEqual(self.get('/private').body, 'bob')
+
+    def test_logout_invalidates(self):
+        self.get('/login')
+        self.get('/private')
+        self.get('/logout')
+        self.assertEqual(self.get('/private').code, 302)
+
+    def test_store_still_used_with_other_keys(self):
+        # Inbox also needs its notifications, so it goes to the store
+        self.get('/login')
+        self.get('/private')
+        self.get('/notify?text=hi')
+        self.assertEqual(self.get('/inbox').body, 'hi')
+
+    def test_from_settings(self):
+        self.assertEqual(UserinfoCache.from_settings({'engine': 'memory'}), None)
+        cache = UserinfoCache.from_settings({'userinfo_cache': {'maxsize': 1, 'ttl': 5}})
+        cache.set('s1', {'name': 'bob'})
+        cache.set('s2', {'name': 'alice'})
+        self.assertEqual((cache.get('s1'), cache.get('s2')), (None, {'name': 'alice'}))
+        cache.invalidate('s2')
+        self.assertEqual(cache.get('s2'), None)
+
+
+class FlakyDriver(object):
+    '''A datastore that hangs, fails or answers, as the test says; "index"
+    hangs on the user index only'''
+    mode = 'answer'
+    calls = 0
+    sessions = {}
+
+    def get(self, key, callback=None):
+        FlakyDriver.calls += 1
+        if self.mode == 'fail':
+            raise IOError('connection refused')
+        if self.mode == 'answer' or (self.mode == 'index' and not key.startswith('user:')):
+            callback(self.sessions.get(key, {}))
+
+    def set(self, key, value, callback=None):
+        self.sessions[key] = value
+        if callback:
+            callback()
+
+
+class DegradedTestCase(HandlerTestCase):
+    degraded = 'unavailable'
+
+    def setUp(self):
+        DriverFactory._create_flaky = lambda factory, settings, category: FlakyDriver()
+        FlakyDriver.mode, FlakyDriver.calls = 'answer', 0
+        FlakyDriver.sessions.clear()
+        super(DegradedTestCase, self).setUp()
+
+    def tearDown(self):
+        super(DegradedTestCase, self).tearDown()
+        del DriverFactory._create_flaky
+        CircuitBreaker._breakers.clear()
+
+    def get_app(self):
+        application = super(DegradedTestCase, self).get_app()
+        application.settings['session'] = {
+            'engine': 'flaky',
+            'timeout': 0.05,
+            'breaker': {'threshold': 2, 'reset_timeout': 0.3},
+            'degraded': self.degraded,
+        }
+        application.userinfo_cache = UserinfoCache(maxsize=10, ttl=30)
+        return application
+
+
+class DegradedTest(DegradedTestCase):
+    def test_hung_store_times_out(self):
+        self.get('/login')
+        FlakyDriver.mode = 'hang'
+        response = self.get('/account', request_timeout=5)
+        self.assertEqual(response.code, 503)
+        self.assertTrue(response.request_time < 1)
+
+    def test_breaker_fails_fast(self):
+        self.get('/login')
+        FlakyDriver.mode = 'fail'
+        self.assertEqual(self.get('/account').code, 503)
+        self.assertEqual(self.get('/account').code, 503)
+        calls = FlakyDriver.calls
+        # open: the datastore isn't even tried
+        self.assertEqual(self.get('/account').code, 503)
+        self.assertEqual(FlakyDriver.calls, calls)
+        # after reset_timeout one trial goes through, and closes it
+        time.sleep(0.3)
+        FlakyDriver.mode = 'answer'
+        self.assertEqual(self.get('/account').body, 'bob')
+        self.assertEqual(self.get('/account').body, 'bob')
+
+    def test_prefetch_answers_503(self):
+        FlakyDriver.mode = 'hang'
+        self.assertEqual(self.get('/notes').code, 503)
+        FlakyDriver.mode = 'fail'
+        self.assertEqual(self.get('/notes').code, 503)
+
+    def test_failed_read_not_written_over(self):
+        self.get('/login')
+        FlakyDriver.mode = 'fail'
+        self.get('/login')
+        FlakyDriver.mode = 'answer'
+        self.assertEqual(self.get('/account').body, 'bob')
+
+
+class DegradedAnonymousTest(DegradedTestCase):
+    degraded = 'anonymous'
+
+    def test_hung_store_times_out(self):
+        self.get('/login')
+        FlakyDriver.mode = 'hang'
+        self.assertEqual(self.get('/account').code, 302)
+
+
+class DegradedCachedTest(DegradedTestCase):
+    degraded = 'cached'
+
+    def test_hung_store_times_out(self):
+        self.get('/login')
+        self.get('/private') # cached
+        FlakyDriver.mode = 'hang'
+        self.assertEqual(self.get('/account').body, 'bob')
+
+    def test_user_index_timeout_keeps_the_session(self):
+        self.get('/login')
+        self.get('/bind')
+        self.get('/private') # cached
+        FlakyDriver.mode = 'index'
+        self.assertEqual(self.get('/account').body, 'bob')
+        # neither the cache nor the stored session were dropped
+        self.assertEqual(len(self._app.userinfo_cache.entries.data), 1)
+        FlakyDriver.mode = 'answer'
+        self._app.userinfo_cache.entries.clear()
+        self.assertEqual(self.get('/account').body, 'bob')
+
+
+class SecureCookieTest(HandlerTestCase):
+    settings = {'cookie_secret_fallbacks': ['old secret']}
+
+    def setUp(self):
+        super(SecureCookieTest, self).setUp()
+        self.decoded = []
+        decode = tornado.web.decode_signed_value
+        def counting(*args, **kwargs):
+            self.decoded.append(args[1])
+            return decode(*args, **kwargs)
+        tornado.web.decode_signed_value = counting
+        self.addCleanup(setattr, tornado.web, 'decode_signed_value', decode)
+
+    def token(self, secret):
+        self.cookies['token'] = tornado.web.create_signed_value(secret, 'token', 'abc')
+
+    def test_verified_once_per_request(self):
+        self.token('secret')
+        self.assertEqual(self.get('/token').body, 'abc abc abc')
+        self.assertEqual(self.decoded, ['token'])
+
+    def test_new_value_seen_in_the_request(self):
+        self.token('secret')
+        self.assertEqual(self.get('/token?set=def').body, 'abc abc abc def')
+        self.assertEqual(self.get('/token').body, 'def def def')
+
+    def test_old_secret_accepted(self):
+        self.token('old secret')
+        self.assertEqual(self.get('/token').body, 'abc abc abc')
+        self.assertEqual(len(self.decoded), 2) # the current secret first
+
+    def test_unknown_secret_refused(self):
+        self.token('stolen secret')
+        self.assertEqual(self.get('/token').body, 'None None None')
+
+
+class FlashTest(HandlerTestCase):
+    def test_shown_by_page_without_prefetch(self):
+        self.get('/flash?text=saved')
+        self.assertEqual(self.cookies.get('flash'), '1')
+        self.assertEqual(self.get('/show').body, 'success:saved;')
+        self.assertFalse('flash' in self.cookies)
+        self.assertEqual(self.get('/show').body, '')
+
+    def test_accumulated_until_shown(self):
+        self.get('/flash?text=one')
+        self.get('/flash?text=two')
+        self.assertEqual(self.get('/show').body, 'success:one;success:two;')
+
+    def test_shown_once(self):
+        self.get('/flash?text=saved')
+        self.assertEqual(self.get('/show?template=twice.html').body, '1 0')
+        self.assertEqual(self.get('/show').body, '')
+
+
+class EtagTest(HandlerTestCase):
+    def test_incremental_hash(self):
+        response = self.get('/hashed')
+        self.assertEqual(response.body, 'part 0;part 1;part 2;')
+        self.assertEqual(response.headers['Etag'], '"%s"' % hashlib.sha1(response.body).hexdigest())
+        response = self.get('/hashed', headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(response.code, 304)
+
+    def test_cleared_output_not_hashed(self):
+        response = self.get('/hashed?error=1')
+        self.assertEqual(response.body, 'replaced')
+        self.assertEqual(response.headers['Etag'], '"%s"' % hashlib.sha1('replaced').hexdigest())
+
+    def test_not_modified_by_etag(self):
+        response = self.get('/article?etag=v1')
+        self.assertEqual(response.headers['Etag'], '"v1"')
+        self.assertTrue(self._app.rendered)
+        for match in ('"v1"', '"v0", "v1"', '*'):
+            response = self.get('/article?etag=v1', headers={'If-None-Match': match})
+            self.assertEqual(response.code, 304, match)
+            self.assertFalse(self._app.rendered)
+        response = self.get('/article?etag=v2', headers={'If-None-Match': '"v1"'})
+        self.assertEqual(response.code, 200)
+        self.assertTrue(self._app.rendered)
+
+    def test_not_modified_since(self):
+        updated = 1300000000.5
+        response = self.get('/article?updated=%s' % updated)
+        since = response.headers['Last-Modified']
+        self.assertEqual(since, 'Sun, 13 Mar 2011 07:06:40 GMT')
+        response = self.get('/article?updated=%s' % updated, headers={'If-Modified-Since': since})
+        self.assertEqual(response.code, 304)
+        response = self.get('/article?updated=%s' % (updated + 60),
+                            headers={'If-Modified-Since': since})
+        self.assertEqual(response.code, 200)
+
+
+class StreamingTest(HandlerTestCase):
+    settings = {'stream_buffer_size': 12}
+    page = '<head>row 0;row 1;row 2;row 3;row 4;</end>'
+
+    def test_streamed(self):
+        chunks = []
+        response = self.get('/streamed?stream=1', streaming_callback=chunks.append)
+        self.assertEqual(response.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertEqual(''.join(chunks), self.page)
+        # the head went out before the rows, which went out a few at a time
+        self.assertEqual(chunks[0], '<head>')
+        self.assertTrue(len(chunks) > 3)
+        self.assertTrue(max(self._app.buffered) < 12)
+
+    def test_plain_render(self):
+        response = self.get('/streamed')
+        self.assertEqual(response.body, self.page)
+        self.assertEqual(response.headers.get('Transfer-Encoding'), None)
+        self.assertEqual(self._app.buffered, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+'''
+Tests of bootornado.metrics and of the admin.metrics route
+
+    python -m unittest discover -s test
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from bootornado.metrics import Histogram, Registry, WorkerMetrics
+from bootornado.views.admin import Metrics
+from sessions.driver import MemoryDriver
+
+from test_handlers import HandlerTestCase
+
+
+class HistogramTest(unittest.TestCase):
+    def test_quantiles_within_an_eighth(self):
+        h = Histogram()
+        for value in xrange(1, 100001):
+            h.record(value)
+        for q in (.5, .9, .99):
+            exact = q * 100000
+            self.assertTrue(exact * 7 / 8 <= h.quantile(q) <= exact, (q, h.quantile(q)))
+
+    def test_negative_recorded_as_zero(self):
+        h = Histogram()
+        h.record(-5)
+        self.assertEqual((h.count, h.quantile(1)), (1, 0))
+
+    def test_merge(self):
+        small, large = Histogram(), Histogram()
+        small.record(3)
+        large.record(3)
+        large.record(100000)
+        small.merge(large)
+        self.assertEqual((small.count, small.total, small.count_below(4)), (3, 100006, 2))
+
+
+class RegistryTest(unittest.TestCase):
+    def test_expose(self):
+        registry = Registry()
+        registry.observe('index', 200, 0.004, session=0.001)
+        registry.observe('index', 200, 0.2)
+        registry.observe('index', 404, 0.001)
+        text = registry.expose()
+        self.assertTrue('bootornado_requests_total{route="index",status="200",' in text)
+        self.assertTrue('bootornado_request_duration_seconds_bucket{route="index",'
+                        'pid="%d",le="0.005"} 2' % __import__('os').getpid() in text)
+        self.assertFalse('ioloop_lag' in text)
+
+    def test_totals_not_labelled_with_a_pid(self):
+        registry = Registry()
+        registry.observe('index', 200, 0.004)
+        registry.loop_lag.record(500)
+        text = registry.expose(process=False)
+        self.assertTrue('bootornado_requests_total{route="index",status="200"} 1' in text)
+        self.assertTrue('bootornado_ioloop_lag_seconds_bucket{le="0.001"} 1' in text)
+        self.assertFalse('pid=' in text)
+
+
+class WorkerMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'metrics.shm')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def worker(self, worker_id, requests):
+        pid = os.fork()
+        if not pid:
+            metrics = WorkerMetrics(Registry(), 3, self.path)
+            metrics.worker_id = worker_id
+            for i in range(requests):
+                metrics.registry.observe('index', 200, 0.01)
+            metrics.publish()
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+    def test_combined(self):
+        metrics = WorkerMetrics(Registry(), 3, self.path)
+        metrics.worker_id = 0
+        metrics.registry.observe('index', 200, 0.01)
+        metrics.registry.observe('about', 404, 0.01)
+        self.worker(1, 2)
+        self.worker(2, 3)
+        combined = metrics.combined()
+        self.assertEqual(combined.routes['index'].statuses, {200: 6})
+        self.assertEqual(combined.routes['index'].duration.count, 6)
+        self.assertEqual(combined.routes['about'].statuses, {404: 1})
+        # the worker's own registry is left alone
+        self.assertEqual(metrics.registry.routes['index'].statuses, {200: 1})
+
+    def test_stale_worker_left_out(self):
+        metrics = WorkerMetrics(Registry(), 3, self.path)
+        self.worker(1, 2)
+        metrics.STALE = 0
+        self.assertEqual(metrics.combined().routes, {})
+
+    def test_other_number_of_workers(self):
+        WorkerMetrics(Registry(), 3, self.path)
+        self.worker(1, 2)
+        self.assertEqual(WorkerMetrics(Registry(), 2, self.path).combined().routes, {})
+
+
+class MetricsRouteTest(HandlerTestCase):
+    handlers = HandlerTestCase.handlers + [(r'/admin/metrics', Metrics)]
+
+    def get_app(self):
+        application = super(MetricsRouteTest, self).get_app()
+        application.metrics = Registry()
+        return application
+
+    def test_denied_by_default(self):
+        # even from the local address, which a proxy's requests come from
+        self.assertEqual(self.get('/admin/metrics').code, 403)
+
+    def test_allowed_address(self):
+        self._app.settings['metrics_allow'] = ['127.0.0.1']
+        self.get('/login')
+        response = self.get('/admin/metrics')
+        self.assertEqual(response.code, 200)
+        self.assertTrue('route="Login",status="200"' in response.body)
+
+    def test_all_the_workers(self):
+        self._app.settings['metrics_allow'] = ['127.0.0.1']
+        self._app.worker_metrics = WorkerMetrics(self._app.metrics, 2,
+                                                 os.path.join(self.root, 'metrics.shm'))
+        self._app.worker_metrics.worker_id = 0
+        self.get('/login')
+        body = self.get('/admin/metrics').body
+        self.assertTrue('bootornado_requests_total{route="Login",status="200"} 1' in body)
+
+    def test_token(self):
+        self._app.settings['metrics_token'] = 'sesame'
+        self.assertEqual(self.get('/admin/metrics', headers={
+            'Authorization': 'Bearer wrong'}).code, 403)
+        self.assertEqual(self.get('/admin/metrics', headers={
+            'Authorization': 'Bearer sesame'}).code, 200)
+
+
+class DriverSetTest(unittest.TestCase):
+    def test_set_calls_back_once_written(self):
+        # the session manager times its writes up to this callback
+        driver = MemoryDriver({}, 'db_sessions')
+        done = []
+        driver.set('key', {'a': 1}, callback=lambda: done.append(driver.get('key')))
+        self.assertEqual(done, [{'a': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+'''
+Tests of bootornado.pagecache
+
+    python -m unittest discover -s test
+'''
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from bootornado import pagecache
+from bootornado.pagecache import PageCache
+from bootornado.session import SharedMemoryStore
+from bootornado.views.base import RequestHandler
+
+from test_handlers import HandlerTestCase
+
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def entry(self, ttl, stale, tags=None):
+        now = time.time()
+        return {'status': 200, 'headers': [], 'body': 'page', 'tags': tags or {},
+                'expires': now + ttl, 'stale_until': now + ttl + stale}
+
+    def test_shm_settings(self):
+        # the settings of the memory engine, switched to shm
+        cache = PageCache.from_settings({'engine': 'shm', 'maxsize': 1000, 'slots': 64,
+                                         'path': os.path.join(self.root, 'pages.shm')})
+        self.assertTrue(isinstance(cache.storage, SharedMemoryStore))
+        cache.set('k', self.entry(60, 0))
+        self.assertEqual(cache.get('k')[0]['body'], 'page')
+
+    def test_shm_ttl_and_label(self):
+        settings = {'engine': 'shm', 'slots': 64, 'path': os.path.join(self.root, 'pages.shm')}
+        storage = PageCache.from_settings(settings).storage
+        self.assertEqual((storage.ttl, storage.label), (24 * 3600, 'page'))
+        settings['ttl'] = 600
+        self.assertEqual(PageCache.from_settings(settings).storage.ttl, 600)
+
+    def test_concurrent_invalidations(self):
+        path = os.path.join(self.root, 'pages.shm')
+        PageCache.from_settings({'engine': 'shm', 'slots': 64, 'path': path})
+        pids = []
+        for i in range(4):
+            pid = os.fork()
+            if not pid:
+                # a worker, with its own mapping of the file
+                cache = PageCache.from_settings({'engine': 'shm', 'slots': 64, 'path': path})
+                for j in range(500):
+                    cache.invalidate('post:1')
+                os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        cache = PageCache.from_settings({'engine': 'shm', 'slots': 64, 'path': path})
+        self.assertEqual(cache.tag_versions(['post:1']), {'post:1': 2000})
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, PageCache.from_settings, {'engine': 'disk'})
+
+    def test_fresh_then_stale(self):
+        cache = PageCache.from_settings({})
+        cache.set('k', self.entry(0, 60))
+        entry, fresh = cache.get('k')
+        self.assertEqual((entry['body'], fresh), ('page', False))
+        self.assertTrue(cache.start_refresh('k'))
+        self.assertFalse(cache.start_refresh('k'))
+
+    def test_invalidate_tag(self):
+        cache = PageCache.from_settings({})
+        cache.set('k', self.entry(60, 0, cache.tag_versions(['post:1'])))
+        cache.invalidate('post:2')
+        self.assertNotEqual(cache.get('k'), (None, False))
+        cache.invalidate('post:1')
+        self.assertEqual(cache.get('k'), (None, False))
+
+
+class Page(RequestHandler):
+    renders = []
+
+    @pagecache.cached(ttl=0.2, stale=60)
+    def get(self):
+        self.renders.append(True)
+        self.finish('render %d' % len(self.renders))
+
+
+class CachedHandlerTest(HandlerTestCase):
+    handlers = HandlerTestCase.handlers + [(r'/page', Page)]
+
+    def setUp(self):
+        super(CachedHandlerTest, self).setUp()
+        del Page.renders[:]
+
+    def get_app(self):
+        application = super(CachedHandlerTest, self).get_app()
+        application.page_cache = PageCache.from_settings({})
+        return application
+
+    def test_hit(self):
+        self.assertEqual(self.get('/page').headers['X-Cache'], 'MISS')
+        response = self.get('/page')
+        self.assertEqual((response.headers['X-Cache'], response.body), ('HIT', 'render 1'))
+
+    def test_stale_refreshed_in_background(self):
+        self.get('/page')
+        time.sleep(0.3)
+        # the first request after the ttl doesn't wait for the render
+        response = self.get('/page')
+        self.assertEqual((response.headers['X-Cache'], response.body), ('STALE', 'render 1'))
+        response = self.get('/page')
+        self.assertEqual((response.headers['X-Cache'], response.body), ('HIT', 'render 2'))
+        self.assertEqual(len(Page.renders), 2)
+
+    def test_not_served_to_sessions(self):
+        self.get('/login')
+        self.get('/page')
+        self.assertEqual(self.get('/page').body, 'render 2')
+
+
+if __name__ == '__main__':
+    unittest.main()
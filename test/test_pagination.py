@@ -0,0 +1,117 @@
+'''
+Tests of bootornado.pagination
+
+    python -m unittest discover -s test
+'''
+import json
+import urlparse
+import unittest
+
+from bootornado.pagination import paginate, encode_cursor, decode_cursor, InvalidCursor
+from bootornado.views.base import RequestHandler
+from test_handlers import HandlerTestCase
+
+POSTS = [{'id': i, 'day': i // 3} for i in range(47)]
+
+
+class Rows(object):
+    """An iterable that isn't a sequence, like a cursor over a query"""
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def walk(source, per_page=10, **kwargs):
+    """All the pages of `source`, following the cursors"""
+    pages, cursor = [], None
+    while True:
+        page = paginate(source, cursor, per_page, **kwargs)
+        pages.append(page.items)
+        if not page.has_next:
+            return pages
+        cursor = page.next_cursor
+
+
+class PaginateTest(unittest.TestCase):
+    def test_sequence(self):
+        pages = walk(range(47))
+        self.assertEqual([len(items) for items in pages], [10, 10, 10, 10, 7])
+        self.assertEqual(sum(pages, []), range(47))
+
+    def test_exact_last_page(self):
+        self.assertEqual([len(items) for items in walk(range(30))], [10, 10, 10])
+        self.assertEqual(walk([]), [[]])
+
+    def test_unsliceable_sequence(self):
+        self.assertEqual(sum(walk(xrange(47)), []), range(47))
+
+    def test_iterable(self):
+        self.assertEqual(sum(walk(Rows(range(47))), []), range(47))
+
+    def test_query(self):
+        calls = []
+        def query(after, limit):
+            calls.append((after, limit))
+            return [i for i in range(47) if after is None or i > after][:limit]
+        self.assertEqual(sum(walk(query), []), range(47))
+        self.assertEqual(calls, [(None, 11), (9, 11), (19, 11), (29, 11), (39, 11)])
+
+    def test_reverse(self):
+        posts = POSTS[::-1]
+        for source in (posts, Rows(posts)):
+            self.assertEqual(sum(walk(source, 4, key=lambda p: p['id'], reverse=True), []), posts)
+
+    def test_compound_key(self):
+        key = lambda post: (post['day'], post['id'])
+        self.assertEqual(sum(walk(POSTS, 5, key=key), []), POSTS)
+        page = paginate(POSTS, encode_cursor((2, 7)), 2, key=key)
+        self.assertEqual([post['id'] for post in page], [8, 9])
+
+    def test_stable_under_insertion(self):
+        # an item added before the cursor doesn't shift the next page
+        items = range(0, 40, 2)
+        cursor = paginate(items, None, 5).next_cursor
+        items.insert(0, -1)
+        self.assertEqual(paginate(items, cursor, 5).items, [10, 12, 14, 16, 18])
+
+    def test_invalid_cursor(self):
+        for token in ('!!!', 'bm90IGpzb24', u'\xe9'):
+            self.assertRaises(InvalidCursor, decode_cursor, token)
+
+    def test_url(self):
+        page = paginate(range(47), None, 10)
+        url = page.url('/posts', {'tag': ['a', 'b'], 'cursor': ['old']})
+        path, query = url.split('?')
+        self.assertEqual(path, '/posts')
+        self.assertEqual(urlparse.parse_qs(query),
+                         {'tag': ['a', 'b'], 'cursor': [page.next_cursor]})
+        self.assertEqual(paginate(range(5), None, 10).url('/posts'), None)
+
+
+class Posts(RequestHandler):
+    def get(self):
+        page = self.paginate(range(25), per_page=10)
+        self.finish({'items': page.items, 'next': self.page_url(page)})
+
+
+class PaginationHandlerTest(HandlerTestCase):
+    handlers = [(r'/posts', Posts)]
+
+    def test_following_the_links(self):
+        items, url = [], '/posts?tag=a'
+        while url:
+            response = self.get(url)
+            self.assertTrue('tag=a' in url)
+            page = json.loads(response.body)
+            items.extend(page['items'])
+            url = page['next']
+        self.assertEqual(items, range(25))
+
+    def test_malformed_cursor(self):
+        self.assertEqual(self.get('/posts?cursor=!!!').code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
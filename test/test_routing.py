@@ -0,0 +1,101 @@
+'''
+Tests of bootornado.routing
+
+    python -m unittest discover -s test
+'''
+import unittest
+
+import tornado.web
+import tornado.testing
+
+from bootornado.routing import RouteTable, CompiledRoutingMixin, literal_prefix
+
+PATTERNS = [
+    r'/$',
+    r'/auth/login$',
+    r'/auth/(\w+)$',
+    r'/user/(\d+)/?$',
+    r'/user/settings$',
+    r'/files?/(.*)$',
+    r'/static\.d/(.*)$',
+    r'/a|/b$',
+    r'/blog/(?P<slug>[\w-]+)$',
+    r'/x+y$',
+    r'(?i)/case$',
+    r'/.*\.json$',
+]
+
+PATHS = [
+    '/', '/auth/login', '/auth/logout', '/user/42', '/user/42/', '/user/settings',
+    '/file/a/b', '/files/', '/fil', '/static.d/app.js', '/staticxd/app.js', '/a', '/b',
+    '/blog/hello-world', '/xxxy', '/y', '/CASE', '/data.json', '/user/42.json', '/missing',
+]
+
+
+def linear(specs, path):
+    for spec in specs:
+        if spec.regex.match(path):
+            return spec
+
+
+class RouteTableTest(unittest.TestCase):
+    def specs(self, patterns):
+        return [tornado.web.URLSpec(pattern, tornado.web.RequestHandler) for pattern in patterns]
+
+    def test_same_route_as_linear_matching(self):
+        specs = self.specs(PATTERNS)
+        table = RouteTable(specs)
+        for path in PATHS:
+            self.assertTrue(table.match(path)[0] is linear(specs, path), path)
+
+    def test_declaration_order_wins(self):
+        # a regex route declared first shadows the exact path after it
+        specs = self.specs([r'/auth/(\w+)$', r'/auth/login$'])
+        self.assertTrue(RouteTable(specs).match('/auth/login')[0] is specs[0])
+        specs.reverse()
+        self.assertTrue(RouteTable(specs).match('/auth/login')[0] is specs[0])
+
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix(r'/static\.d/(.*)$'), ('/static.d/', False))
+        self.assertEqual(literal_prefix(r'/x+y$'), ('/', False))
+        self.assertEqual(literal_prefix(r'^/about$'), ('/about', True))
+        self.assertEqual(literal_prefix(r'/\d+$'), ('/', False))
+
+
+class Name(tornado.web.RequestHandler):
+    def get(self, *args):
+        self.write(self.__class__.__name__ + ' ' + ' '.join(args))
+
+
+class Other(Name):
+    pass
+
+
+class Application(CompiledRoutingMixin, tornado.web.Application):
+    pass
+
+
+class CompiledRoutingTest(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([
+            (r'/', Name),
+            (r'/item/(\d+)', Name),
+            (r'/item/new', Other),
+        ])
+
+    def test_dispatch(self):
+        self.assertEqual(self.fetch('/').body, 'Name ')
+        self.assertEqual(self.fetch('/item/12').body, 'Name 12')
+        self.assertEqual(self.fetch('/item/new').body, 'Other ')
+
+    def test_not_found(self):
+        self.assertEqual(self.fetch('/nothing').code, 404)
+
+    def test_added_handlers(self):
+        self.fetch('/')
+        self._app.add_handlers(r'.*$', [(r'/late', Other)])
+        self.assertEqual(self.fetch('/late').body, 'Other ')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+'''
+Tests of bootornado.server: they run a master with its workers in a
+subprocess, on a free port
+
+    python -m unittest discover -s test
+'''
+import os
+import sys
+import time
+import signal
+import shutil
+import socket
+import urllib2
+import tempfile
+import textwrap
+import threading
+import subprocess
+import unittest
+
+import tornado.web
+
+from bootornado.server import Master
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER = textwrap.dedent('''
+    import os, sys, time, logging
+    sys.path.insert(0, %(root)r)
+    logging.basicConfig(level=logging.INFO)
+    import tornado.web
+    from bootornado.server import Master
+    from sessions.session import SessionMixin
+
+    class Pid(tornado.web.RequestHandler):
+        def get(self):
+            self.write(str(os.getpid()))
+
+    class Slow(tornado.web.RequestHandler):
+        @tornado.web.asynchronous
+        def get(self):
+            io_loop = tornado.ioloop.IOLoop.instance()
+            io_loop.add_timeout(time.time() + float(self.get_argument('seconds')),
+                                lambda: self.finish(str(os.getpid())))
+
+    class Block(tornado.web.RequestHandler):
+        def get(self):
+            time.sleep(float(self.get_argument('seconds')))
+            self.write(str(os.getpid()))
+
+    class Crash(tornado.web.RequestHandler):
+        def get(self):
+            os._exit(1)
+
+    class Session(tornado.web.RequestHandler, SessionMixin):
+        @tornado.web.asynchronous
+        def get(self):
+            value = self.get_argument('value', None)
+            if value:
+                self.session.set('value', value)
+                self.finish(value)
+            else:
+                self.session.get('value', lambda value: self.finish(value or ''))
+
+    application = tornado.web.Application([
+        (r'/pid', Pid), (r'/slow', Slow), (r'/block', Block), (r'/crash', Crash), (r'/session', Session),
+    ], cookie_secret='secret', session={
+        'engine': %(engine)r, 'storage': {'path': %(sessions)r},
+    })
+    Master(application, %(port)d, %(workers)d, %(reuse_port)r).run()
+''')
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class MasterTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.port = free_port()
+        self.master = None
+        self.cookie = None
+
+    def tearDown(self):
+        if self.master is not None and self.master.poll() is None:
+            self.master.send_signal(signal.SIGTERM)
+            if not self.stopped():
+                self.master.kill()
+        shutil.rmtree(self.root)
+
+    def stopped(self, timeout=10):
+        deadline = time.time() + timeout
+        while self.master.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        return self.master.poll() is not None
+
+    def write_script(self, engine='shm', workers=2, reuse_port=False, prelude=''):
+        script = os.path.join(self.root, 'server.py')
+        with open(script, 'w') as f:
+            f.write(prelude)
+            f.write(SERVER % {'root': ROOT, 'engine': engine, 'port': self.port,
+                              'workers': workers, 'reuse_port': reuse_port,
+                              'sessions': os.path.join(self.root, 'sessions')})
+        return script
+
+    def start(self, engine='shm', workers=2, reuse_port=False):
+        script = self.write_script(engine, workers, reuse_port)
+        self.master = subprocess.Popen([sys.executable, script],
+                                       stderr=open(os.path.join(self.root, 'log'), 'w'))
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                return self.get('/pid')
+            except (urllib2.URLError, socket.error):
+                time.sleep(0.05)
+        self.fail('the server did not start')
+
+    def get(self, path, timeout=10):
+        request = urllib2.Request('http://127.0.0.1:%d%s' % (self.port, path))
+        if self.cookie:
+            request.add_header('Cookie', self.cookie)
+        response = urllib2.urlopen(request, timeout=timeout)
+        cookie = response.info().getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';')[0]
+        return response.read()
+
+    def background(self, path):
+        """GETs `path` in a thread, returns the list its response goes to"""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.get(path)))
+        thread.daemon = True
+        thread.start()
+        return result
+
+    def wait_for_new_worker(self, old):
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            pid = self.get('/pid')
+            if pid not in old:
+                return pid
+            time.sleep(0.05)
+        self.fail('the workers were not replaced')
+
+    def pids(self, requests=200):
+        pids = set()
+        for i in range(requests):
+            pids.add(self.get('/pid'))
+        return pids
+
+    def test_blocked_worker_doesnt_stop_the_others(self):
+        self.start(workers=2)
+        blocked = self.background('/block?seconds=1')
+        time.sleep(0.2)
+        started = time.time()
+        pid = self.get('/pid')
+        self.assertTrue(time.time() - started < 0.5)
+        time.sleep(1)
+        self.assertNotEqual(blocked, [pid])
+
+    def test_reuse_port(self):
+        self.start(workers=3, reuse_port=True)
+        # the kernel hashes each new connection to one of the sockets
+        self.assertTrue(len(self.pids()) > 1)
+
+    def test_sessions_shared_between_workers(self):
+        self.start(engine='shm', workers=3, reuse_port=True)
+        self.get('/session?value=shared')
+        for i in range(20):
+            self.assertEqual(self.get('/session'), 'shared')
+
+    def test_crashed_worker_restarted(self):
+        self.start(workers=1)
+        old = self.get('/pid')
+        self.assertRaises(Exception, self.get, '/crash')
+        self.assertNotEqual(self.wait_for_new_worker([old]), old)
+
+    def test_reload_finishes_in_flight_requests(self):
+        old = self.start(workers=1)
+        slow = self.background('/slow?seconds=1')
+        time.sleep(0.2)
+        self.master.send_signal(signal.SIGHUP)
+        self.wait_for_new_worker([old])
+        time.sleep(1.5)
+        # answered by the old worker, on the old code
+        self.assertEqual(slow, [old])
+
+    def test_reload_keeps_memory_sessions(self):
+        old = self.start(engine='memory', workers=1)
+        self.get('/session?value=kept')
+        # the old worker is draining this one while the new one would start
+        slow = self.background('/slow?seconds=1')
+        time.sleep(0.2)
+        self.master.send_signal(signal.SIGHUP)
+        self.wait_for_new_worker([old])
+        self.assertEqual(self.get('/session'), 'kept')
+        self.assertEqual(slow, [old])
+
+    def test_reload_of_broken_code_keeps_serving(self):
+        old = set([self.start(workers=1)])
+        self.write_script(workers=1, prelude='def broken(:\n')
+        self.master.send_signal(signal.SIGHUP)
+        time.sleep(1)
+        self.assertEqual(self.master.poll(), None)
+        self.assertEqual(self.pids(20), old)
+        with open(os.path.join(self.root, 'log')) as f:
+            self.assertTrue('SyntaxError' in f.read())
+        # still supervised
+        self.master.send_signal(signal.SIGTERM)
+        self.assertTrue(self.stopped())
+
+    def test_reload_with_failing_workers_keeps_the_old_ones(self):
+        old = set([self.start(workers=1)])
+        # the new code boots, but its workers die before serving
+        self.write_script(workers=1, prelude=textwrap.dedent('''
+            import os, sys
+            sys.path.insert(0, %r)
+            import bootornado.server
+            bootornado.server.serve = lambda *args: os._exit(1)
+        ''' % ROOT))
+        self.master.send_signal(signal.SIGHUP)
+        time.sleep(2)
+        self.assertEqual(self.master.poll(), None)
+        self.assertEqual(self.pids(20), old)
+        # still supervised
+        self.master.send_signal(signal.SIGTERM)
+        self.assertTrue(self.stopped())
+        self.assertRaises(Exception, self.get, '/pid', 1)
+
+    def test_stop_during_reload(self):
+        self.start(engine='memory', workers=1)
+        self.background('/slow?seconds=1')
+        time.sleep(0.2)
+        self.master.send_signal(signal.SIGHUP)
+        time.sleep(0.2)
+        self.master.send_signal(signal.SIGTERM)
+        self.assertTrue(self.stopped())
+
+    def test_memory_sessions_need_one_worker(self):
+        application = tornado.web.Application([], session={'engine': 'memory'})
+        self.assertRaises(ValueError, Master, application, self.port, 2)
+        Master(application, self.port, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+'''
+Tests of sessions.session.SessionManager and the per-user index, served by
+a throwaway application over the "memory" engine
+
+    python -m unittest discover -s test
+'''
+import shutil
+import tempfile
+import unittest
+
+import tornado.web
+import tornado.testing
+
+import bootornado.session
+from bootornado.session import UserIndex, _result
+from sessions.session import SessionMixin
+from sessions.driver import StoreDriver
+
+
+class Login(tornado.web.RequestHandler, SessionMixin):
+    @tornado.web.asynchronous
+    def get(self, user_id):
+        self.session.bind_user(user_id, callback=lambda: self.finish('ok'))
+
+
+class LogoutEverywhere(tornado.web.RequestHandler, SessionMixin):
+    @tornado.web.asynchronous
+    def get(self, user_id):
+        self.session.invalidate_user(user_id, callback=lambda: self.finish('ok'))
+
+
+class Whoami(tornado.web.RequestHandler, SessionMixin):
+    @tornado.web.asynchronous
+    def get(self):
+        self.session.get('_user', lambda user: self.finish(user or 'anonymous'))
+
+
+class SessionTestCase(tornado.testing.AsyncHTTPTestCase):
+    handlers = [
+        (r'/login/(\w+)', Login),
+        (r'/logout-everywhere/(\w+)', LogoutEverywhere),
+        (r'/whoami', Whoami),
+    ]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        super(SessionTestCase, self).setUp()
+
+    def tearDown(self):
+        super(SessionTestCase, self).tearDown()
+        StoreDriver._stores.clear()
+        bootornado.session._snapshot_stores.clear()
+        shutil.rmtree(self.root)
+
+    def get_app(self):
+        return tornado.web.Application(self.handlers, cookie_secret='secret', session={
+            'engine': 'memory',
+            'storage': {'path': self.root},
+        })
+
+    def get(self, path, cookie=None):
+        headers = {'Cookie': cookie} if cookie else {}
+        response = self.fetch(path, headers=headers)
+        self.assertEqual(response.code, 200)
+        return response
+
+    def login(self, user_id):
+        response = self.get('/login/' + user_id)
+        return response.headers['Set-Cookie'].split(';')[0]
+
+
+class UserIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.store = {}
+        self.pending = []
+        def get(key, callback):
+            # answer later, as a networked datastore does
+            self.pending.append(lambda: callback(self.store.get(key)))
+        self.index = UserIndex(get, self.store.__setitem__)
+
+    def call(self, method, *args):
+        result = []
+        method(*args, callback=result.append)
+        self.run_pending()
+        return result[0]
+
+    def run_pending(self):
+        while self.pending:
+            self.pending.pop(0)()
+
+    def test_login_racing_invalidation(self):
+        old = self.call(self.index.add, 'bob', 's0')
+        # a login reads the generation...
+        bound = []
+        self.index.add('bob', 's1', bound.append)
+        self.pending.pop(0)() # the session list
+        self.pending.pop(0)() # the generation
+        # ...then "log out everywhere" completes before the login does
+        self.call(self.index.invalidate, 'bob')
+        self.run_pending()
+        self.assertEqual(bound, [old])
+        self.assertFalse(self.call(self.index.is_current, 'bob', old))
+
+    def test_expired_record(self):
+        self.call(self.index.invalidate, 'bob')
+        generation = self.call(self.index.add, 'bob', 's1')
+        self.assertTrue(self.call(self.index.is_current, 'bob', generation))
+        # the datastore expired the user record
+        for key in list(self.store):
+            del self.store[key]
+        self.assertTrue(self.call(self.index.is_current, 'bob', generation))
+        # and a later invalidation still ends the session
+        self.call(self.index.invalidate, 'bob')
+        self.assertFalse(self.call(self.index.is_current, 'bob', generation))
+
+    def test_sessions(self):
+        for session_id in ('a', 'b', 'a'):
+            self.call(self.index.add, 'bob', session_id)
+        self.index.remove('bob', 'a')
+        self.run_pending()
+        self.assertEqual(self.call(self.index.sessions, 'bob'), ['b'])
+        self.assertEqual(self.call(self.index.invalidate, 'bob'), ['b'])
+        self.assertEqual(self.call(self.index.sessions, 'bob'), [])
+
+    def test_synchronous_store(self):
+        index = UserIndex.for_store({})
+        generation = _result(index.add, 'bob', 'a')
+        self.assertTrue(_result(index.is_current, 'bob', generation))
+
+
+class LogOutEverywhereTest(SessionTestCase):
+    def test_invalidate_user(self):
+        laptop = self.login('bob')
+        phone = self.login('bob')
+        alice = self.login('alice')
+        self.assertEqual(self.get('/whoami', laptop).body, 'bob')
+        self.get('/logout-everywhere/bob', phone)
+        self.assertEqual(self.get('/whoami', laptop).body, 'anonymous')
+        self.assertEqual(self.get('/whoami', phone).body, 'anonymous')
+        self.assertEqual(self.get('/whoami', alice).body, 'alice')
+        # logging in again works
+        laptop = self.login('bob')
+        self.assertEqual(self.get('/whoami', laptop).body, 'bob')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+'''
+Tests of the session stores of bootornado.session
+
+    python -m unittest discover -s test
+'''
+import os
+import time
+import signal
+import shutil
+import socket
+import tempfile
+import unittest
+
+import tornado.web
+import tornado.ioloop
+import tornado.netutil
+
+from bootornado.session import ExpiryIndex, DiskStore, LogStore, SharedMemoryStore, MemoryStore
+from sessions.driver import DriverFactory
+
+
+class ExpiryIndexTest(unittest.TestCase):
+    def test_pops_only_the_expired(self):
+        index = ExpiryIndex([('a', 10), ('b', 20), ('c', 30)])
+        self.assertEqual(index.expired(15, now=40), ['a', 'b'])
+        self.assertEqual(index.expired(15, now=40), [])
+        self.assertEqual(list(index._atimes), ['c'])
+
+    def test_touch_and_discard(self):
+        index = ExpiryIndex([('a', 10), ('b', 10)])
+        index.touch('a', 35)
+        index.discard('b')
+        self.assertEqual(index.expired(15, now=40), [])
+        self.assertEqual((len(index), 'a' in index, 'b' in index), (1, True, False))
+
+    def test_stale_entries_bounded(self):
+        index = ExpiryIndex()
+        for i in xrange(10000):
+            index.touch('a', i)
+        self.assertTrue(len(index._heap) <= 2 * len(index) + 1024)
+        self.assertEqual(index.expired(1, now=10000), [])
+        self.assertEqual(index.expired(1, now=10001), ['a'])
+
+
+class DiskStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_cleanup_indexes_existing_files(self):
+        s = DiskStore(self.root)
+        s['a'] = 'foo'
+        old = time.time() - 100
+        os.utime(os.path.join(self.root, 'a'), (old, old))
+        s = DiskStore(self.root)
+        s['b'] = 'bar'
+        s.cleanup(50)
+        self.assertEqual(sorted(os.listdir(self.root)), ['b'])
+
+    def test_cleanup_keeps_sessions_used_by_another_process(self):
+        s = DiskStore(self.root)
+        s['a'] = 'foo'
+        time.sleep(0.02)
+        # read through another store meanwhile
+        now = time.time()
+        os.utime(os.path.join(self.root, 'a'), (now, now))
+        s.cleanup(0.01)
+        self.assertEqual(s['a'], 'foo')
+
+
+class LogStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'sessions.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def reopen(self, s, **kwargs):
+        s.close()
+        return LogStore(self.path, **kwargs)
+
+    def test_replayed_on_open(self):
+        s = LogStore(self.path)
+        s['a'] = {'user': 'bob'}
+        s['b'] = 'x'
+        s['a'] = {'user': 'alice'}
+        del s['b']
+        s = self.reopen(s)
+        self.assertEqual(s['a'], {'user': 'alice'})
+        self.assertFalse('b' in s)
+        s.close()
+
+    def test_reads_dont_write(self):
+        s = LogStore(self.path)
+        s['a'] = 'foo'
+        size = os.path.getsize(self.path)
+        s['a']
+        self.assertEqual(os.path.getsize(self.path), size)
+        s.close()
+
+    def test_torn_record_dropped(self):
+        s = LogStore(self.path)
+        s['a'] = 'foo'
+        s.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write('\x00\x01\x02') # a crash in the middle of an append
+        s = LogStore(self.path)
+        self.assertEqual(s['a'], 'foo')
+        self.assertEqual(os.path.getsize(self.path), size)
+        s['b'] = 'bar'
+        s = self.reopen(s)
+        self.assertEqual((s['a'], s['b']), ('foo', 'bar'))
+        s.close()
+
+    def test_bad_checksum_ends_the_log(self):
+        s = LogStore(self.path)
+        s['a'] = 'foo'
+        size = os.path.getsize(self.path)
+        s['b'] = 'bar'
+        s.close()
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write('X')
+        s = LogStore(self.path)
+        self.assertEqual(s['a'], 'foo')
+        self.assertFalse('b' in s)
+        self.assertEqual(os.path.getsize(self.path), size)
+        s.close()
+
+    def test_compact(self):
+        s = LogStore(self.path, compact_min_bytes=1 << 30)
+        for i in range(100):
+            s['a'] = 'x' * i
+        s['b'] = 'keep'
+        del s['b']
+        s['c'] = 'c'
+        size = os.path.getsize(self.path)
+        s.compact()
+        self.assertTrue(os.path.getsize(self.path) < size / 10)
+        self.assertEqual((s['a'], s['c']), ('x' * 99, 'c'))
+        s['d'] = 'after'
+        s = self.reopen(s)
+        self.assertEqual((s['a'], s['c'], s['d']), ('x' * 99, 'c', 'after'))
+        self.assertFalse('b' in s)
+        s.close()
+
+    def test_compacted_in_background(self):
+        s = LogStore(self.path, compact_min_bytes=1024)
+        for i in range(200):
+            s['a'] = 'x' * 100
+        s.close() # waits for the compaction
+        self.assertTrue(os.path.getsize(self.path) < 200 * 100)
+        self.assertFalse(os.path.exists(self.path + '.compact'))
+        s = LogStore(self.path)
+        self.assertEqual(s['a'], 'x' * 100)
+        s.close()
+
+    def test_cleanup(self):
+        s = LogStore(self.path)
+        s['old'] = 1
+        time.sleep(0.02)
+        s['new'] = 2
+        s.cleanup(0.01)
+        self.assertEqual(('old' in s, 'new' in s), (False, True))
+        s = self.reopen(s)
+        self.assertFalse('old' in s)
+        s.close()
+
+    def test_refuses_shared_directory(self):
+        os.chmod(self.root, 0777)
+        self.assertRaises(OSError, LogStore, self.path)
+
+
+class SharedMemoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'sessions.shm')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_shared_between_stores(self):
+        writer = SharedMemoryStore(self.path, slots=64)
+        reader = SharedMemoryStore(self.path, slots=64)
+        writer['a'] = {'user': 'bob'}
+        self.assertEqual(reader['a'], {'user': 'bob'})
+        del reader['a']
+        self.assertFalse('a' in writer)
+
+    def test_overflow_chain(self):
+        s = SharedMemoryStore(self.path, slots=64, slot_size=128)
+        s['big'] = 'x' * 5000
+        s['small'] = 'y'
+        self.assertEqual(s['big'], 'x' * 5000)
+        s['big'] = 'z'
+        self.assertEqual(s['big'], 'z')
+        self.assertEqual(s['small'], 'y')
+
+    def test_refuses_file_others_can_write(self):
+        with open(self.path, 'wb') as f:
+            f.write('\0' * 100)
+        os.chmod(self.path, 0666)
+        self.assertRaises(OSError, SharedMemoryStore, self.path, slots=64)
+
+    def test_refuses_shared_directory(self):
+        os.chmod(self.root, 0777)
+        self.assertRaises(OSError, SharedMemoryStore, self.path, slots=64)
+
+    def test_reopen_stale_file(self):
+        # a file without the header, e.g. left by a crash before it was written
+        with open(self.path, 'wb') as f:
+            f.write('\0' * 100)
+        s = SharedMemoryStore(self.path, slots=64)
+        s['a'] = 'foo'
+        self.assertEqual(s['a'], 'foo')
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(8), SharedMemoryStore.MAGIC)
+        # reopening must keep the table, not initialize it again
+        self.assertEqual(SharedMemoryStore(self.path, slots=64)['a'], 'foo')
+
+    def test_other_geometry(self):
+        SharedMemoryStore(self.path, slots=64)
+        self.assertRaises(ValueError, SharedMemoryStore, self.path, slots=128)
+
+    def test_cleanup(self):
+        s = SharedMemoryStore(self.path, slots=64)
+        s['old'] = 1
+        time.sleep(0.02)
+        s['new'] = 2
+        s.cleanup(0.01)
+        self.assertFalse('old' in s)
+        self.assertEqual(s['new'], 2)
+
+    def test_full_table_sweeps_expired(self):
+        s = SharedMemoryStore(self.path, slots=4, ttl=0.01)
+        for key in 'abcd':
+            s[key] = key
+        time.sleep(0.02)
+        s['e'] = 'e'
+        self.assertEqual(s['e'], 'e')
+
+    def test_driver_maps_once_per_process(self):
+        settings = {'path': self.root, 'slots': 64}
+        first = DriverFactory().create('shm', settings, 'db_sessions')
+        second = DriverFactory().create('shm', settings, 'db_sessions')
+        first.set('a', {'n': 1})
+        self.assertEqual(second.get('a'), {'n': 1})
+        self.assertTrue(first.client is second.client)
+
+
+class MemoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        # the directory doesn't exist yet, as on a fresh /dev/shm
+        self.path = os.path.join(self.root, 'bootornado', 'db_sessions.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_dump_to_missing_directory(self):
+        s = MemoryStore(self.path)
+        s['a'] = {'user': 'bob'}
+        s.dump()
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(os.stat(os.path.dirname(self.path)).st_mode & 0777, 0700)
+
+    def test_refuses_shared_directory(self):
+        # anyone able to write there could plant a snapshot we'd unpickle
+        os.mkdir(os.path.dirname(self.path))
+        os.chmod(os.path.dirname(self.path), 0777)
+        self.assertRaises(OSError, MemoryStore, self.path)
+
+    def test_warm_load(self):
+        s = MemoryStore(self.path)
+        s['a'] = 'foo'
+        s['b'] = 'x' * 5000
+        s.dump()
+        s = MemoryStore(self.path)
+        self.assertEqual((s['a'], s['b']), ('foo', 'x' * 5000))
+        # a crash now can't bring back sessions deleted after the snapshot
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_expired_sessions_not_loaded(self):
+        s = MemoryStore(self.path)
+        s['a'] = 'foo'
+        s.dump()
+        time.sleep(0.02)
+        self.assertFalse('a' in MemoryStore(self.path, timeout=0.01))
+
+    def test_dumped_on_sigterm(self):
+        import bootornado.server
+        sock, = tornado.netutil.bind_sockets(0, '127.0.0.1', family=socket.AF_INET)
+        pid = os.fork()
+        if not pid:
+            try:
+                # a fresh IOLoop, not the one the parent may have made
+                tornado.ioloop.IOLoop._instance = tornado.ioloop.IOLoop()
+                store = MemoryStore(self.path)
+                store['a'] = 'foo'
+                bootornado.server.serve(tornado.web.Application(), [sock])
+            finally:
+                os._exit(0)
+        time.sleep(0.3)
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        sock.close()
+        self.assertEqual(MemoryStore(self.path)['a'], 'foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+'''
+Tests of what starting the application costs: the imports it defers, and
+the startup-profile command. Each runs a fresh interpreter.
+
+    python -m unittest discover -s test
+'''
+import os
+import sys
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def python(*args):
+    process = subprocess.Popen((sys.executable,) + args, cwd=ROOT,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise AssertionError(output)
+    return output
+
+
+class LazyImportTest(unittest.TestCase):
+    def imported(self, statement, modules):
+        output = python('-c', 'import sys; %s; print [m for m in %r if m in sys.modules]'
+                        % (statement, modules))
+        return eval(output.splitlines()[-1])
+
+    def test_import_is_cheap(self):
+        self.assertEqual(self.imported('import bootornado', (
+            'pygments', 'redis', 'tornadoredis', 'tornado.options', 'bootornado.views')), [])
+
+    def test_views_imported_with_the_application(self):
+        self.assertEqual(self.imported('import bootornado; bootornado.Application()', (
+            'bootornado.views', 'pygments', 'tornadoredis')), ['bootornado.views'])
+
+
+class StartupProfileTest(unittest.TestCase):
+    def test_report(self):
+        output = python('app.py', '--cmd=startup-profile')
+        lines = output.splitlines()
+        self.assertEqual(lines[0].split(), ['cumulative', 'self', 'peak', 'rss', 'module'])
+        self.assertTrue(any(line.endswith('  bootornado') for line in lines))
+        self.assertTrue(lines[-1].startswith('imports '))
+        self.assertTrue(', application ' in lines[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+'''
+Tests of bootornado.staticfiles, serving a throwaway static directory
+
+    python -m unittest discover -s test
+'''
+import os
+import gzip
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+
+import tornado.web
+import tornado.ioloop
+import tornado.testing
+
+from bootornado.staticfiles import StaticFileHandler
+
+
+class RecordingHandler(StaticFileHandler):
+    unmapped = []
+
+    def unmap(self):
+        if getattr(self, '_mapped', None) is not None:
+            self.unmapped.append(self._mapped)
+        StaticFileHandler.unmap(self)
+
+
+class StaticFileHandlerTest(tornado.testing.AsyncHTTPTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('site.css', 'a { color: red }')
+        with open(os.path.join(self.root, 'site.css.gz'), 'wb') as f:
+            with gzip.GzipFile('', 'wb', 9, f, mtime=0) as gz:
+                gz.write('a { color: red }')
+        self.write('plain.css', 'b { color: blue }')
+        self.write('logo.png', 'png')
+        self.big = os.urandom(1024) * (5 * 1024)
+        self.write('big.bin', self.big)
+        del RecordingHandler.unmapped[:]
+        super(StaticFileHandlerTest, self).setUp()
+
+    def tearDown(self):
+        super(StaticFileHandlerTest, self).tearDown()
+        StaticFileHandler._files.clear()
+        StaticFileHandler._hot.clear()
+        shutil.rmtree(self.root)
+
+    def get_new_ioloop(self):
+        return tornado.ioloop.IOLoop.instance()
+
+    def get_app(self):
+        return tornado.web.Application(static_path=self.root,
+                                       static_handler_class=RecordingHandler)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+
+    def get(self, name, accept=None, **headers):
+        if accept is not None:
+            headers['Accept-Encoding'] = accept
+        return self.fetch('/static/' + name, headers=headers, use_gzip=False)
+
+    def test_precompressed_variant(self):
+        response = self.get('site.css', 'gzip, deflate')
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(response.headers.get('Vary'), 'Accept-Encoding')
+        self.assertEqual(response.body[:2], '\x1f\x8b')
+
+    def test_refused_encoding(self):
+        for accept in ('gzip;q=0', 'gzip; q=0.0, identity', '*;q=0', ''):
+            response = self.get('site.css', accept)
+            self.assertEqual(response.headers.get('Content-Encoding'), None, accept)
+            self.assertEqual(response.body, 'a { color: red }')
+            self.assertEqual(response.headers.get('Vary'), 'Accept-Encoding')
+
+    def test_wildcard_and_qvalues(self):
+        for accept in ('*', 'br;q=0.5, gzip;q=0.8', 'GZIP'):
+            self.assertEqual(self.get('site.css', accept).headers.get('Content-Encoding'),
+                             'gzip', accept)
+
+    def test_vary_without_variant(self):
+        # the compression transform may compress it for another client
+        self.assertEqual(self.get('plain.css').headers.get('Vary'), 'Accept-Encoding')
+        self.assertEqual(self.get('logo.png').headers.get('Vary'), None)
+
+    def test_not_modified_keeps_vary(self):
+        etag = self.get('site.css', 'gzip').headers['Etag']
+        response = self.get('site.css', 'gzip', **{'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.headers.get('Vary'), 'Accept-Encoding')
+
+    def test_mapped_file_streamed(self):
+        response = self.get('big.bin')
+        self.assertEqual(response.body, self.big)
+        mapped, = RecordingHandler.unmapped
+        self.assertRaises(ValueError, lambda: mapped[0]) # closed
+
+    def test_mapped_file_unmapped_on_disconnect(self):
+        client = socket.create_connection(('127.0.0.1', self.get_http_port()))
+        client.sendall('GET /static/big.bin HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        self.io_loop.add_timeout(time.time() + 0.2, self.stop)
+        self.wait()
+        self.assertEqual(RecordingHandler.unmapped, [])
+        client.recv(1024)
+        client.close()
+        self.io_loop.add_timeout(time.time() + 0.2, self.stop)
+        self.wait()
+        mapped, = RecordingHandler.unmapped
+        self.assertRaises(ValueError, lambda: mapped[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
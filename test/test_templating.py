@@ -0,0 +1,74 @@
+'''
+Tests of bootornado.templating
+
+    python -m unittest discover -s test
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from bootornado import templating
+
+
+class PersistentLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.templates = os.path.join(self.root, 'templates')
+        self.cache = os.path.join(self.root, 'cache')
+        os.mkdir(self.templates)
+        self.write('base.html', '<b>{% block body %}{% end %}</b>')
+        self.write('page.html', '{% extends "base.html" %}{% block body %}{{ name }}{% end %}')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        with open(os.path.join(self.templates, name), 'w') as f:
+            f.write(content)
+
+    def loader(self):
+        return templating.PersistentLoader(self.templates, self.cache)
+
+    def test_compiled_code_reused(self):
+        self.assertEqual(self.loader().load('page.html').generate(name='bob'), '<b>bob</b>')
+        self.assertEqual(len(os.listdir(self.cache)), 2) # and its parent
+        template = self.loader().load('page.html')
+        self.assertTrue(isinstance(template, templating.CachedTemplate))
+        self.assertEqual(template.generate(name='bob'), '<b>bob</b>')
+
+    def test_change_invalidates(self):
+        self.loader().load('page.html')
+        self.write('base.html', '<i>{% block body %}{% end %}</i>')
+        template = self.loader().load('page.html')
+        self.assertFalse(isinstance(template, templating.CachedTemplate))
+        self.assertEqual(template.generate(name='bob'), '<i>bob</i>')
+
+    def test_cache_is_private(self):
+        self.loader()
+        self.assertEqual(os.stat(self.cache).st_mode & 0777, 0700)
+
+    def test_refuses_shared_cache(self):
+        # a directory others can write to could hold planted code
+        os.mkdir(self.cache)
+        os.chmod(self.cache, 0777)
+        self.assertRaises(OSError, self.loader)
+
+    def test_streaming_variant(self):
+        class Handler(object):
+            def __init__(self):
+                self.chunks = []
+            def write(self, chunk):
+                self.chunks.append(chunk)
+            def flush(self):
+                pass
+        handler = Handler()
+        template = templating.streaming(self.loader().load('page.html'))
+        rest = template.generate(name='bob',
+                                 _stream_buffer=lambda: templating.StreamBuffer(handler, 2))
+        self.assertEqual(''.join(handler.chunks) + rest, '<b>bob</b>')
+        self.assertTrue(len(handler.chunks) > 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
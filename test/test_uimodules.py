@@ -0,0 +1,91 @@
+'''
+Tests of bootornado.uimodules
+
+    python -m unittest discover -s test
+'''
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import tornado.web
+import tornado.testing
+
+from bootornado.uimodules import CachedFragment
+
+
+class Page(tornado.web.RequestHandler):
+    def get_current_user(self):
+        return self.get_argument('user', None)
+
+    def get(self):
+        self.render('page.html')
+
+
+class FragmentTestCase(tornado.testing.AsyncHTTPTestCase):
+    debug = False
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'page.html'), 'w') as f:
+            f.write('<{% module CachedFragment("fragment.html", key=handler.get_argument("key", None), '
+                    'ttl=float(handler.get_argument("ttl", 60)), vary_user=True, '
+                    'value=handler.get_argument("value")) %}>')
+        with open(os.path.join(self.root, 'fragment.html'), 'w') as f:
+            f.write('{{ value }}')
+        super(FragmentTestCase, self).setUp()
+
+    def tearDown(self):
+        super(FragmentTestCase, self).tearDown()
+        CachedFragment.invalidate()
+        shutil.rmtree(self.root)
+
+    def get_app(self):
+        return tornado.web.Application([(r'/', Page)], template_path=self.root, debug=self.debug,
+                                       ui_modules={'CachedFragment': CachedFragment})
+
+    def get(self, **arguments):
+        query = '&'.join('%s=%s' % item for item in arguments.items())
+        return self.fetch('/?' + query).body
+
+
+class CachedFragmentTest(FragmentTestCase):
+    def test_rendered_once(self):
+        self.assertEqual(self.get(value=1), '<1>')
+        # the arguments aren't part of the key
+        self.assertEqual(self.get(value=2), '<1>')
+
+    def test_key(self):
+        self.assertEqual(self.get(value=1, key='a'), '<1>')
+        self.assertEqual(self.get(value=2, key='b'), '<2>')
+        self.assertEqual(self.get(value=3, key='a'), '<1>')
+
+    def test_vary_user(self):
+        self.assertEqual(self.get(value=1, user='bob'), '<1>')
+        self.assertEqual(self.get(value=2, user='alice'), '<2>')
+        self.assertEqual(self.get(value=3, user='bob'), '<1>')
+        self.assertEqual(self.get(value=4), '<4>')
+
+    def test_expired(self):
+        self.assertEqual(self.get(value=1, ttl=0.1), '<1>')
+        time.sleep(0.2)
+        self.assertEqual(self.get(value=2, ttl=0.1), '<2>')
+
+    def test_invalidate(self):
+        self.get(value=1)
+        CachedFragment.invalidate()
+        self.assertEqual(self.get(value=2), '<2>')
+
+
+class DebugCachedFragmentTest(FragmentTestCase):
+    debug = True
+
+    def test_rendered_every_time(self):
+        self.assertEqual(self.get(value=1), '<1>')
+        self.assertEqual(self.get(value=2), '<2>')
+        self.assertEqual(len(CachedFragment.cache.data), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+'''
+Tests of bootornado.watchdog, blocking the IOLoop on purpose
+
+    python -m unittest discover -s test
+'''
+import time
+import logging
+import unittest
+
+import tornado.web
+
+from bootornado.metrics import Registry
+from bootornado.watchdog import Watchdog
+from test_handlers import HandlerTestCase
+
+
+class Blocking(tornado.web.RequestHandler):
+    def get(self):
+        time.sleep(float(self.get_argument('seconds')))
+        self.finish('done')
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class WatchdogTest(HandlerTestCase):
+    handlers = [(r'/blocking', Blocking)]
+
+    def setUp(self):
+        super(WatchdogTest, self).setUp()
+        self.records = Records()
+        logging.getLogger().addHandler(self.records)
+        self.watchdog = Watchdog(self._app, threshold=0.1, io_loop=self.io_loop)
+        self.watchdog.start()
+        self.pause(0.1) # for the first heartbeat
+
+    def tearDown(self):
+        self.watchdog.stop()
+        logging.getLogger().removeHandler(self.records)
+        super(WatchdogTest, self).tearDown()
+
+    def get_app(self):
+        application = super(WatchdogTest, self).get_app()
+        application.metrics = Registry()
+        application.route_names = {Blocking: 'test.blocking'}
+        return application
+
+    def pause(self, seconds):
+        self.io_loop.add_timeout(time.time() + seconds, self.stop)
+        self.wait()
+
+    def test_blocking_handler_reported(self):
+        self.assertEqual(self.get('/blocking?seconds=0.4').body, 'done')
+        self.pause(0.1)
+        self.assertEqual(self.watchdog.stalls, 1)
+        blocked, recovered = self.records.messages
+        self.assertTrue(blocked.startswith('IOLoop blocked for 0.'), blocked)
+        self.assertTrue('in test.blocking (GET /blocking?seconds=0.4):' in blocked)
+        self.assertTrue('time.sleep' in blocked) # the stack
+        self.assertTrue(recovered.startswith('IOLoop was blocked for 0.'), recovered)
+        self.assertTrue(recovered.endswith('in test.blocking (GET /blocking?seconds=0.4)'))
+
+    def test_callback_outside_handler(self):
+        self.io_loop.add_callback(lambda: time.sleep(0.3))
+        self.pause(0.2)
+        self.assertEqual(self.watchdog.stalls, 1)
+        self.assertTrue('in a callback outside any handler' in self.records.messages[0])
+
+    def test_short_callbacks_ignored(self):
+        self.get('/blocking?seconds=0.02')
+        self.pause(0.2)
+        self.assertEqual(self.watchdog.stalls, 0)
+        self.assertEqual(self.records.messages, [])
+
+    def test_lag_recorded(self):
+        recorded = self._app.metrics.loop_lag.count
+        self.get('/blocking?seconds=0.3')
+        self.pause(0.1)
+        self.assertTrue(self._app.metrics.loop_lag.count > recorded)
+        self.assertTrue(self._app.metrics.loop_lag.count_below(0.2 * 1e6) <
+                        self._app.metrics.loop_lag.count)
+
+
+if __name__ == '__main__':
+    unittest.main()